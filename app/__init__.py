@@ -6,6 +6,14 @@ from app.extensions import db, csrf
 from app.models.user import User  # Import User model
 from config import Config
 from app.services.auto_tasks import auto_generate_and_apply_config
+from app.services.expiry_scheduler import expiry_scheduler
+from app.services.change_debouncer import config_debouncer
+from app.services.live_stream import log_stream, stats_stream
+from app.services.log_store import log_store
+from app.services.traffic_rollup import traffic_rollup
+from app.services.heavy_hitters import heavy_hitters
+from app.services.whitelist_suggestions import denied_traffic
+from app.services.allowlist_usage import allowlist_usage
 from app.services.bandwidth_history_service import BandwidthHistoryService
 from datetime import datetime
 
@@ -36,6 +44,8 @@ def create_app():
     # Register custom filter
     @app.template_filter('strftime')
     def format_datetime(value, format='%d-%m-%Y'):
+        if isinstance(value, (int, float)):
+            value = datetime.fromtimestamp(value)
         if isinstance(value, datetime):
             return value.strftime(format)
         return value
@@ -53,14 +63,15 @@ def create_app():
     scheduler.init_app(app)
     scheduler.start()
 
-    # Định nghĩa job định kỳ - Auto generate config
-    scheduler.add_job(
-        id='daily_generate_and_apply_config',
-        func=lambda: auto_generate_and_apply_config(app),  # Truyền app vào hàm
-        trigger='cron',
-        hour=app.config['JOB_HOUR'],  # Lấy giờ từ config
-        minute=app.config['JOB_MINUTE']  # Lấy phút từ config
-    )
+    if not app.config.get('EXPIRY_SCHEDULING', True):
+        # Định nghĩa job định kỳ - Auto generate config
+        scheduler.add_job(
+            id='daily_generate_and_apply_config',
+            func=lambda: auto_generate_and_apply_config(app),  # Truyền app vào hàm
+            trigger='cron',
+            hour=app.config['JOB_HOUR'],  # Lấy giờ từ config
+            minute=app.config['JOB_MINUTE']  # Lấy phút từ config
+        )
     
     # Định nghĩa job định kỳ - Bandwidth tracking (mỗi 5 phút)
     scheduler.add_job(
@@ -105,10 +116,33 @@ def create_app():
     app.register_blueprint(whitelist_bp)
 
     # Import all models to ensure they are registered before create_all
-    from app.models import Client, GlobalDomainWhitelist, GlobalIPWhitelist, DomainTemplate
+    from app.models import Client, GlobalDomainWhitelist, GlobalIPWhitelist, DomainTemplate, ReloadEvent
     
     # Create database tables (if not exist)
     with app.app_context():
         db.create_all()
+        # create_all() does not add indexes to tables that already exist
+        for index in Client.__table__.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+    if app.config.get('EXPIRY_SCHEDULING', True):
+        # Regenerate exactly when the next client expires instead of once a day
+        expiry_scheduler.init_app(app, scheduler)
+
+    # Coalesce edits into one generate/apply/reload (only if AUTO_APPLY_ON_CHANGE)
+    config_debouncer.init_app(app, scheduler)
+
+    # Shared producers behind the SSE endpoints (started on first subscriber)
+    stats_stream.init_app(app)
+    log_stream.init_app(app)
+
+    # Ingest the access log into the indexed log store (LOG_STORE_ENABLED),
+    # folding every batch into the per-client hourly rollups, top-K tables,
+    # the denied hosts behind the whitelist suggestions and allowlist last hits
+    log_store.register(traffic_rollup)
+    log_store.register(heavy_hitters)
+    log_store.register(denied_traffic)
+    log_store.register(allowlist_usage)
+    log_store.init_app(app, scheduler)
 
     return app
\ No newline at end of file
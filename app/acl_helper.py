@@ -0,0 +1,251 @@
+"""
+Squid external ACL helper backed by an in-memory policy index.
+
+Answers Squid's "may this client reach this destination" lookups straight from
+the Squid Manager database, so client changes take effect without regenerating
+files or reloading Squid. The index (IP prefix index + domain suffix tries) is
+rebuilt in a background thread whenever the SQLite file changes or the date
+rolls over, and swapped in with a single reference assignment.
+
+squid.conf example (Squid starts helpers in its own working directory, so the
+script is given by absolute path and finds the project from its location):
+
+    external_acl_type squidman ttl=60 negative_ttl=10 children-max=2 concurrency=50 \\
+        %SRC %DST /opt/squid-manager/venv/bin/python /opt/squid-manager/app/acl_helper.py \\
+        --db /opt/squid-manager/db/squid_manager.db
+    acl squidman_allowed external squidman
+    http_access allow squidman_allowed
+
+Benchmark against a synthetic dataset:
+
+    python -m app.acl_helper --benchmark --clients 10000
+"""
+import argparse
+import logging
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from datetime import date
+from urllib.parse import unquote
+
+if __package__ in (None, ''):
+    # Run by path (as Squid does) rather than with -m: make the project importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config, basedir
+from app.utils import DomainSuffixTrie, IPPrefixIndex
+
+
+class PolicyIndex:
+    """Immutable snapshot of the access policy, built once and then only read."""
+
+    def __init__(self, built_for):
+        self.built_for = built_for            # date the expiry filter was applied for
+        self.vip = IPPrefixIndex()            # source networks allowed everything
+        self.clients = IPPrefixIndex()        # source network -> DomainSuffixTrie
+        self.global_domains = DomainSuffixTrie()
+        self.global_ips = IPPrefixIndex()     # destination networks allowed for everybody
+
+    @classmethod
+    def from_rows(cls, clients, global_domains, global_ips, today=None):
+        """
+        Build an index from plain rows:
+        clients: (ip_address, allowed_domains, expiration_date 'YYYY-MM-DD' or date),
+        global_domains: domain strings, global_ips: IP/CIDR strings.
+        """
+        today = today or date.today()
+        index = cls(today)
+        today_iso = today.isoformat()
+        for ip, allowed, expiration in clients:
+            if str(expiration)[:10] < today_iso:
+                continue
+            try:
+                if (allowed or '').strip().upper() == 'ANY':
+                    index.vip.add(ip)
+                else:
+                    domains = [d for d in (allowed or '').split('\n') if d.strip()]
+                    index.clients.add(ip, DomainSuffixTrie(domains))
+            except ValueError:
+                logging.warning(f"acl_helper: skipping invalid client address {ip}")
+        for domain in global_domains:
+            index.global_domains.add(domain)
+        for ip in global_ips:
+            try:
+                index.global_ips.add(ip)
+            except ValueError:
+                logging.warning(f"acl_helper: skipping invalid global IP {ip}")
+        return index
+
+    def is_allowed(self, src, dst):
+        """True if a request from src to dst host is allowed by the policy."""
+        if self.vip.lookup(src) is not None:
+            return True
+        host = dst.strip().lower().rstrip('.')
+        if host.startswith('[') and host.endswith(']'):
+            host = host[1:-1]
+        if self.global_domains.find_cover(host) is not None:
+            return True
+        if self.global_ips.lookup(host) is not None:
+            return True
+        domains = self.clients.lookup(src)
+        return domains is not None and domains.find_cover(host) is not None
+
+
+def sqlite_path(uri=None):
+    """
+    Filesystem path of the SQLite database configured for the web app. A
+    relative path is taken from the project directory, as in config.py, never
+    from the working directory Squid starts the helper in.
+    """
+    uri = uri or Config.SQLALCHEMY_DATABASE_URI
+    if not uri.startswith('sqlite:///'):
+        raise ValueError(f"acl_helper only supports SQLite databases, got {uri}")
+    return os.path.join(basedir, uri.replace('sqlite:///', '', 1))
+
+
+def load_index(db_path, today=None):
+    """Read clients and global whitelists with a read-only connection and build an index."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        clients = conn.execute("SELECT ip_address, allowed_domains, expiration_date FROM client").fetchall()
+        domains = [row[0] for row in conn.execute("SELECT domain FROM global_domain_whitelist")]
+        ips = [row[0] for row in conn.execute("SELECT ip_address FROM global_ip_whitelist")]
+    finally:
+        conn.close()
+    return PolicyIndex.from_rows(clients, domains, ips, today)
+
+
+class IndexHolder:
+    """Holds the current PolicyIndex and hot-swaps it when the DB file changes."""
+
+    def __init__(self, db_path, poll_seconds=5):
+        self.db_path = db_path
+        self.poll_seconds = poll_seconds
+        self._stamp = self._db_stamp()
+        try:
+            self.index = load_index(db_path)
+        except sqlite3.Error as e:
+            # Answer ERR for everything until the DB becomes readable
+            logging.error(f"acl_helper: cannot load {db_path}: {e}")
+            self.index = PolicyIndex(date.today())
+            self._stamp = None
+
+    def _db_stamp(self):
+        # Commits touch the main file (rollback journal) or the -wal file (WAL mode)
+        stamp = []
+        for path in (self.db_path, f"{self.db_path}-wal"):
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def refresh_if_changed(self):
+        stamp = self._db_stamp()
+        if stamp == self._stamp and self.index.built_for == date.today():
+            return False
+        try:
+            new_index = load_index(self.db_path)
+        except sqlite3.Error as e:
+            logging.error(f"acl_helper: reload failed, keeping previous index: {e}")
+            return False
+        self.index = new_index
+        self._stamp = stamp
+        logging.info("acl_helper: policy index reloaded")
+        return True
+
+    def watch(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            self.refresh_if_changed()
+
+    def start(self):
+        threading.Thread(target=self.watch, name='acl-helper-reload', daemon=True).start()
+
+
+def handle_line(holder, line):
+    """
+    Answer one helper request line. With concurrency enabled Squid prefixes a
+    channel ID (``ID SRC DST``), which is echoed back in the reply.
+    """
+    tokens = line.split()
+    channel = ''
+    if len(tokens) == 3:
+        channel = tokens[0] + ' '
+        tokens = tokens[1:]
+    if len(tokens) != 2:
+        return f"{channel}BH message=\"expected: [channel] src dst\""
+    src, dst = (unquote(t) for t in tokens)
+    return f"{channel}{'OK' if holder.index.is_allowed(src, dst) else 'ERR'}"
+
+
+def serve(holder, stdin=sys.stdin, stdout=sys.stdout):
+    for line in stdin:
+        if not line.strip():
+            continue
+        stdout.write(handle_line(holder, line) + '\n')
+        stdout.flush()
+
+
+def synthetic_index(n_clients, seed=1):
+    """Policy index for a synthetic dataset, plus sample (src, dst) pairs."""
+    rng = random.Random(seed)
+    pool = [f".site{i}.example{i % 50}.com" for i in range(5000)]
+    clients = []
+    for i in range(n_clients):
+        ip = f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+        allowed = 'ANY' if i % 100 == 0 else '\n'.join(rng.sample(pool, 20))
+        clients.append((ip, allowed, '2999-12-31'))
+    global_domains = [f".global{i}.org" for i in range(500)]
+    global_ips = [f"172.16.{i}.0/24" for i in range(100)]
+    index = PolicyIndex.from_rows(clients, global_domains, global_ips)
+
+    samples = []
+    for _ in range(10000):
+        ip = clients[rng.randrange(n_clients)][0]
+        host = f"www{rng.choice(pool)}" if rng.random() < 0.7 else f"www.other{rng.randrange(10**6)}.net"
+        samples.append((ip, host))
+    return index, samples
+
+
+def benchmark(n_clients=10000, n_lookups=200000):
+    """Return (build_seconds, lookups_per_second) on a synthetic dataset."""
+    started = time.perf_counter()
+    index, samples = synthetic_index(n_clients)
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for i in range(n_lookups):
+        src, dst = samples[i % len(samples)]
+        index.is_allowed(src, dst)
+    elapsed = time.perf_counter() - started
+    return build_seconds, n_lookups / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Squid external ACL helper for Squid Manager")
+    parser.add_argument('--db', help="SQLite database path (default: from DATABASE_URL)")
+    parser.add_argument('--poll', type=float, default=5, help="seconds between DB change checks")
+    parser.add_argument('--benchmark', action='store_true', help="run the synthetic lookup benchmark and exit")
+    parser.add_argument('--clients', type=int, default=10000, help="synthetic clients for --benchmark")
+    parser.add_argument('--lookups', type=int, default=200000, help="lookups for --benchmark")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        build_seconds, rate = benchmark(args.clients, args.lookups)
+        print(f"index build: {build_seconds:.2f}s for {args.clients} clients")
+        print(f"lookups/sec: {rate:,.0f}")
+        return 0
+
+    holder = IndexHolder(args.db or sqlite_path(), poll_seconds=args.poll)
+    holder.start()
+    serve(holder)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,45 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+import ipaddress
+import logging
+import sqlite3
+from flask import Blueprint, current_app, render_template, request, flash, redirect, url_for, jsonify
 from app.services.client_service import ClientService
+from app.services.domain_template_service import DomainTemplateService
+from app.services.whitelist_service import WhitelistService
+from app.services.whitelist_suggestions import denied_traffic, public_suffix_list
+from app.services.log_store import log_store
+from app.services.traffic_rollup import traffic_rollup
 from flask_login import login_required
 from datetime import datetime
 
 clients_bp = Blueprint('manage_clients', __name__)
 
+def _client_usage(clients, hours):
+    """{client id: usage dict or None} from the hourly rollups, None if the log store is off."""
+    if not log_store.enabled:
+        return None
+    try:
+        usage = traffic_rollup.usage_by_client(hours)
+    except sqlite3.Error as e:
+        logging.error(f"Client usage unavailable: {e}")
+        return None
+    result = {}
+    for client in clients:
+        if '/' in client.ip_address:
+            try:
+                network = ipaddress.ip_network(client.ip_address, strict=False)
+            except ValueError:
+                continue
+            result[client.id] = traffic_rollup.usage_for_network(network, usage, hours)
+        else:
+            result[client.id] = usage.get(client.ip_address)
+    return result
+
 @clients_bp.route('/clients', methods=['GET'])
 @login_required
 def manage_clients():
     clients = ClientService.get_all_clients()
+    usage_hours = current_app.config.get('CLIENT_USAGE_HOURS', 24)
+    usage = _client_usage(clients, usage_hours)
 
     client_data = [
         {
@@ -23,12 +54,14 @@ def manage_clients():
             'expiration_date_iso': client.expiration_date.strftime('%Y-%m-%d'), # Sorting/Data
             'allowed_domains': client.allowed_domains.split('\n') if client.allowed_domains else [],
             'days_remaining': (client.expiration_date - datetime.now().date()).days,
-            'expired': (client.expiration_date - datetime.now().date()).days < 0
+            'expired': (client.expiration_date - datetime.now().date()).days < 0,
+            'usage': usage.get(client.id) if usage is not None else None
         }
         for client in clients
     ]
 
-    return render_template('manage_clients.html', active_tab='manage_clients', client_data=client_data)
+    return render_template('manage_clients.html', active_tab='manage_clients', client_data=client_data,
+                           show_usage=usage is not None, usage_hours=usage_hours)
 
 @clients_bp.route('/clients/add', methods=['POST'])
 @login_required
@@ -112,3 +145,34 @@ def nslookup():
     if error:
         return jsonify({'error': error, 'hostname': None}), 404 if "found" in error else 500
     return jsonify({'hostname': hostname})
+
+@clients_bp.route('/api/clients/<int:client_id>/usage', methods=['GET'])
+@login_required
+def client_usage(client_id):
+    """Hourly requests/bytes/denied/domains of one client from the traffic rollups."""
+    client = ClientService.get_client_by_id(client_id)
+    if not log_store.enabled:
+        return jsonify({'error': 'Log store is disabled'}), 404
+    hours = max(1, min(request.args.get('hours', 24, type=int), 24 * 31))
+    try:
+        return jsonify(traffic_rollup.series(client.ip_address, hours))
+    except ValueError:
+        return jsonify({'error': f"Invalid client address {client.ip_address}"}), 400
+
+@clients_bp.route('/api/clients/<int:client_id>/suggestions', methods=['GET'])
+@login_required
+def client_suggestions(client_id):
+    """Ranked domains and templates that would unblock this client's denied traffic."""
+    client = ClientService.get_client_by_id(client_id)
+    if not log_store.enabled:
+        return jsonify({'error': 'Log store is disabled'}), 404
+    allowed = client.allowed_domains.split('\n') if client.allowed_domains else []
+    if any(d.strip().upper() == 'ANY' for d in allowed):
+        return jsonify({'domains': [], 'parents': [], 'templates': []})
+    try:
+        return jsonify(denied_traffic.suggestions(
+            client.ip_address, [d for d in allowed if d.strip()],
+            DomainTemplateService.domain_tries(), WhitelistService.domain_trie(),
+            public_suffix_list(current_app.config.get('PUBLIC_SUFFIX_LIST'))))
+    except ValueError:
+        return jsonify({'error': f"Invalid client address {client.ip_address}"}), 400
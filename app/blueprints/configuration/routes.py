@@ -1,11 +1,87 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, current_app
 from flask_login import login_required
-from app.services.configuration_service import ConfigurationService
+from app.services.configuration_service import ConfigurationService, PIPELINE_BUSY
 from app.services.backup_service import BackupService
+from app.services.domain_template_service import DomainTemplateService
+from app.services.whitelist_service import WhitelistService
 from app.services.system_service import SystemService
+from app.services.expiry_scheduler import expiry_scheduler
+from app.services.change_debouncer import config_debouncer
+from app.services.job_service import JobService
 
 configuration_bp = Blueprint('apply_configuration', __name__)
 
+def _format_policies(result):
+    """One summary line comparing client count with generated policy count."""
+    return (
+        f"• ACL Mode: <strong>{result['acl_mode']}</strong> — "
+        f"{result['valid_count']} clients → <strong>{result['policy_groups']}</strong> policies "
+        f"({result['http_access_rules']} http_access rules)"
+    )
+
+def _format_redundant(redundant, limit=10):
+    """Per-client count of domains dropped because the global whitelist covers them."""
+    if not redundant:
+        return ''
+    top = sorted(redundant.items(), key=lambda item: item[1], reverse=True)
+    shown = ', '.join(f"{ip}: {count}" for ip, count in top[:limit])
+    more = f" (+{len(top) - limit} more clients)" if len(top) > limit else ""
+    return (
+        f"<br>• Covered by Global Whitelist: <strong>{sum(redundant.values())}</strong> entries "
+        f"removed from {len(redundant)} clients<br>&nbsp;&nbsp;{shown}{more}"
+    )
+
+def _format_ip_acls(ip_acls):
+    """Entries in the DB vs. lines written for each src ACL file, with the compression ratio."""
+    parts = []
+    for filename, (entries, written) in ip_acls.items():
+        ratio = f"{entries / written:.1f}x" if written else "n/a"
+        parts.append(f"{filename}: {entries} → {written} ({ratio})")
+    return f"• IP ACLs: {', '.join(parts)}"
+
+def _format_hit_ordering(report):
+    """Estimated http_access rules evaluated per request before/after hit ordering."""
+    if not report:
+        return ''
+    busiest = ', '.join(f"{name}: {hits}" for name, hits in report['busiest'])
+    return (
+        f"<br>• Hit ordering: {report['requests']} logged requests ({report['matched']} matched a client rule), "
+        f"~<strong>{report['avg_rules_before']:.1f}</strong> → <strong>{report['avg_rules_after']:.1f}</strong> "
+        f"rules evaluated per request"
+        + (f"<br>&nbsp;&nbsp;Busiest: {busiest}" if busiest else "")
+    )
+
+def _format_changes(changes, limit=10):
+    """Render the added/changed/removed file set of a generate run as HTML lines."""
+    lines = [
+        f"• Changes: <strong>{len(changes['added'])}</strong> added, "
+        f"<strong>{len(changes['changed'])}</strong> changed, "
+        f"<strong>{len(changes['removed'])}</strong> removed, "
+        f"{changes['unchanged']} unchanged"
+    ]
+    for key in ('added', 'changed', 'removed'):
+        names = changes[key]
+        if names:
+            shown = ', '.join(names[:limit])
+            more = f" (+{len(names) - limit} more)" if len(names) > limit else ""
+            lines.append(f"&nbsp;&nbsp;{key.capitalize()}: {shown}{more}")
+    return '<br>'.join(lines)
+
+def _format_one_click(result):
+    """Summary of a generate/apply/reload run, shared by the form post and the job API."""
+    m1 = result['generate']
+    status = "Applied & Reloaded" if result['reload']['reloaded'] else "Applied (no changes, reload skipped)"
+    return (
+        f"<strong>1-Click Apply Completed!</strong><br>"
+        f"• Generated: {m1['valid_count']} valid, {m1['expired_count']} expired<br>"
+        f"• Global: {m1['global_domains']} domains, {m1['global_ips']} IPs<br>"
+        f"{_format_policies(m1)}{_format_redundant(m1['global_redundant'])}"
+        f"{_format_hit_ordering(m1['hit_ordering'])}<br>"
+        f"{_format_ip_acls(m1['ip_acls'])}<br>"
+        f"{_format_changes(m1['changes'])}<br>"
+        f"• Status: {status}"
+    )
+
 @configuration_bp.route('/apply_configuration', methods=['GET', 'POST'])
 @login_required
 def apply_configuration():
@@ -17,57 +93,94 @@ def apply_configuration():
     if request.method == 'POST':
         action = request.form.get('action')
 
+        # Manual steps share the single-flight lock with 1-Click Apply and the scheduled runs
         if action == 'generate_config':
-            success, result = ConfigurationService.generate_config()
+            with ConfigurationService.single_flight() as acquired:
+                success, result = ConfigurationService.generate_config() if acquired else (False, PIPELINE_BUSY)
             if success:
                 msg = (
                     f"Configuration generated successfully!<br>"
                     f"• Valid Clients: <strong>{result['valid_count']}</strong><br>"
                     f"• Expired Clients: <strong>{result['expired_count']}</strong><br>"
                     f"• Global Domains: <strong>{result['global_domains']}</strong><br>"
-                    f"• Global IPs: <strong>{result['global_ips']}</strong>"
+                    f"• Global IPs: <strong>{result['global_ips']}</strong><br>"
+                    f"{_format_policies(result)}{_format_redundant(result['global_redundant'])}"
+                    f"{_format_hit_ordering(result['hit_ordering'])}<br>"
+                    f"{_format_ip_acls(result['ip_acls'])}<br>"
+                    f"• Read {result['rows']} rows in {result['elapsed']:.2f}s "
+                    f"({result['rows_per_sec']:.0f} rows/sec)<br>"
+                    f"{_format_changes(result['changes'])}"
                 )
                 flash(msg, 'success')
             else:
                 flash(f"Error generating configuration: {result}", 'error')
         
+        elif action == 'benchmark_writes':
+            success, result = ConfigurationService.benchmark_writes()
+            if success:
+                best = min(result['runs'], key=lambda run: run['seconds'])
+                runs = '<br>'.join(
+                    f"&nbsp;&nbsp;{run['workers']} worker(s): {run['seconds']:.3f}s "
+                    f"({run['files_per_sec']:.0f} files/sec)"
+                    for run in result['runs']
+                )
+                flash(
+                    f"Write benchmark for {result['files']} files:<br>{runs}<br>"
+                    f"• Fastest: <strong>{best['workers']}</strong> worker(s) — set CONFIG_WRITE_WORKERS accordingly",
+                    'success'
+                )
+            else:
+                flash(f"Error benchmarking writes: {result}", 'error')
+
         elif action == 'apply_config':
-            success, msg = ConfigurationService.apply_config()
+            with ConfigurationService.single_flight() as acquired:
+                success, msg = ConfigurationService.apply_config() if acquired else (False, PIPELINE_BUSY)
             flash(msg, 'success' if success else 'error')
             
         elif action == 'reload_squid':
-            success, msg = ConfigurationService.reload_squid()
-            flash(msg, 'success' if success else 'error')
-            
+            # Explicit reload always runs, but still records the fingerprint
+            with ConfigurationService.single_flight() as acquired:
+                success, result = ConfigurationService.reload_if_changed(force=True) if acquired else (False, PIPELINE_BUSY)
+            flash(result['message'] if success else result, 'success' if success else 'error')
 
         elif action == 'one_click_apply':
-            try:
-                s1, m1 = ConfigurationService.generate_config()
-                if not s1: raise Exception(m1)
-                
-                s2, m2 = ConfigurationService.apply_config()
-                if not s2: raise Exception(m2)
-                
-                s3, m3 = ConfigurationService.reload_squid()
-                if not s3: raise Exception(m3)
-                
-                
-                msg = (
-                    f"<strong>1-Click Apply Completed!</strong><br>"
-                    f"• Generated: {m1['valid_count']} valid, {m1['expired_count']} expired<br>"
-                    f"• Global: {m1['global_domains']} domains, {m1['global_ips']} IPs<br>"
-                    f"• Status: Applied & Reloaded"
-                )
-                flash(msg, 'success')
-            except Exception as e:
-                flash(f'Error during 1-Click Apply: {e}', 'error')
+            force = request.form.get('force') == 'on'
+            success, result = ConfigurationService.generate_apply_reload(force=force)
+            if success:
+                flash(_format_one_click(result), 'success')
+            else:
+                flash(f'Error during 1-Click Apply: {result}', 'error')
 
         return redirect(url_for('apply_configuration.apply_configuration'))
 
     # Get Squid port for Client Config display
     squid_port = SystemService.get_squid_port()
+    reload_history = ConfigurationService.get_reload_state().get('history', [])
     
-    return render_template('apply_configuration.html', active_tab='apply_configuration', squid_port=squid_port)
+    return render_template('apply_configuration.html', active_tab='apply_configuration', squid_port=squid_port,
+                           last_reload_event=reload_history[0] if reload_history else None,
+                           next_expiry=expiry_scheduler.next_expiry() if expiry_scheduler.enabled else None,
+                           pending_auto_apply=config_debouncer.pending(),
+                           reload_stats=ConfigurationService.reload_latency_stats())
+
+@configuration_bp.route('/apply_configuration/jobs', methods=['POST'])
+@login_required
+def start_apply_job():
+    """API chạy 1-Click Apply trong background, trả về job ID để poll."""
+    force = request.form.get('force') == 'on'
+    job, created = JobService.submit_apply(current_app._get_current_object(), force=force)
+    return jsonify({'job_id': job.id, 'created': created}), 202
+
+@configuration_bp.route('/apply_configuration/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_apply_job(job_id):
+    """API trạng thái job: status, thời gian từng stage, kết quả."""
+    job = JobService.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    data = job.to_dict()
+    data['message'] = _format_one_click(job.result) if job.result else None
+    return jsonify(data)
 
 @configuration_bp.route('/backup/create', methods=['POST'])
 @login_required
@@ -96,4 +209,10 @@ def delete_backup(filename):
 def restore_backup(filename):
     """API restore backup."""
     success, msg = BackupService.restore_backup(filename)
+    if success:
+        # The restored tables bypassed the services, so their caches are stale
+        WhitelistService.reset_domain_trie()
+        DomainTemplateService.reset_domain_tries()
+        if expiry_scheduler.enabled:
+            expiry_scheduler.rebuild(catch_up=True)
     return jsonify({'success': success, 'message': msg})
@@ -1,7 +1,10 @@
-from flask import Blueprint, render_template, redirect, url_for, jsonify, request
+from flask import Blueprint, Response, current_app, render_template, redirect, url_for, jsonify, request
 from app.models.client import Client
 from app.services.system_service import SystemService
 from app.services.bandwidth_history_service import BandwidthHistoryService
+from app.services.live_stream import stats_stream, sse_event
+from app.services.heavy_hitters import TABLES, WINDOWS, heavy_hitters
+from app.services.log_store import log_store
 from sqlalchemy.orm import load_only
 from datetime import datetime
 from flask_login import login_required
@@ -38,6 +41,8 @@ def dashboard():
     squid_reload_time = SystemService.get_squid_log_time("Reloading")
     squid_port = SystemService.get_squid_port()
 
+    top_hitters_enabled = log_store.enabled
+
     # Prepare View Data
     all_client_data = []
     for client in clients:
@@ -73,6 +78,8 @@ def dashboard():
         active_ips=active_ips,
         expired_ips=expired_ips,
         total_domains=total_domains,
+        top_hitters_enabled=top_hitters_enabled,
+        top_windows=list(WINDOWS),
         active_tab='dashboard'
     )
 
@@ -80,6 +87,51 @@ def dashboard():
 def system_stats():
     return SystemService.get_system_stats()
 
+@dashboard_bp.route('/api/system_stats/stream', methods=['GET'])
+@login_required
+def system_stats_stream():
+    """
+    Server-Sent Events version of /api/system_stats: one shared sampler pushes
+    a 'stats' event every STREAM_STATS_INTERVAL seconds to every open dashboard.
+    Answers 503 once STREAM_MAX_SUBSCRIBERS streams are open; the dashboard
+    then falls back to polling.
+    """
+    heartbeat = current_app.config.get('STREAM_HEARTBEAT_SECONDS', 15)
+    sub, _ = stats_stream.subscribe()
+    if sub is None:
+        return jsonify({'error': 'Too many open streams'}), 503
+
+    def events():
+        while True:
+            batch, _ = sub.drain(heartbeat)
+            if batch:
+                # Only the newest sample matters to a client that fell behind
+                yield sse_event(*batch[-1])
+            else:
+                yield ': keepalive\n\n'
+
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs even if the client leaves before the first event is sent
+    response.call_on_close(lambda: stats_stream.unsubscribe(sub))
+    return response
+
+@dashboard_bp.route('/api/top', methods=['GET'])
+@login_required
+def top_hitters():
+    """
+    Heaviest domains, denied domains or client->domain pairs over a sliding
+    window: ?table=domains|denied|pairs&window=1h|24h|7d&n=50.
+    """
+    table = request.args.get('table', 'domains')
+    window = request.args.get('window', '24h')
+    n = max(1, min(request.args.get('n', 50, type=int), 500))
+    if table not in TABLES or window not in WINDOWS:
+        return jsonify({'error': f"table must be one of {', '.join(TABLES)}, window one of {', '.join(WINDOWS)}"}), 400
+    if not log_store.enabled:
+        return jsonify({'error': 'Log store is disabled'}), 404
+    return jsonify({'table': table, 'window': window, 'items': heavy_hitters.top(table, window, n)})
+
 @dashboard_bp.route('/api/bandwidth_history', methods=['GET'])
 def bandwidth_history():
     """API endpoint để lấy bandwidth history data cho chart."""
@@ -1,15 +1,175 @@
-from flask import Blueprint, render_template, request
+import os
+from datetime import datetime
+from flask import Blueprint, Response, current_app, jsonify, render_template, request, stream_with_context
 from flask_login import login_required
-from app.services.log_service import LogService
+from app.services.live_stream import log_stream, sse_event
+from app.services.log_service import AccessLogEntry, LogFilter, LogService, parse_access_line
+from app.services.log_store import log_store
 
 log_bp = Blueprint('log', __name__)
 
+def _epoch(value):
+    """datetime-local input ('YYYY-MM-DDTHH:MM') -> epoch seconds in server local time."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M').timestamp() if value else None
+    except ValueError:
+        return None
+
+def _filters(params):
+    return {
+        'result': params.get('result_filter', '').strip(),
+        'method': params.get('method_filter', '').strip(),
+        'domain': params.get('domain_filter', '').strip(),
+        'since': _epoch(params.get('since', '').strip()),
+        'until': _epoch(params.get('until', '').strip()),
+    }
+
 @log_bp.route('/', methods=['GET', 'POST'])
 @login_required
 def log():
-    ip_filter = request.args.get('ip_filter', '').strip() if request.method == 'GET' else request.form.get('ip_filter', '').strip()
-    status_filter = request.args.get('status_filter', 'ANY').strip() if request.method == 'GET' else request.form.get('status_filter', 'ANY').strip()
+    params = request.args if request.method == 'GET' else request.form
+    ip_filter = params.get('ip_filter', '').strip()
+    status_filter = params.get('status_filter', 'ANY').strip()
+
+    logs, cursor = LogService.get_log_view(ip_filter, status_filter, **_filters(params))
+
+    return render_template('log.html', logs=logs, ip_filter=ip_filter, status_filter=status_filter,
+                           cursor=cursor, active_tab='log')
+
+@log_bp.route('/search')
+@login_required
+def search():
+    """
+    JSON search over the access log (same filters as the Logs page, plus
+    ?limit=), newest first. Answered from the indexed log store when it is in use.
+    """
+    params = request.args
+    limit = min(params.get('limit', 100, type=int), current_app.config.get('LOG_VIEW_LINES', 500))
+    try:
+        log_filter = LogFilter(client=params.get('ip_filter', '').strip(),
+                               status=params.get('status_filter', 'ANY').strip(),
+                               **_filters(params))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if log_store.usable():
+        lines, _ = log_store.search(log_filter, limit=limit)
+        source = 'store'
+    elif os.path.exists(current_app.config.get('SQUID_ACCESS_LOG', '/var/log/squid/access.log')):
+        lines, _ = LogService.search(log_filter, limit=limit)
+        source = 'file'
+    else:
+        return jsonify({'error': 'Access log not available'}), 404
+    entries = [parse_access_line(line) for line in lines]
+    return jsonify({'source': source, 'entries': [e._asdict() for e in entries if e is not None]})
+
+@log_bp.route('/tail')
+@login_required
+def tail():
+    """
+    Access-log lines appended since the cursor (?inode=&offset=), parsed into
+    fields and filtered like the Logs page. Without a cursor, returns the
+    current end of the log so a client can start tailing from there.
+    """
+    params = request.args
+    cursor = LogService.log_cursor() if os.name != 'nt' else None
+    if cursor is None:
+        return jsonify({'error': 'Access log not available'}), 404
+    if 'offset' not in params:
+        return jsonify({**cursor, 'reset': False, 'entries': []})
+    try:
+        log_filter = LogFilter(client=params.get('ip_filter', '').strip(),
+                               status=params.get('status_filter', 'ANY').strip(),
+                               **_filters(params))
+        inode = params.get('inode', type=int)
+        offset = params.get('offset', type=int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(LogService.tail(inode, offset, log_filter))
+
+@log_bp.route('/stream')
+@login_required
+def stream():
+    """
+    Server-Sent Events feed of new access-log lines ('log' events), filtered
+    like the Logs page. All viewers share one tail of the log. Pass the page's
+    cursor (?inode=&offset=) to receive the lines written since it was rendered;
+    a 'reset' event asks the client to reload the page content instead.
+    Answers 503 once STREAM_MAX_SUBSCRIBERS streams are open; the page then
+    falls back to polling /log/tail.
+    """
+    params = request.args
+    try:
+        log_filter = LogFilter(client=params.get('ip_filter', '').strip(),
+                               status=params.get('status_filter', 'ANY').strip(),
+                               **_filters(params))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    inode = params.get('inode', type=int)
+    offset = params.get('offset', type=int)
+    heartbeat = current_app.config.get('STREAM_HEARTBEAT_SECONDS', 15)
+    tail_max = current_app.config.get('LOG_TAIL_MAX_BYTES', 1024 * 1024)
+
+    def matching(entries):
+        return [e for e in entries if log_filter.matches(AccessLogEntry(**e))]
+
+    sub, cursor = log_stream.subscribe(poll_first=offset is not None)
+    if sub is None:
+        return jsonify({'error': 'Too many open streams'}), 503
+
+    def events():
+        if offset is not None:
+            gap = cursor['offset'] - offset if cursor and cursor['inode'] == inode else -1
+            if not 0 <= gap <= tail_max:
+                yield sse_event('reset', {})
+                return
+            if gap:
+                res = LogService.tail(inode, offset, log_filter, max_bytes=gap)
+                yield sse_event('log', {'reset': False, 'entries': res['entries']})
+        while True:
+            batch, dropped = sub.drain(heartbeat)
+            if dropped:
+                # Lines were lost for this client; it reloads rather than show a gap
+                yield sse_event('reset', {'dropped': dropped})
+                return
+            for _, data in batch:
+                entries = matching(data['entries'])
+                if entries or data['reset']:
+                    yield sse_event('log', {'reset': data['reset'], 'entries': entries})
+            if not batch:
+                yield ': keepalive\n\n'
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs even if the client leaves before the first event is sent
+    response.call_on_close(lambda: log_stream.unsubscribe(sub))
+    return response
+
+@log_bp.route('/export')
+@login_required
+def export():
+    """
+    Raw access-log lines of a time window (?since=&until=, plus the Logs page
+    filters), oldest first, streamed as a text download. The window start is
+    located by bisecting the file, so only the window itself is read.
+    """
+    params = request.args
+    log_path = current_app.config.get('SQUID_ACCESS_LOG', '/var/log/squid/access.log')
+    try:
+        log_filter = LogFilter(client=params.get('ip_filter', '').strip(),
+                               status=params.get('status_filter', 'ANY').strip(),
+                               **_filters(params))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if log_filter.since is None:
+        return jsonify({'error': 'since is required'}), 400
+    if not os.path.exists(log_path):
+        return jsonify({'error': 'Access log not available'}), 404
 
-    logs = LogService.get_logs(ip_filter, status_filter)
+    def lines():
+        for entry in LogService.read_window(log_filter.since, log_filter.until, log_path=log_path):
+            if log_filter.matches(entry):
+                yield entry.raw + '\n'
 
-    return render_template('log.html', logs=logs, ip_filter=ip_filter, active_tab='log')
+    filename = f"access-{datetime.fromtimestamp(log_filter.since).strftime('%Y%m%d-%H%M')}.log"
+    return Response(stream_with_context(lines()), mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
@@ -1,7 +1,11 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, Response
+from flask import Blueprint, current_app, render_template, request, flash, redirect, url_for, jsonify, Response
 from app.services.whitelist_service import WhitelistService
 from app.services.domain_template_service import DomainTemplateService
+from app.services.client_service import ClientService
+from app.services.allowlist_usage import GLOBAL_SCOPE, allowlist_usage
+from app.services.log_store import log_store
 from flask_login import login_required
+from app.utils import describe_dropped
 import json
 
 whitelist_bp = Blueprint('whitelist', __name__)
@@ -70,6 +74,56 @@ def delete_bulk_domains():
     flash(f"Deleted {count} domains. {errors} failed.", 'success' if errors == 0 else 'warning')
     return redirect(url_for('whitelist.manage_whitelist'))
 
+# --- STALE ENTRIES (no hit within N days) ---
+@whitelist_bp.route('/whitelist/stale', methods=['GET'])
+@login_required
+def stale_entries():
+    days = max(1, request.args.get('days', current_app.config.get('ALLOWLIST_STALE_DAYS', 30), type=int))
+    report = None
+    if log_store.enabled:
+        report = allowlist_usage.stale_report(days)
+    else:
+        flash('Stale detection needs the log store (LOG_STORE_ENABLED).', 'warning')
+    return render_template('stale_entries.html', active_tab='whitelist', days=days, report=report)
+
+@whitelist_bp.route('/whitelist/stale/prune', methods=['POST'])
+@login_required
+def prune_stale_entries():
+    days = request.form.get('days', type=int)
+    removals = {}
+    for value in request.form.getlist('client_entries'):
+        client_id, _, entry = value.partition('|')
+        if client_id.isdigit() and entry:
+            removals.setdefault(int(client_id), []).append(entry)
+    global_ids = [int(i) for i in request.form.getlist('global_ids') if i.isdigit()]
+    if not removals and not global_ids:
+        flash('No items selected.', 'warning')
+        return redirect(url_for('whitelist.stale_entries', days=days))
+
+    messages, errors = [], 0
+    if removals:
+        success, result = ClientService.remove_allowed_domains(removals)
+        if success:
+            for ip_address, entries in result.items():
+                allowlist_usage.forget(ip_address, entries)
+            messages.append(f"Removed {sum(len(e) for e in result.values())} entries from {len(result)} clients.")
+        else:
+            errors += 1
+            messages.append(f"Error pruning client entries: {result}")
+    if global_ids:
+        domains = {d.id: d.domain for d in WhitelistService.get_all_domains()}
+        deleted = []
+        for domain_id in global_ids:
+            success, _ = WhitelistService.delete_domain(domain_id)
+            if success:
+                deleted.append(domains.get(domain_id))
+            else:
+                errors += 1
+        allowlist_usage.forget(GLOBAL_SCOPE, [d for d in deleted if d])
+        messages.append(f"Deleted {len(deleted)} global domains.")
+    flash(' '.join(messages), 'success' if errors == 0 else 'warning')
+    return redirect(url_for('whitelist.stale_entries', days=days))
+
 # --- IP ROUTES ---
 @whitelist_bp.route('/whitelist/ips/add', methods=['POST'])
 @login_required
@@ -160,32 +214,10 @@ def import_domains():
     
     try:
         content = file.read().decode('utf-8')
-        lines = content.strip().split('\n')
-        success_count = 0
-        skip_count = 0
-        
-        for line in lines:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            
-            # Parse: domain #description
-            if '#' in line:
-                parts = line.split('#', 1)
-                domain = parts[0].strip()
-                description = parts[1].strip()
-            else:
-                domain = line
-                description = ''
-            
-            data = {'domain': domain, 'description': description}
-            success, msg = WhitelistService.add_domain(data)
-            if success:
-                success_count += 1
-            else:
-                skip_count += 1
-        
-        flash(f"Import completed! Added: {success_count}, Skipped: {skip_count}", 'success')
+        added, dropped = WhitelistService.import_domains(content.splitlines())
+        msg = f"Import completed! Added: {added}, Skipped: {len(dropped)}"
+        details = describe_dropped(dropped)
+        flash(f"{msg}. {details}" if details else msg, 'success')
     except Exception as e:
         flash(f'Import failed: {str(e)}', 'error')
     
@@ -343,12 +375,14 @@ def import_templates():
     try:
         json_data = json.load(file)
         overwrite = request.form.get('overwrite') == 'on'
-        success_count, skip_count, errors = DomainTemplateService.import_from_json(json_data, overwrite)
+        success_count, skip_count, errors, dropped = DomainTemplateService.import_from_json(json_data, overwrite)
         
         if errors:
             flash(f"Import completed with errors: {', '.join(errors)}", 'warning')
         else:
             flash(f"Import successful! Added/Updated: {success_count}, Skipped: {skip_count}", 'success')
+        if dropped:
+            flash(f"Normalized domains: {' '.join(dropped)}", 'info')
     except json.JSONDecodeError:
         flash('Invalid JSON file.', 'error')
     except Exception as e:
@@ -382,12 +416,14 @@ def migrate_templates():
         with open(json_path, 'r', encoding='utf-8') as f:
             json_data = json.load(f)
         
-        success_count, skip_count, errors = DomainTemplateService.import_from_json(json_data, overwrite=False)
+        success_count, skip_count, errors, dropped = DomainTemplateService.import_from_json(json_data, overwrite=False)
         
         if errors:
             flash(f"Migration completed with errors: {', '.join(errors)}", 'warning')
         else:
             flash(f"Migration successful! Imported: {success_count}, Skipped (already exists): {skip_count}", 'success')
+        if dropped:
+            flash(f"Normalized domains: {' '.join(dropped)}", 'info')
     
     except Exception as e:
         flash(f'Migration failed: {str(e)}', 'error')
@@ -1,5 +1,6 @@
 from .client import Client
 from .whitelist import GlobalDomainWhitelist, GlobalIPWhitelist
 from .domain_template import DomainTemplate
+from .reload_event import ReloadEvent
 
-__all__ = ['Client', 'GlobalDomainWhitelist', 'GlobalIPWhitelist', 'DomainTemplate']
\ No newline at end of file
+__all__ = ['Client', 'GlobalDomainWhitelist', 'GlobalIPWhitelist', 'DomainTemplate', 'ReloadEvent']
\ No newline at end of file
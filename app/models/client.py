@@ -8,7 +8,7 @@ class Client(db.Model):
     ip_address = db.Column(db.String(50), nullable=False, unique=True)
     dns_hostname = db.Column(db.String(128), nullable=True)  # Thêm cột DNS or Hostname
     ticket_id = db.Column(db.String(50), nullable=True)  # Thêm cột Ticket ID
-    expiration_date = db.Column(db.Date, nullable=False)
+    expiration_date = db.Column(db.Date, nullable=False, index=True)
     allowed_domains = db.Column(db.Text, nullable=True)
     date_added = db.Column(db.DateTime, default=db.func.current_timestamp())
     notes = db.Column(db.Text, nullable=True)
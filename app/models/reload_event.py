@@ -0,0 +1,27 @@
+from app.extensions import db
+
+
+class ReloadEvent(db.Model):
+    """One Squid reload: how long the reload command took and when Squid answered again."""
+    __tablename__ = 'reload_event'
+
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, default=db.func.current_timestamp(), index=True)
+    action = db.Column(db.String(20), nullable=False)        # reloaded / forced
+    success = db.Column(db.Boolean, nullable=False)
+    command_seconds = db.Column(db.Float, nullable=True)     # systemctl reload
+    ready_seconds = db.Column(db.Float, nullable=True)       # reload start -> probe OK, None if never ready
+    probe = db.Column(db.String(20), nullable=True)
+    message = db.Column(db.String(255), nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'timestamp': self.timestamp.strftime('%Y-%m-%d %H:%M:%S') if self.timestamp else 'N/A',
+            'action': self.action,
+            'success': self.success,
+            'command_seconds': self.command_seconds,
+            'ready_seconds': self.ready_seconds,
+            'probe': self.probe,
+            'message': self.message,
+        }
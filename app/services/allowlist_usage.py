@@ -0,0 +1,178 @@
+import time
+from datetime import date, datetime
+
+from app.services.log_store import log_store
+from app.services.whitelist_suggestions import is_proxy_denied
+from app.utils import DomainSuffixTrie, IPPrefixIndex
+
+GLOBAL_SCOPE = '*'
+# How long the (client -> allowed domains) index built from the main DB is reused
+INDEX_TTL = 60
+
+
+def load_allowlists():
+    """
+    (IPPrefixIndex of active clients -> (ip_address, DomainSuffixTrie), global
+    DomainSuffixTrie) from the main database. VIP (ANY) clients are skipped.
+    """
+    from app.models.client import Client
+    from app.models.whitelist import GlobalDomainWhitelist
+    clients = IPPrefixIndex()
+    for ip_address, allowed in Client.query.with_entities(Client.ip_address, Client.allowed_domains).filter(
+            Client.expiration_date >= date.today()):
+        domains = [d.strip() for d in (allowed or '').split('\n') if d.strip()]
+        if not domains or any(d.upper() == 'ANY' for d in domains):
+            continue
+        try:
+            clients.add(ip_address, (ip_address, DomainSuffixTrie(domains)))
+        except ValueError:
+            continue
+    global_domains = DomainSuffixTrie(
+        d for (d,) in GlobalDomainWhitelist.query.with_entities(GlobalDomainWhitelist.domain))
+    return clients, global_domains
+
+
+class AllowlistUsage:
+    """
+    Last hit of every allowed domain entry, maintained by the log store ingester.
+
+    Each allowed (not TCP_DENIED) request is credited to the entry that let it
+    through: the most specific active client containing the source IP and
+    the entry of its allowed_domains covering the host, and the global
+    whitelist entry covering the host. allowlist_hit keeps hits and last hit
+    per (client IP or '*', entry); rows are kept regardless of the log store
+    retention so a stale report can look back further than the raw log.
+    The allowlists themselves are re-read from the main DB at most every
+    INDEX_TTL seconds.
+    """
+
+    schema = """
+    CREATE TABLE IF NOT EXISTS allowlist_hit (
+        scope TEXT NOT NULL,         -- client ip_address, or '*' for the global whitelist
+        entry TEXT NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0,
+        last_hit REAL NOT NULL,
+        PRIMARY KEY (scope, entry)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS allowlist_tracking (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        since REAL NOT NULL          -- first request seen, the report cannot look back further
+    );
+    """
+
+    def __init__(self, store, loader=load_allowlists):
+        self.store = store
+        self.loader = loader
+        self._index = None
+        self._index_at = 0
+
+    def _allowlists(self):
+        if self._index is None or time.monotonic() - self._index_at > INDEX_TTL:
+            self._index = self.loader()
+            self._index_at = time.monotonic()
+        return self._index
+
+    def ingest(self, conn, entries):
+        if not entries:
+            return
+        clients, global_domains = self._allowlists()
+        hits = {}
+        for entry in entries:
+            if is_proxy_denied(entry) or not entry.host:
+                continue
+            keys = []
+            client = clients.lookup(entry.client)
+            if client is not None:
+                cover = client[1].find_cover(entry.host)
+                if cover is not None:
+                    keys.append((client[0], cover))
+            cover = global_domains.find_cover(entry.host)
+            if cover is not None:
+                keys.append((GLOBAL_SCOPE, cover))
+            for key in keys:
+                hit = hits.setdefault(key, [0, 0])
+                hit[0] += 1
+                hit[1] = max(hit[1], entry.timestamp)
+        conn.execute('INSERT OR IGNORE INTO allowlist_tracking (id, since) VALUES (1, ?)',
+                     (min(e.timestamp for e in entries),))
+        conn.executemany(
+            'INSERT INTO allowlist_hit (scope, entry, hits, last_hit) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(scope, entry) DO UPDATE SET hits = hits + excluded.hits, '
+            'last_hit = MAX(last_hit, excluded.last_hit)',
+            [key + tuple(hit) for key, hit in hits.items()])
+
+    def forget(self, scope, entries):
+        """Drop the hit rows of removed entries."""
+        conn = self.store.connect()
+        try:
+            conn.executemany('DELETE FROM allowlist_hit WHERE scope = ? AND entry = ?',
+                             [(scope, entry) for entry in entries])
+            conn.commit()
+        finally:
+            conn.close()
+        self._index = None
+
+    def stale_report(self, days, now=None):
+        """
+        Allowed entries with no hit in the last `days` days:
+        {'days', 'since', 'complete', 'clients': [{'id', 'ip_address',
+        'dns_hostname', 'entries': [{'entry', 'last_hit', 'hits'}]}],
+        'global': [{'id', 'domain', 'last_hit', 'hits'}]}.
+        last_hit is None for entries never hit since tracking started. Clients
+        and global domains added within the window are not reported, and
+        complete is False while tracking covers less than `days` days.
+        """
+        from app.models.client import Client
+        from app.models.whitelist import GlobalDomainWhitelist
+        now = now or time.time()
+        cutoff = now - days * 86400
+        conn = self.store.connect()
+        try:
+            row = conn.execute('SELECT since FROM allowlist_tracking WHERE id = 1').fetchone()
+            last_hits = {(scope, entry): (last_hit, hits) for scope, entry, last_hit, hits in conn.execute(
+                'SELECT scope, entry, last_hit, hits FROM allowlist_hit')}
+        finally:
+            conn.close()
+        since = row[0] if row else None
+        added_cutoff = datetime.utcfromtimestamp(cutoff)  # date_added is CURRENT_TIMESTAMP (UTC)
+
+        def stale(scope, entry):
+            last_hit, hits = last_hits.get((scope, entry), (None, 0))
+            if last_hit is not None and last_hit >= cutoff:
+                return None
+            return {'last_hit': last_hit, 'hits': hits}
+
+        clients = []
+        for client in Client.query.filter(Client.expiration_date >= date.today()).order_by(Client.ip_address):
+            if client.date_added and client.date_added > added_cutoff:
+                continue
+            domains = [d.strip() for d in (client.allowed_domains or '').split('\n') if d.strip()]
+            if any(d.upper() == 'ANY' for d in domains):
+                continue
+            entries = []
+            for domain in domains:
+                info = stale(client.ip_address, domain)
+                if info is not None:
+                    entries.append(dict(entry=domain, **info))
+            if entries:
+                clients.append({'id': client.id, 'ip_address': client.ip_address,
+                                'dns_hostname': client.dns_hostname, 'entries': entries})
+
+        global_entries = []
+        for domain in GlobalDomainWhitelist.query.order_by(GlobalDomainWhitelist.domain):
+            if domain.date_added and domain.date_added > added_cutoff:
+                continue
+            info = stale(GLOBAL_SCOPE, domain.domain)
+            if info is not None:
+                global_entries.append(dict(id=domain.id, domain=domain.domain, **info))
+
+        return {
+            'days': days,
+            'since': since,
+            'complete': since is not None and since <= cutoff,
+            'clients': clients,
+            'global': global_entries,
+        }
+
+
+allowlist_usage = AllowlistUsage(log_store)
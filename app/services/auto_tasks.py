@@ -11,6 +11,7 @@ def auto_generate_and_apply_config(app):
     """
     Hàm tự động Generate Config, Apply Config, và Reload Squid.
     Được gọi bởi APScheduler vào thời gian cấu hình.
+    Returns (success, result) of ConfigurationService.generate_apply_reload().
     """
     from app.services.configuration_service import ConfigurationService
 
@@ -19,29 +20,14 @@ def auto_generate_and_apply_config(app):
         # Tạo request context giả lập
         with app.test_request_context():
             try:
-                # Generate Config
-                logging.info("Starting to generate configuration files...")
-                success, res = ConfigurationService.generate_config()
+                logging.info("Starting generate / apply / reload...")
+                success, res = ConfigurationService.generate_apply_reload()
                 if not success:
-                    logging.error(f"Generate failed: {res}")
-                    return
-                logging.info("Configuration files generated.")
-
-                # Apply Config
-                logging.info("Starting to apply configuration...")
-                success, res = ConfigurationService.apply_config()
-                if not success:
-                    logging.error(f"Apply failed: {res}")
-                    return
-                logging.info("Configuration applied.")
-
-                # Reload Squid
-                logging.info("Starting to reload Squid...")
-                success, res = ConfigurationService.reload_squid()
-                if not success:
-                    logging.error(f"Reload failed: {res}")
-                else:
-                    logging.info("Squid reloaded successfully.")
+                    logging.error(res)
+                    return False, res
+                logging.info(f"Configuration applied. {res['reload']['message']}")
+                return True, res
 
             except Exception as e:
-                logging.error(f"Error during auto configuration: {e}")
\ No newline at end of file
+                logging.error(f"Error during auto configuration: {e}")
+                return False, str(e)
\ No newline at end of file
@@ -0,0 +1,80 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+
+JOB_ID = 'debounced_apply'
+
+
+class ChangeDebouncer:
+    """
+    Coalesces bursts of DB changes into a single generate/apply/reload.
+
+    Every service mutation calls mark_dirty(). The run is scheduled
+    AUTO_APPLY_QUIET_SECONDS after the latest change, but never later than
+    AUTO_APPLY_MAX_DELAY_SECONDS after the first change of the burst, so a
+    steady trickle of edits cannot postpone it forever. Disabled unless
+    AUTO_APPLY_ON_CHANGE is set.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.scheduler = None
+        self._lock = threading.Lock()
+        self._first_dirty = None
+        self._run_at = None
+        self._reasons = {}
+
+    def init_app(self, app, scheduler):
+        self.app = app
+        self.scheduler = scheduler
+
+    @property
+    def enabled(self):
+        return self.scheduler is not None and self.app.config.get('AUTO_APPLY_ON_CHANGE', False)
+
+    def mark_dirty(self, reason, count=1, now=None):
+        """Record count changes of one kind (e.g. 'client') and (re)schedule the coalesced run."""
+        if not self.enabled:
+            return
+        now = now or datetime.now()
+        quiet = timedelta(seconds=self.app.config.get('AUTO_APPLY_QUIET_SECONDS', 30))
+        max_delay = timedelta(seconds=self.app.config.get('AUTO_APPLY_MAX_DELAY_SECONDS', 300))
+        with self._lock:
+            if self._first_dirty is None:
+                self._first_dirty = now
+            self._reasons[reason] = self._reasons.get(reason, 0) + count
+            self._run_at = min(now + quiet, self._first_dirty + max_delay)
+            self.scheduler.add_job(
+                id=JOB_ID,
+                func=self._flush,
+                trigger='date',
+                run_date=self._run_at,
+                misfire_grace_time=None,
+                replace_existing=True
+            )
+
+    def pending(self):
+        """{'run_at': datetime, 'changes': {reason: count}} while a run is scheduled, else None."""
+        with self._lock:
+            if self._first_dirty is None:
+                return None
+            return {'run_at': self._run_at, 'changes': dict(self._reasons)}
+
+    def _flush(self):
+        from app.services.auto_tasks import auto_generate_and_apply_config
+        from app.services.configuration_service import PIPELINE_BUSY
+        with self._lock:
+            reasons = self._reasons
+            self._first_dirty = self._run_at = None
+            self._reasons = {}
+        summary = ', '.join(f"{count} {reason}" for reason, count in sorted(reasons.items()))
+        logging.info(f"Auto-apply after changes: {summary}")
+        success, result = auto_generate_and_apply_config(self.app)
+        if not success and result == PIPELINE_BUSY:
+            # A manual or scheduled run holds the lock; it may have read the DB
+            # before these changes, so try again after another quiet period.
+            for reason, count in reasons.items():
+                self.mark_dirty(reason, count)
+
+
+config_debouncer = ChangeDebouncer()
@@ -2,9 +2,11 @@ from app.models.client import Client
 from app import db
 from datetime import datetime
 from sqlalchemy.exc import IntegrityError
-from app.utils import validate_allowed_domains
+from app.utils import normalize_domains, describe_dropped
 import dns.resolver
 from flask import current_app
+from app.services.expiry_scheduler import expiry_scheduler
+from app.services.change_debouncer import config_debouncer
 
 class ClientService:
     @staticmethod
@@ -24,8 +26,9 @@ class ClientService:
         """
         try:
             allowed_domains_str = ''
+            dropped = []
             if data.get('allowed_domains'):
-                unique_domains = validate_allowed_domains(data.get('allowed_domains'))
+                unique_domains, dropped = normalize_domains(data.get('allowed_domains'), strict=True)
                 allowed_domains_str = '\n'.join(unique_domains)
 
             # Auto-lookup hostname if not provided
@@ -48,7 +51,9 @@ class ClientService:
             
             db.session.add(new_client)
             db.session.commit()
-            return True, "Client added successfully."
+            expiry_scheduler.client_changed(new_date=new_client.expiration_date)
+            config_debouncer.mark_dirty('client')
+            return True, f"Client added successfully. {describe_dropped(dropped)}".strip()
         except ValueError as e:
             return False, str(e)
         except IntegrityError:
@@ -61,9 +66,11 @@ class ClientService:
     @staticmethod
     def update_client(client_id, data):
         client = ClientService.get_client_by_id(client_id)
+        old_expiration = client.expiration_date
         try:
+            dropped = []
             if data.get('allowed_domains'):
-                unique_domains = validate_allowed_domains(data.get('allowed_domains'))
+                unique_domains, dropped = normalize_domains(data.get('allowed_domains'), strict=True)
                 client.allowed_domains = '\n'.join(unique_domains)
             else:
                 client.allowed_domains = ''
@@ -74,7 +81,9 @@ class ClientService:
             client.notes = data.get('notes')
 
             db.session.commit()
-            return True, "Client updated successfully."
+            expiry_scheduler.client_changed(old_expiration, client.expiration_date)
+            config_debouncer.mark_dirty('client')
+            return True, f"Client updated successfully. {describe_dropped(dropped)}".strip()
         except ValueError as e:
             return False, str(e)
         except Exception as e:
@@ -85,8 +94,11 @@ class ClientService:
     def delete_client(client_id):
         client = ClientService.get_client_by_id(client_id)
         try:
+            expiration = client.expiration_date
             db.session.delete(client)
             db.session.commit()
+            expiry_scheduler.client_changed(old_date=expiration)
+            config_debouncer.mark_dirty('client')
             return True, "Client deleted successfully."
         except Exception as e:
             db.session.rollback()
@@ -98,14 +110,41 @@ class ClientService:
             # Get IPs for logging
             clients_to_delete = Client.query.filter(Client.id.in_(client_ids)).all()
             deleted_ips = [client.ip_address for client in clients_to_delete]
+            expirations = [client.expiration_date for client in clients_to_delete]
 
             Client.query.filter(Client.id.in_(client_ids)).delete(synchronize_session=False)
             db.session.commit()
+            for expiration in expirations:
+                expiry_scheduler.client_changed(old_date=expiration)
+            config_debouncer.mark_dirty('client', len(expirations))
             return True, deleted_ips
         except Exception as e:
             db.session.rollback()
             return False, str(e)
 
+    @staticmethod
+    def remove_allowed_domains(removals):
+        """
+        Remove entries from clients' allowed domains: removals is
+        {client_id: iterable of entries}. Returns (success, {ip_address: [removed entries]}).
+        """
+        try:
+            removed = {}
+            for client in Client.query.filter(Client.id.in_(list(removals))).all():
+                drop = set(removals[client.id])
+                domains = [d for d in (client.allowed_domains or '').split('\n') if d.strip()]
+                kept = [d for d in domains if d.strip() not in drop]
+                if len(kept) != len(domains):
+                    client.allowed_domains = '\n'.join(kept)
+                    removed[client.ip_address] = [d.strip() for d in domains if d.strip() in drop]
+            db.session.commit()
+            if removed:
+                config_debouncer.mark_dirty('client', len(removed))
+            return True, removed
+        except Exception as e:
+            db.session.rollback()
+            return False, str(e)
+
     @staticmethod
     def perform_nslookup(ip):
         if not ip:
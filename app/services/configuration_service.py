@@ -1,9 +1,137 @@
 import os
+import json
 import shutil
+import hashlib
 import logging
+import ipaddress
+import math
+import time
+import threading
+from contextlib import contextmanager
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+try:
+    import fcntl
+except ImportError:  # Windows dev setup
+    fcntl = None
 from datetime import datetime, date
 from flask import current_app
+from sqlalchemy import func
+from app.extensions import db
 from app.models.client import Client
+from app.models.reload_event import ReloadEvent
+from app.services.system_service import SystemService
+from app.services.log_service import LogService
+from app.utils import DomainSuffixTrie, aggregate_networks
+from app.services.validation import (
+    SQUID_DEFAULT_DOMAINS_DIR, build_validation_sandbox, parse_with_squid, lint_squid_config
+)
+
+# Manifests (filename -> sha256 of content) kept in OUTPUT_DIR
+MANIFEST_FILE = '.manifest.json'
+APPLIED_MANIFEST_FILE = '.applied_manifest.json'
+# Fingerprint of the deployed file set at the last Squid reload
+RELOAD_STATE_FILE = '.reload_state.json'
+RELOAD_HISTORY_SIZE = 50
+# Side-car mapping of aggregated src networks to the original entries
+IP_SOURCES_FILE = 'ip_acl_sources.json'
+# Single-flight guard: one generate/apply/reload at a time across web
+# requests, the expiry job and the auto-apply debouncer. The thread lock covers
+# this process, an flock on OUTPUT_DIR/PIPELINE_LOCK_FILE the other ones (the
+# Werkzeug reloader's second process, extra workers).
+_pipeline_lock = threading.Lock()
+PIPELINE_LOCK_FILE = '.pipeline.lock'
+PIPELINE_BUSY = "Another generate/apply/reload run is already in progress. Try again shortly."
+
+class HitOrdering:
+    """
+    Orders per-client/policy http_access files by access-log request counts.
+
+    Squid includes conf.d/*.conf in name order and evaluates http_access
+    top to bottom, so each *_ip.conf gets a 3-digit prefix that sorts busier
+    files first. The prefix comes from a log2 bucket of the request count
+    (about 19% wide), which keeps file names stable while counts drift and
+    needs no global sort of the streamed clients.
+    """
+
+    def __init__(self, counts, requests):
+        self.counts = counts            # client address -> [requests, CONNECT requests]
+        self.requests = requests        # all requests in the window
+        self._networks = None
+        self._rows = []                 # (name without prefix, prefixed name, requests, connects)
+
+    def hits(self, addresses):
+        """[requests, connects] summed over client entries (IPs or CIDRs)."""
+        total = [0, 0]
+        for address in addresses:
+            if '/' in address:
+                matched = self._network_hits(address)
+            else:
+                matched = self.counts.get(address, (0, 0))
+            total[0] += matched[0]
+            total[1] += matched[1]
+        return total
+
+    def _network_hits(self, cidr):
+        if self._networks is None:
+            self._networks = []
+            for address, counter in self.counts.items():
+                try:
+                    self._networks.append((ipaddress.ip_address(address), counter))
+                except ValueError:
+                    continue
+        try:
+            network = ipaddress.ip_network(cidr, strict=False)
+        except ValueError:
+            return (0, 0)
+        total = [0, 0]
+        for address, counter in self._networks:
+            if address in network:
+                total[0] += counter[0]
+                total[1] += counter[1]
+        return total
+
+    @staticmethod
+    def prefix(requests):
+        bucket = min(int(math.log2(requests + 1) * 4), 999)
+        return f"{999 - bucket:03d}_"
+
+    def place(self, files, addresses):
+        """Prefix the *_ip.conf file of one client/policy; domain files keep their names."""
+        requests, connects = self.hits(addresses)
+        placed = []
+        for filename, content in files:
+            if filename.endswith('_ip.conf'):
+                prefixed = f"{self.prefix(requests)}{filename}"
+                self._rows.append((filename, prefixed, requests, connects))
+                filename = prefixed
+            placed.append((filename, content))
+        return placed
+
+    def report(self):
+        """
+        Estimated http_access rules evaluated per logged request, in plain name
+        order vs. hit order. A client's request stops at its CONNECT rule (1)
+        or its second rule (2); requests from unknown sources pass all rules.
+        """
+        def average(key):
+            cost = 0
+            for position, (_, _, requests, connects) in enumerate(sorted(self._rows, key=key)):
+                cost += requests * 2 * position + connects + 2 * (requests - connects)
+            cost += unmatched * 2 * len(self._rows)
+            return cost / self.requests if self.requests else 0.0
+
+        matched = sum(row[2] for row in self._rows)
+        unmatched = max(self.requests - matched, 0)
+        busiest = sorted(self._rows, key=lambda row: (-row[2], row[1]))[:5]
+        return {
+            'requests': self.requests,
+            'matched': matched,
+            'avg_rules_before': average(lambda row: row[0]),
+            'avg_rules_after': average(lambda row: row[1]),
+            'busiest': [(row[1], row[2]) for row in busiest if row[2]],
+        }
+
 
 class ConfigurationService:
     @staticmethod
@@ -25,67 +153,230 @@ class ConfigurationService:
 
 
     @staticmethod
-    def generate_config():
-        """Generate Squid configuration files from DB."""
-        try:
-            output_dir = current_app.config.get('OUTPUT_DIR', 'output/')
-            os.makedirs(output_dir, exist_ok=True)
-            ConfigurationService.clear_directory(output_dir)
+    def _content_hash(content):
+        """SHA-256 of a generated file's text content."""
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
 
-            valid_clients = Client.query.filter(Client.expiration_date >= date.today()).all()
-            expired_clients = Client.query.filter(Client.expiration_date < date.today()).all()
+    @staticmethod
+    def load_manifest(directory, name=MANIFEST_FILE):
+        """Load a filename -> content hash manifest, empty dict if missing/corrupt."""
+        path = os.path.join(directory, name)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data.get('files', {})
+        except FileNotFoundError:
+            return {}
+        except (ValueError, OSError) as e:
+            logging.warning(f"Ignoring unreadable manifest {path}: {e}")
+            return {}
 
-            vip_ips = []
-            vip_file_path = os.path.join(output_dir, 'VIP_clients.acl')
+    @staticmethod
+    def save_manifest(directory, manifest, name=MANIFEST_FILE):
+        """Persist a manifest atomically (write temp file, then rename)."""
+        path = os.path.join(directory, name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'generated_at': datetime.now().isoformat(),
+                'files': manifest
+            }, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
 
-            for client in valid_clients:
-                if client.allowed_domains.strip().upper() == "ANY":
-                    vip_ips.append(client.ip_address)
-                else:
-                    ConfigurationService._generate_client_file(client, output_dir)
+    @staticmethod
+    def generate_config():
+        """
+        Generate Squid configuration files from DB.
 
-            if not vip_ips:
-                vip_ips.append("127.0.0.2")
+        Only files whose content hash differs from the manifest of the previous
+        run are written, and only files that are no longer produced (client
+        deleted or expired) are removed. Clients are streamed as plain tuples
+        in GENERATE_BATCH_SIZE batches, so memory does not grow with the
+        client table.
+        """
+        try:
+            output_dir = current_app.config.get('OUTPUT_DIR', 'output/')
+            os.makedirs(output_dir, exist_ok=True)
+            started = time.perf_counter()
+            today = date.today()
 
-            with open(vip_file_path, 'w', encoding='utf-8') as vip_file:
-                for ip in vip_ips:
-                    vip_file.write(f"{ip}\n")
+            valid_count = db.session.query(func.count(Client.id)).filter(Client.expiration_date >= today).scalar()
+            expired_count = db.session.query(func.count(Client.id)).filter(Client.expiration_date < today).scalar()
 
-            # --- Global Whitelist Generation ---
-            from app.models.whitelist import GlobalDomainWhitelist, GlobalIPWhitelist
-            
-            # 1. Global Domains List
-            global_domains = GlobalDomainWhitelist.query.all()
-            
-            # Additional: Whitelist_domains.acl
-            with open(os.path.join(output_dir, 'Whitelist_domains.acl'), 'w', encoding='utf-8') as f:
-                for d in global_domains:
-                    desc = f" # {d.description}" if d.description else ""
-                    f.write(f"{d.domain}{desc}\n")
-            
-            # 2. Global IPs List
-            global_ips = GlobalIPWhitelist.query.all()
-
-            # Additional: Whitelist_ips.acl
-            with open(os.path.join(output_dir, 'Whitelist_ips.acl'), 'w', encoding='utf-8') as f:
-                for ip in global_ips:
-                    desc = f" # {ip.description}" if ip.description else ""
-                    f.write(f"{ip.ip_address}{desc}\n")
-            
+            valid_clients, global_domains, global_ips = ConfigurationService._query_sources(today)
+            stats = {}
+            files = ConfigurationService._render_files(valid_clients, global_domains, global_ips, stats)
+            changes = ConfigurationService._sync_output(output_dir, files)
+            if changes['errors']:
+                # Files that failed stay out of the manifest and are retried next run
+                shown = '; '.join(f"{name}: {err}" for name, err in changes['errors'][:10])
+                more = f" (+{len(changes['errors']) - 10} more)" if len(changes['errors']) > 10 else ""
+                return False, f"Failed to write {len(changes['errors'])} file(s): {shown}{more}"
 
+            elapsed = time.perf_counter() - started
+            rows = stats['client_rows'] + len(global_domains) + len(global_ips)
+            rows_per_sec = rows / elapsed if elapsed else 0
+            logging.info(f"Config generation read {rows} rows in {elapsed:.2f}s ({rows_per_sec:.0f} rows/sec)")
 
             return True, {
-                'valid_count': len(valid_clients),
-                'expired_count': len(expired_clients),
+                'valid_count': valid_count,
+                'expired_count': expired_count,
                 'global_domains': len(global_domains),
-                'global_ips': len(global_ips)
+                'global_ips': len(global_ips),
+                'acl_mode': stats['acl_mode'],
+                'policy_groups': stats['policy_groups'],
+                'http_access_rules': stats['http_access_rules'],
+                'global_redundant': stats['global_redundant'],
+                'ip_acls': stats['ip_acls'],
+                'hit_ordering': stats['hit_ordering'],
+                'rows': rows,
+                'elapsed': elapsed,
+                'rows_per_sec': rows_per_sec,
+                'changes': changes
             }
         except Exception as e:
             logging.error(f"Error generating config: {e}")
             return False, str(e)
 
     @staticmethod
-    def _generate_client_file(client, output_dir):
+    def _query_sources(today):
+        """
+        Return (valid_clients, global_domains, global_ips) for a generate run.
+        Clients are plain column tuples streamed in GENERATE_BATCH_SIZE batches:
+        no ORM identity map, no full materialization of the client table.
+        """
+        from app.models.whitelist import GlobalDomainWhitelist, GlobalIPWhitelist
+        batch_size = current_app.config.get('GENERATE_BATCH_SIZE', 1000)
+        valid_clients = db.session.query(
+            Client.ip_address, Client.allowed_domains, Client.expiration_date
+        ).filter(Client.expiration_date >= today).order_by(Client.id).yield_per(batch_size)
+        global_domains = db.session.query(
+            GlobalDomainWhitelist.domain, GlobalDomainWhitelist.description
+        ).order_by(GlobalDomainWhitelist.id).all()
+        global_ips = db.session.query(
+            GlobalIPWhitelist.ip_address, GlobalIPWhitelist.description
+        ).order_by(GlobalIPWhitelist.id).all()
+        return valid_clients, global_domains, global_ips
+
+    @staticmethod
+    def _render_files(valid_clients, global_domains, global_ips, stats):
+        """
+        Yield (filename, content) for every file of the generated config.
+        Fills `stats` with the ACL mode, policy count, http_access rule count and
+        per-client global-whitelist redundancy once the generator is exhausted.
+        """
+        mode = current_app.config.get('ACL_GENERATION_MODE', 'per_client')
+        # Suffix index of the global domain whitelist, built once per run
+        global_index = None
+        if current_app.config.get('SUBTRACT_GLOBAL_DOMAINS', False):
+            global_index = DomainSuffixTrie(d.domain for d in global_domains)
+
+        # Optional: prefix *_ip.conf names so the busiest clients sort (and are evaluated) first
+        ordering = None
+        if current_app.config.get('ACL_HIT_ORDERING', False):
+            counts, requests = LogService.client_hit_counts(current_app.config.get('ACL_HIT_WINDOW_HOURS', 24))
+            if counts is not None:
+                ordering = HitOrdering(counts, requests)
+
+        vip_ips = []
+        groups = {}
+        redundant = {}
+        client_policies = 0
+        client_rows = 0
+        for client in valid_clients:
+            client_rows += 1
+            if (client.allowed_domains or '').strip().upper() == "ANY":
+                vip_ips.append(client.ip_address)
+                continue
+
+            domains = client.allowed_domains.split('\n') if client.allowed_domains else []
+            if global_index is not None:
+                kept = [d for d in domains if not d.strip() or global_index.find_cover(d) is None]
+                if len(kept) != len(domains):
+                    redundant[client.ip_address] = len(domains) - len(kept)
+                    domains = kept
+
+            if mode == 'grouped':
+                key = ConfigurationService._domain_set_key(domains)
+                groups.setdefault(key, []).append(client.ip_address)
+            else:
+                client_policies += 1
+                files = ConfigurationService._render_client_files(client, domains)
+                if ordering is not None:
+                    files = ordering.place(files, [client.ip_address])
+                yield from files
+
+        for key in sorted(groups):
+            files = ConfigurationService._render_policy_files(key, groups[key])
+            if ordering is not None:
+                files = ordering.place(files, groups[key])
+            yield from files
+
+        policies = len(groups) if mode == 'grouped' else client_policies
+        stats['acl_mode'] = mode
+        stats['policy_groups'] = policies
+        stats['http_access_rules'] = 2 * policies
+        stats['global_redundant'] = redundant
+        stats['client_rows'] = client_rows
+        stats['hit_ordering'] = ordering.report() if ordering is not None else None
+
+        if not vip_ips:
+            vip_ips.append("127.0.0.2")
+
+        aggregate = current_app.config.get('AGGREGATE_IP_ACLS', True)
+        stats['ip_acls'] = {}
+        sidecar = {}
+
+        content, sources = ConfigurationService._render_ip_acl(
+            [(ip, None) for ip in vip_ips], aggregate)
+        stats['ip_acls']['VIP_clients.acl'] = (len(vip_ips), content.count('\n'))
+        sidecar['VIP_clients.acl'] = sources
+        yield 'VIP_clients.acl', content
+
+        # --- Global Whitelist Generation ---
+        lines = []
+        for d in global_domains:
+            desc = f" # {d.description}" if d.description else ""
+            lines.append(f"{d.domain}{desc}\n")
+        yield 'Whitelist_domains.acl', ''.join(lines)
+
+        content, sources = ConfigurationService._render_ip_acl(
+            [(ip.ip_address, ip.description) for ip in global_ips], aggregate)
+        stats['ip_acls']['Whitelist_ips.acl'] = (len(global_ips), content.count('\n'))
+        sidecar['Whitelist_ips.acl'] = sources
+        yield 'Whitelist_ips.acl', content
+
+        if aggregate:
+            # Which original entries (and their descriptions) each written network replaces
+            yield IP_SOURCES_FILE, json.dumps(sidecar, indent=2, sort_keys=True)
+
+    @staticmethod
+    def _render_ip_acl(entries, aggregate):
+        """
+        Render (ip_or_cidr, description) entries as an src ACL file.
+        With aggregate=True adjacent/contained networks are collapsed and the
+        descriptions move to the returned sources mapping (network -> originals);
+        otherwise every entry is written verbatim with its description.
+        """
+        if not aggregate:
+            lines = []
+            for value, description in entries:
+                desc = f" # {description}" if description else ""
+                lines.append(f"{value}{desc}\n")
+            return ''.join(lines), None
+
+        networks, sources, unparsed = aggregate_networks([value for value, _ in entries])
+        descriptions = {value: description for value, description in entries}
+        lines = [f"{net}\n" for net in networks] + [f"{value}\n" for value in unparsed]
+        sources = {
+            net: [{'entry': e, 'description': descriptions.get(e) or ''} for e in originals]
+            for net, originals in sources.items()
+        }
+        return ''.join(lines), sources
+
+    @staticmethod
+    def _render_client_files(client, domains):
+        """Return [(ip_filename, content), (url_filename, content)] for one client."""
         ip = client.ip_address.replace('.', '_')
         if '/' in ip:
              ip = ip.replace('/', '-') # Handle CIDR
@@ -94,23 +385,321 @@ class ConfigurationService:
         ip_filename = f"{ip}__{exp_date}_ip.conf"
         url_filename = f"{ip}__{exp_date}_url.conf"
         
-        # IP Conf
-        with open(os.path.join(output_dir, ip_filename), 'w') as f:
-            f.write(
-                f"acl client_{ip} src {client.ip_address}\n"
-                f"acl allowed_sites_{ip} dstdomain \"/etc/squid/domains/{url_filename}\"\n"
-                f"http_access allow client_{ip} CONNECT allowed_sites_{ip}\n"
-                f"http_access allow client_{ip} allowed_sites_{ip}\n"
-            )
-        
-        # URL Conf
-        with open(os.path.join(output_dir, url_filename), 'w') as f:
-            domains = client.allowed_domains.split('\n') if client.allowed_domains else []
-            f.write('\n'.join(domains))
+        ip_content = (
+            f"acl client_{ip} src {client.ip_address}\n"
+            f"acl allowed_sites_{ip} dstdomain \"/etc/squid/domains/{url_filename}\"\n"
+            f"http_access allow client_{ip} CONNECT allowed_sites_{ip}\n"
+            f"http_access allow client_{ip} allowed_sites_{ip}\n"
+        )
+        return [(ip_filename, ip_content), (url_filename, '\n'.join(domains))]
+
+    @staticmethod
+    def _domain_set_key(domains):
+        """Normalized, order-independent domain set used to group clients."""
+        domains = {d.strip().lower() for d in domains}
+        domains.discard('')
+        return tuple(sorted(domains))
+
+    @staticmethod
+    def _render_policy_files(domains, ips, ips_per_line=20):
+        """
+        Return [(ip_filename, content), (url_filename, content)] for a policy
+        group: every client sharing the same domain set, in one src ACL.
+        File names start with a digit, like the per-client (IP) ones, so the
+        rules are still included before the hand-maintained conf.d/default.conf.
+        """
+        policy_id = hashlib.sha1('\n'.join(domains).encode('utf-8')).hexdigest()[:12]
+        ip_filename = f"0_policy_{policy_id}_ip.conf"
+        url_filename = f"0_policy_{policy_id}_url.conf"
+
+        ips = sorted(ips)
+        lines = [f"# {len(ips)} client(s) sharing {len(domains)} domain(s)\n"]
+        for i in range(0, len(ips), ips_per_line):
+            lines.append(f"acl policy_{policy_id} src {' '.join(ips[i:i + ips_per_line])}\n")
+        lines.append(
+            f"acl policy_sites_{policy_id} dstdomain \"/etc/squid/domains/{url_filename}\"\n"
+            f"http_access allow policy_{policy_id} CONNECT policy_sites_{policy_id}\n"
+            f"http_access allow policy_{policy_id} policy_sites_{policy_id}\n"
+        )
+        return [(ip_filename, ''.join(lines)), (url_filename, '\n'.join(domains))]
+
+    @staticmethod
+    def _write_files(output_dir, pending, workers=1):
+        """
+        Write [(filename, content)] into output_dir, through a thread pool when
+        workers > 1. Returns {filename: error message} for the files that failed.
+        """
+        def write(item):
+            filename, content = item
+            with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f:
+                f.write(content)
+
+        errors = {}
+        if workers <= 1 or len(pending) <= 1:
+            for item in pending:
+                try:
+                    write(item)
+                except OSError as e:
+                    errors[item[0]] = str(e)
+            return errors
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='config-write') as pool:
+            futures = {pool.submit(write, item): item[0] for item in pending}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except OSError as e:
+                    errors[futures[future]] = str(e)
+        return errors
+
+    @staticmethod
+    def _sync_output(output_dir, files):
+        """
+        Write rendered files into output_dir, touching only what changed.
+        Changed files are collected in memory and written by CONFIG_WRITE_WORKERS
+        threads. Returns {'added': [...], 'changed': [...], 'removed': [...],
+        'unchanged': int, 'errors': [(filename, message), ...]}.
+        """
+        previous = ConfigurationService.load_manifest(output_dir)
+        manifest = {}
+        changes = {'added': [], 'changed': [], 'removed': [], 'unchanged': 0, 'errors': []}
+        pending = []
+
+        for filename, content in files:
+            digest = ConfigurationService._content_hash(content)
+            manifest[filename] = digest
+            old_digest = previous.get(filename)
+            if old_digest == digest and os.path.isfile(os.path.join(output_dir, filename)):
+                changes['unchanged'] += 1
+                continue
+            pending.append((filename, content))
+            changes['added' if old_digest is None else 'changed'].append(filename)
+
+        workers = current_app.config.get('CONFIG_WRITE_WORKERS', 4)
+        errors = ConfigurationService._write_files(output_dir, pending, workers)
+        del pending
+        if errors:
+            for filename, message in errors.items():
+                logging.error(f"Error writing {filename}: {message}")
+                del manifest[filename]
+            changes['added'] = [f for f in changes['added'] if f not in errors]
+            changes['changed'] = [f for f in changes['changed'] if f not in errors]
+            changes['errors'] = sorted(errors.items())
+
+        # Without a previous manifest we cannot tell our files from stale ones,
+        # so fall back to removing everything that is not part of this run.
+        # Dot-files are bookkeeping (manifests, reload state), never rendered output.
+        if previous:
+            stale = [f for f in previous if f not in manifest and f not in errors]
+        else:
+            stale = [f for f in os.listdir(output_dir)
+                     if f not in manifest and f not in errors and not f.startswith('.')
+                     and os.path.isfile(os.path.join(output_dir, f))]
+        for filename in stale:
+            try:
+                os.unlink(os.path.join(output_dir, filename))
+            except FileNotFoundError:
+                pass
+            changes['removed'].append(filename)
+
+        ConfigurationService.save_manifest(output_dir, manifest)
+        for key in ('added', 'changed', 'removed'):
+            changes[key].sort()
+        logging.info(
+            f"Config generated: {len(changes['added'])} added, {len(changes['changed'])} changed, "
+            f"{len(changes['removed'])} removed, {changes['unchanged']} unchanged, "
+            f"{len(changes['errors'])} failed"
+        )
+        return changes
+
+    @staticmethod
+    def benchmark_writes(worker_counts=(1, 2, 4, 8, 16)):
+        """
+        Render the current config once and time writing the full file set into
+        a scratch directory with each worker count. Nothing under OUTPUT_DIR is
+        touched. Returns (True, {'files': n, 'runs': [{'workers', 'seconds',
+        'files_per_sec'}, ...]}) or (False, error).
+        """
+        try:
+            valid_clients, global_domains, global_ips = ConfigurationService._query_sources(date.today())
+            files = list(ConfigurationService._render_files(valid_clients, global_domains, global_ips, {}))
+            output_dir = current_app.config.get('OUTPUT_DIR', 'output/')
+            os.makedirs(output_dir, exist_ok=True)
+            runs = []
+            for workers in worker_counts:
+                # Scratch dir next to OUTPUT_DIR so the timing reflects the same storage
+                scratch = tempfile.mkdtemp(prefix='.write-bench-', dir=output_dir)
+                try:
+                    started = time.perf_counter()
+                    errors = ConfigurationService._write_files(scratch, files, workers)
+                    seconds = time.perf_counter() - started
+                finally:
+                    shutil.rmtree(scratch, ignore_errors=True)
+                if errors:
+                    name, message = sorted(errors.items())[0]
+                    return False, f"{len(errors)} write(s) failed with {workers} workers, e.g. {name}: {message}"
+                runs.append({
+                    'workers': workers,
+                    'seconds': seconds,
+                    'files_per_sec': len(files) / seconds if seconds else 0
+                })
+            return True, {'files': len(files), 'runs': runs}
+        except Exception as e:
+            logging.error(f"Error benchmarking config writes: {e}")
+            return False, str(e)
+
+    @staticmethod
+    def _deploy_target(filename, squid_conf, squid_domains, vip_dir):
+        """Return (category, destination dir) for a generated file, or (None, None)."""
+        if filename == 'VIP_clients.acl' or filename.startswith('Whitelist_'):
+            return 'vip', vip_dir
+        elif filename.endswith('_ip.conf'):
+            return 'conf', squid_conf
+        elif filename.endswith('_url.conf'):
+            return 'domains', squid_domains
+        return None, None
+
+    @staticmethod
+    def _releases_dir(live_dir):
+        """Sibling directory holding the staged releases of a live directory."""
+        parent, base = os.path.split(live_dir)
+        return os.path.join(parent, f".{base}.releases")
+
+    @staticmethod
+    def _stage_release(live_dir, files, output_dir, applied):
+        """
+        Build a complete new tree for live_dir in a sibling staging directory.
+
+        Files that are unchanged since the last apply are hard-linked from the
+        current release (same filesystem, no data copied); new or changed files
+        are copied from output_dir. Returns (release_path, copied, reused).
+        """
+        releases_dir = ConfigurationService._releases_dir(live_dir)
+        release = os.path.join(releases_dir, datetime.now().strftime('%Y%m%d_%H%M%S_%f'))
+        os.makedirs(release)
+
+        current = os.path.realpath(live_dir) if os.path.isdir(live_dir) else None
+        copied = reused = 0
+
+        # Keep the hand-maintained default.conf, as clear_directory() used to.
+        if current and os.path.isfile(os.path.join(current, 'default.conf')):
+            ConfigurationService._link_or_copy(
+                os.path.join(current, 'default.conf'), os.path.join(release, 'default.conf'))
+
+        for filename, digest in files.items():
+            dest = os.path.join(release, filename)
+            existing = os.path.join(current, filename) if current else None
+            if applied.get(filename) == digest and existing and os.path.isfile(existing):
+                ConfigurationService._link_or_copy(existing, dest)
+                reused += 1
+            else:
+                shutil.copy2(os.path.join(output_dir, filename), dest)
+                copied += 1
+        return release, copied, reused
+
+    @staticmethod
+    def validate_staged_config(conf_release, domains_release, path_map):
+        """
+        Validate a staged conf.d/domains pair before it goes live, in one pass.
+        Builds a throwaway squid.conf that includes the staged tree and runs a
+        single `squid -k parse` on it (SQUID_VALIDATE_TIMEOUT); without a
+        squid binary falls back to the built-in linter.
+        Returns (valid, {'method', 'errors', 'seconds'}).
+        """
+        squid_binary = shutil.which(current_app.config.get('SQUID_BINARY', 'squid'))
+        main_conf = current_app.config.get('SQUID_MAIN_CONF', '/etc/squid/squid.conf')
+        started = time.perf_counter()
+        sandbox = tempfile.mkdtemp(prefix='squidman-validate-')
+        try:
+            squid_conf = build_validation_sandbox(sandbox, conf_release, domains_release, path_map, main_conf)
+            if squid_binary:
+                method = 'squid -k parse'
+                errors = parse_with_squid(
+                    squid_binary, squid_conf, current_app.config.get('SQUID_VALIDATE_TIMEOUT', 30))
+            else:
+                method = 'built-in linter'
+                errors = lint_squid_config(squid_conf)
+        finally:
+            shutil.rmtree(sandbox, ignore_errors=True)
+        seconds = time.perf_counter() - started
+        if errors:
+            logging.error(f"Staged config failed validation ({method}): {errors[:5]}")
+        return not errors, {'method': method, 'errors': errors, 'seconds': seconds}
+
+    @staticmethod
+    def _link_or_copy(src, dest):
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copy2(src, dest)
+
+    @staticmethod
+    def _swap_in(live_dir, release):
+        """
+        Make live_dir point at release in a single rename.
+
+        live_dir becomes a symlink into its releases directory; a temporary
+        symlink is created next to it and renamed over it, which is atomic on
+        POSIX. A legacy real directory is moved into the releases directory
+        once, the first time this runs.
+        """
+        parent = os.path.dirname(live_dir)
+        target = os.path.relpath(release, parent)
+
+        if os.name == 'nt':
+            # No reliable directory symlinks: swap with two renames.
+            if os.path.isdir(live_dir):
+                old = os.path.join(ConfigurationService._releases_dir(live_dir),
+                                   f"replaced_{os.path.basename(release)}")
+                os.rename(live_dir, old)
+            os.rename(release, live_dir)
+            return
+
+        if os.path.isdir(live_dir) and not os.path.islink(live_dir):
+            legacy = os.path.join(ConfigurationService._releases_dir(live_dir),
+                                  f"legacy_{os.path.basename(release)}")
+            os.rename(live_dir, legacy)
+            logging.info(f"Moved legacy directory {live_dir} to {legacy}")
+
+        tmp_link = f"{live_dir}.swap"
+        if os.path.lexists(tmp_link):
+            os.unlink(tmp_link)
+        os.symlink(target, tmp_link)
+        os.replace(tmp_link, live_dir)
+
+    @staticmethod
+    def _prune_releases(live_dir, keep):
+        """Delete old releases, keeping the live one and the `keep` newest others."""
+        releases_dir = ConfigurationService._releases_dir(live_dir)
+        if not os.path.isdir(releases_dir):
+            return
+        live_target = os.path.realpath(live_dir)
+        releases = sorted(
+            (os.path.join(releases_dir, name) for name in os.listdir(releases_dir)),
+            key=os.path.getmtime, reverse=True
+        )
+        others = [r for r in releases if os.path.realpath(r) != live_target]
+        for old in others[keep:]:
+            shutil.rmtree(old, ignore_errors=True)
+
+    @staticmethod
+    def _replace_file(src, dest):
+        """Copy src over dest atomically (temp file in the same dir + rename)."""
+        tmp_path = f"{dest}.tmp"
+        shutil.copy2(src, tmp_path)
+        os.replace(tmp_path, dest)
 
     @staticmethod
     def apply_config():
-        """Apply generated config to Squid directories."""
+        """
+        Apply generated config to Squid directories.
+
+        The new conf.d and domains trees are built in sibling staging
+        directories and switched in with a symlink rename, so the live tree
+        moves from the old to the new config in one step regardless of the
+        number of clients. VIP/Whitelist files are replaced one by one with
+        an atomic rename.
+        """
         try:
             # Auto backup before applying
             from app.services.backup_service import BackupService
@@ -120,48 +709,80 @@ class ConfigurationService:
             if not os.path.exists(output_dir):
                 return False, "Output directory not found."
 
-            squid_conf = current_app.config.get('SQUID_CONF_DIR')
-            squid_domains = current_app.config.get('SQUID_DOMAINS_DIR')
-            
-            # Ensure dirs exist (mocking relative paths in Dev)
-            os.makedirs(squid_conf, exist_ok=True)
-            os.makedirs(squid_domains, exist_ok=True)
-            
-            ConfigurationService.clear_directory(squid_conf)
-            ConfigurationService.clear_directory(squid_domains)
+            squid_conf = os.path.normpath(current_app.config.get('SQUID_CONF_DIR'))
+            squid_domains = os.path.normpath(current_app.config.get('SQUID_DOMAINS_DIR'))
+            vip_dir = os.path.normpath(current_app.config.get('SQUID_VIP_DIR'))
+            keep = current_app.config.get('APPLY_KEEP_RELEASES', 2)
+
+            generated = ConfigurationService.load_manifest(output_dir)
+            if not generated:
+                return False, "No generated configuration found. Run Generate Config first."
+            applied = ConfigurationService.load_manifest(output_dir, APPLIED_MANIFEST_FILE)
+
+            by_category = {'vip': {}, 'conf': {}, 'domains': {}}
+            for filename, digest in generated.items():
+                category, _ = ConfigurationService._deploy_target(
+                    filename, squid_conf, squid_domains, vip_dir)
+                if category:
+                    by_category[category][filename] = digest
 
-            vip_dir = '/etc/squid/VIP' if os.name != 'nt' else 'config/squid/VIP' 
+            # Stage both trees fully before touching anything live.
             os.makedirs(vip_dir, exist_ok=True)
+            conf_release, conf_copied, conf_reused = ConfigurationService._stage_release(
+                squid_conf, by_category['conf'], output_dir, applied)
+            domains_release, domains_copied, domains_reused = ConfigurationService._stage_release(
+                squid_domains, by_category['domains'], output_dir, applied)
 
-            # Track copied files
-            copied_files = {'vip': 0, 'conf': 0, 'domains': 0}
-            
-            for filename in os.listdir(output_dir):
-                src = os.path.join(output_dir, filename)
-                if os.path.isfile(src):
-                    if filename == 'VIP_clients.acl' or filename.startswith('Whitelist_'):
-                        dest = os.path.join(vip_dir, filename)
-                        shutil.copy(src, dest)
-                        copied_files['vip'] += 1
-                        logging.info(f"Copied {filename} to {dest}")
-                    elif filename.endswith('_ip.conf'):
-                        dest = os.path.join(squid_conf, filename)
-                        shutil.copy(src, dest)
-                        copied_files['conf'] += 1
-                        logging.info(f"Copied {filename} to {dest}")
-                    elif filename.endswith('_url.conf'):
-                        dest = os.path.join(squid_domains, filename)
-                        shutil.copy(src, dest)
-                        copied_files['domains'] += 1
-                        logging.info(f"Copied {filename} to {dest}")
+            if current_app.config.get('SQUID_VALIDATE_CONFIG', True):
+                valid, validation = ConfigurationService.validate_staged_config(
+                    conf_release, domains_release, {
+                        squid_conf: conf_release,
+                        squid_domains: domains_release,
+                        SQUID_DEFAULT_DOMAINS_DIR.rstrip('/'): domains_release,
+                        vip_dir: os.path.normpath(output_dir),
+                    })
+                if not valid:
+                    shutil.rmtree(conf_release, ignore_errors=True)
+                    shutil.rmtree(domains_release, ignore_errors=True)
+                    shown = '<br>'.join(validation['errors'][:20])
+                    more = f"<br>(+{len(validation['errors']) - 20} more)" if len(validation['errors']) > 20 else ""
+                    return False, (
+                        f"Validation ({validation['method']}) failed, live config left untouched:<br>{shown}{more}"
+                    )
+                validated = f"{validation['method']} OK in {validation['seconds']:.2f}s"
+            else:
+                validated = "skipped"
+
+            # Domains first: the new conf.d references the new domain files.
+            ConfigurationService._swap_in(squid_domains, domains_release)
+            ConfigurationService._swap_in(squid_conf, conf_release)
+            logging.info(f"Switched {squid_conf} -> {conf_release}, {squid_domains} -> {domains_release}")
+
+            vip_copied = 0
+            for filename, digest in by_category['vip'].items():
+                dest = os.path.join(vip_dir, filename)
+                if applied.get(filename) == digest and os.path.isfile(dest):
+                    continue
+                ConfigurationService._replace_file(os.path.join(output_dir, filename), dest)
+                vip_copied += 1
+                logging.info(f"Copied {filename} to {dest}")
+
+            deployed = {}
+            for files in by_category.values():
+                deployed.update(files)
+            ConfigurationService.save_manifest(output_dir, deployed, APPLIED_MANIFEST_FILE)
+
+            ConfigurationService._prune_releases(squid_conf, keep)
+            ConfigurationService._prune_releases(squid_domains, keep)
             
             msg = (
                 f"Configuration applied successfully!<br>"
-                f"• VIP files: {copied_files['vip']}<br>"
-                f"• Config files: {copied_files['conf']}<br>"
-                f"• Domain files: {copied_files['domains']}<br>"
-                f"• Squid Conf Dir: {squid_conf}<br>"
-                f"• Squid Domains Dir: {squid_domains}<br>"
+                f"• Validation: {validated}<br>"
+                f"• VIP files: {vip_copied}<br>"
+                f"• Config files: {conf_copied} copied, {conf_reused} unchanged<br>"
+                f"• Domain files: {domains_copied} copied, {domains_reused} unchanged<br>"
+                f"• Squid Conf Dir: {squid_conf} → {conf_release}<br>"
+                f"• Squid Domains Dir: {squid_domains} → {domains_release}<br>"
                 f"• VIP Dir: {vip_dir}"
             )
             
@@ -184,3 +805,230 @@ class ConfigurationService:
             return False, "Failed to reload Squid (exit code != 0)"
         except Exception as e:
             return False, str(e)
+
+    @staticmethod
+    def last_applied_at():
+        """Local datetime of the last apply (its manifest's mtime), None if nothing applied."""
+        output_dir = current_app.config.get('OUTPUT_DIR', 'output/')
+        try:
+            return datetime.fromtimestamp(os.path.getmtime(os.path.join(output_dir, APPLIED_MANIFEST_FILE)))
+        except OSError:
+            return None
+
+    @staticmethod
+    def deployed_fingerprint():
+        """
+        Fingerprint of the deployed file set (VIP, Whitelist_*, conf.d, domains),
+        derived from the manifest written by the last apply. None if nothing applied.
+        """
+        output_dir = current_app.config.get('OUTPUT_DIR', 'output/')
+        applied = ConfigurationService.load_manifest(output_dir, APPLIED_MANIFEST_FILE)
+        if not applied:
+            return None
+        digest = hashlib.sha256()
+        for filename in sorted(applied):
+            digest.update(f"{filename}\0{applied[filename]}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def get_reload_state():
+        """Last reloaded fingerprint and recent reload/no-op history."""
+        output_dir = current_app.config.get('OUTPUT_DIR', 'output/')
+        path = os.path.join(output_dir, RELOAD_STATE_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'fingerprint': None, 'history': []}
+
+    @staticmethod
+    def _record_reload_event(action, fingerprint):
+        output_dir = current_app.config.get('OUTPUT_DIR', 'output/')
+        os.makedirs(output_dir, exist_ok=True)
+        state = ConfigurationService.get_reload_state()
+        if action != 'noop':
+            state['fingerprint'] = fingerprint
+        state['history'] = ([{
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'action': action,
+            'fingerprint': fingerprint
+        }] + state.get('history', []))[:RELOAD_HISTORY_SIZE]
+        path = os.path.join(output_dir, RELOAD_STATE_FILE)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+    @staticmethod
+    def reload_if_changed(force=False):
+        """
+        Reload Squid unless the deployed config is byte-identical to what was
+        deployed at the last reload. force=True always reloads.
+        Returns (success, {'reloaded': bool, 'message': str}) or (False, error).
+        """
+        fingerprint = ConfigurationService.deployed_fingerprint()
+        last = ConfigurationService.get_reload_state().get('fingerprint')
+
+        if not force and fingerprint is not None and fingerprint == last:
+            ConfigurationService._record_reload_event('noop', fingerprint)
+            logging.info(f"Squid reload skipped, deployed config unchanged ({fingerprint[:12]}).")
+            return True, {'reloaded': False, 'message': "Reload skipped: deployed config unchanged."}
+
+        action = 'forced' if force else 'reloaded'
+        started = time.perf_counter()
+        success, msg = ConfigurationService.reload_squid()
+        command_seconds = time.perf_counter() - started
+        if not success:
+            ConfigurationService._save_reload_metrics(action, False, command_seconds, None, None, msg)
+            return False, msg
+
+        # Reload only counts once Squid serves again
+        probe_name, probe = ConfigurationService._readiness_probe()
+        ready_seconds = None
+        if probe is not None:
+            host = current_app.config.get('SQUID_PROBE_HOST', '127.0.0.1')
+            port = SystemService.get_squid_port()
+            timeout = current_app.config.get('SQUID_READY_TIMEOUT', 30)
+            waited = SystemService.wait_for_squid_ready(probe, host, port, timeout)
+            if waited is None:
+                error = f"Squid reloaded but not ready after {timeout}s ({probe_name} probe on {host}:{port})"
+                ConfigurationService._save_reload_metrics(action, False, command_seconds, None, probe_name, error)
+                return False, error
+            ready_seconds = command_seconds + waited
+            msg = f"{msg} Ready in {ready_seconds:.2f}s."
+
+        ConfigurationService._save_reload_metrics(action, True, command_seconds, ready_seconds, probe_name, msg)
+        ConfigurationService._record_reload_event(action, fingerprint)
+        return True, {'reloaded': True, 'message': msg, 'ready_seconds': ready_seconds}
+
+    @staticmethod
+    def _readiness_probe():
+        """
+        (name, probe) from SQUID_READY_PROBE: 'cachemgr' (default), 'tcp', 'none',
+        or any callable probe(host, port, timeout) -> bool (e.g. a stand-in in
+        tests). 'tcp' only shows that the port is open, which it stays during a
+        reload, so its ready times measure little beyond the reload command.
+        Always ('none', None) on Windows, where reload_squid() is mocked.
+        """
+        if os.name == 'nt':
+            return 'none', None
+        probe = current_app.config.get('SQUID_READY_PROBE', 'cachemgr')
+        if callable(probe):
+            return getattr(probe, '__name__', 'custom'), probe
+        probes = {
+            'tcp': SystemService.probe_squid_tcp,
+            'cachemgr': SystemService.probe_squid_cachemgr,
+        }
+        return probe, probes.get(probe)
+
+    @staticmethod
+    def _save_reload_metrics(action, success, command_seconds, ready_seconds, probe, message):
+        """Persist one ReloadEvent; metrics must never fail the reload itself."""
+        try:
+            db.session.add(ReloadEvent(
+                action=action,
+                success=success,
+                command_seconds=command_seconds,
+                ready_seconds=ready_seconds,
+                probe=probe,
+                message=(message or '')[:255]
+            ))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logging.warning(f"Could not record reload metrics: {e}")
+
+    @staticmethod
+    def reload_latency_stats(limit=100):
+        """
+        p50/p95 of reload-to-ready time over the last `limit` reloads.
+        Returns {'count', 'failures', 'p50', 'p95', 'last'}; p50/p95 are None without data.
+        """
+        events = ReloadEvent.query.order_by(ReloadEvent.id.desc()).limit(limit).all()
+        samples = sorted(e.ready_seconds for e in events if e.success and e.ready_seconds is not None)
+
+        def percentile(p):
+            if not samples:
+                return None
+            return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)]
+
+        return {
+            'count': len(samples),
+            'failures': sum(1 for e in events if not e.success),
+            'p50': percentile(50),
+            'p95': percentile(95),
+            'last': events[0].to_dict() if events else None,
+        }
+
+    @staticmethod
+    @contextmanager
+    def single_flight():
+        """
+        Hold the pipeline lock for the duration of the block without waiting.
+        Yields False (and runs nothing exclusive) when another run holds it,
+        in this process or another one.
+        """
+        if not _pipeline_lock.acquire(blocking=False):
+            yield False
+            return
+        try:
+            with ConfigurationService._pipeline_file_lock() as acquired:
+                yield acquired
+        finally:
+            _pipeline_lock.release()
+
+    @staticmethod
+    @contextmanager
+    def _pipeline_file_lock():
+        """Non-blocking flock on OUTPUT_DIR/PIPELINE_LOCK_FILE; always acquired without fcntl."""
+        if fcntl is None:
+            yield True
+            return
+        output_dir = current_app.config.get('OUTPUT_DIR', 'output/')
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, PIPELINE_LOCK_FILE), 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                acquired = True
+            except BlockingIOError:
+                acquired = False
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def generate_apply_reload(force=False, progress=None):
+        """
+        Full pipeline used by 1-Click Apply and the scheduled jobs.
+        progress(stage, success), if given, is called when a stage starts
+        (success=None) and when it finishes.
+        Returns (success, {'generate': ..., 'apply': ..., 'reload': ...}) or
+        (False, error); (False, PIPELINE_BUSY) if another run is in progress.
+        """
+        with ConfigurationService.single_flight() as acquired:
+            if not acquired:
+                return False, PIPELINE_BUSY
+            return ConfigurationService._generate_apply_reload(force, progress or (lambda stage, success: None))
+
+    @staticmethod
+    def _generate_apply_reload(force, progress):
+        progress('generate', None)
+        success, generated = ConfigurationService.generate_config()
+        progress('generate', success)
+        if not success:
+            return False, f"Generate failed: {generated}"
+
+        progress('apply', None)
+        success, applied = ConfigurationService.apply_config()
+        progress('apply', success)
+        if not success:
+            return False, f"Apply failed: {applied}"
+
+        progress('reload', None)
+        success, reloaded = ConfigurationService.reload_if_changed(force=force)
+        progress('reload', success)
+        if not success:
+            return False, f"Reload failed: {reloaded}"
+
+        return True, {'generate': generated, 'apply': applied, 'reload': reloaded}
@@ -1,12 +1,14 @@
 from app.models.domain_template import DomainTemplate
 from app.extensions import db
-from app.utils import validate_allowed_domains
+from app.utils import DomainSuffixTrie, normalize_domains, describe_dropped
 import json
 import logging
+from app.services.change_debouncer import config_debouncer
 
 
 class DomainTemplateService:
     """Service layer for Domain Template CRUD operations."""
+    _domain_tries = None  # cached {name: DomainSuffixTrie}, reset on every change
 
     @staticmethod
     def get_all_templates():
@@ -38,7 +40,7 @@ class DomainTemplateService:
 
             # Parse and validate domains using central utility
             try:
-                validated_domains = validate_allowed_domains(domains_text)
+                validated_domains, dropped = normalize_domains(domains_text, strict=True)
                 if not validated_domains:
                     return False, "At least one valid domain is required."
             except ValueError as e:
@@ -51,7 +53,9 @@ class DomainTemplateService:
             )
             db.session.add(new_template)
             db.session.commit()
-            return True, f"Template '{name}' added successfully with {len(validated_domains)} domains."
+            DomainTemplateService._domain_tries = None
+            config_debouncer.mark_dirty('template')
+            return True, f"Template '{name}' added successfully with {len(validated_domains)} domains. {describe_dropped(dropped)}".strip()
 
         except Exception as e:
             db.session.rollback()
@@ -80,7 +84,7 @@ class DomainTemplateService:
 
             # Parse and validate domains using central utility
             try:
-                validated_domains = validate_allowed_domains(domains_text)
+                validated_domains, dropped = normalize_domains(domains_text, strict=True)
                 if not validated_domains:
                     return False, "At least one valid domain is required."
             except ValueError as e:
@@ -90,7 +94,9 @@ class DomainTemplateService:
             template.domains = json.dumps(validated_domains)
             template.description = description
             db.session.commit()
-            return True, f"Template '{name}' updated successfully."
+            DomainTemplateService._domain_tries = None
+            config_debouncer.mark_dirty('template')
+            return True, f"Template '{name}' updated successfully. {describe_dropped(dropped)}".strip()
 
         except Exception as e:
             db.session.rollback()
@@ -108,6 +114,8 @@ class DomainTemplateService:
             name = template.name
             db.session.delete(template)
             db.session.commit()
+            DomainTemplateService._domain_tries = None
+            config_debouncer.mark_dirty('template')
             return True, f"Template '{name}' deleted successfully."
 
         except Exception as e:
@@ -127,18 +135,35 @@ class DomainTemplateService:
             result[t.name] = t.get_domains_list()
         return result
 
+    @staticmethod
+    def domain_tries():
+        """{name: DomainSuffixTrie of its domains}, built once and rebuilt only after a change."""
+        if DomainTemplateService._domain_tries is None:
+            DomainTemplateService._domain_tries = {
+                name: DomainSuffixTrie(domains) for name, domains in DomainTemplateService.get_all_as_dict().items()
+            }
+        return DomainTemplateService._domain_tries
+
+    @staticmethod
+    def reset_domain_tries():
+        """Drop the cached tries after the table changed outside this service (e.g. a DB restore)."""
+        DomainTemplateService._domain_tries = None
+
     @staticmethod
     def import_from_json(json_data, overwrite=False):
         """
         Import templates from JSON data.
+        Domains of every template are normalized in bulk (leading dot, no
+        duplicates or covered subdomains, invalid entries dropped).
         Args:
             json_data: dict in format {"GroupName": [domains], ...}
             overwrite: if True, overwrite existing templates with same name
-        Returns: (success_count, skip_count, error_messages)
+        Returns: (success_count, skip_count, error_messages, dropped_messages)
         """
         success_count = 0
         skip_count = 0
         errors = []
+        dropped_notes = []
 
         try:
             for name, domains in json_data.items():
@@ -146,6 +171,13 @@ class DomainTemplateService:
                     errors.append(f"Invalid format for '{name}': domains must be a list")
                     continue
 
+                domains, dropped = normalize_domains(str(d) for d in domains)
+                if dropped:
+                    dropped_notes.append(f"{name}: {describe_dropped(dropped)}")
+                if not domains:
+                    errors.append(f"'{name}' has no valid domains")
+                    continue
+
                 existing = DomainTemplate.query.filter_by(name=name).first()
                 
                 if existing:
@@ -164,12 +196,15 @@ class DomainTemplateService:
                     success_count += 1
 
             db.session.commit()
-            return success_count, skip_count, errors
+            DomainTemplateService._domain_tries = None
+            if success_count:
+                config_debouncer.mark_dirty('template', success_count)
+            return success_count, skip_count, errors, dropped_notes
 
         except Exception as e:
             db.session.rollback()
             logging.error(f"Error importing templates: {e}")
-            return 0, 0, [str(e)]
+            return 0, 0, [str(e)], []
 
     @staticmethod
     def export_to_json():
@@ -0,0 +1,166 @@
+import heapq
+import logging
+import threading
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import func
+
+JOB_ID = 'expiry_regenerate'
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+class ExpiryScheduler:
+    """
+    Schedules a config regeneration for the exact moment a client expires.
+
+    A client is valid while expiration_date >= today, so clients expiring on
+    day D lose access at midnight of D + 1. Upcoming expiration dates are kept
+    in a min-heap with a per-date client count; the heap top is the only date
+    with an APScheduler job. Removed dates are dropped lazily when they reach
+    the top. Nothing is scheduled while no client is due to expire. The date
+    job lives in memory only, so on startup (and after a DB restore) clients
+    that expired since the last apply trigger an immediate regeneration.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.scheduler = None
+        self._lock = threading.RLock()
+        self._heap = []
+        self._counts = {}
+
+    def init_app(self, app, scheduler):
+        self.app = app
+        self.scheduler = scheduler
+        with app.app_context():
+            self.rebuild(catch_up=True)
+
+    @property
+    def enabled(self):
+        return self.scheduler is not None
+
+    def rebuild(self, catch_up=False):
+        """
+        Reload the upcoming expiration dates from the DB (uses the expiration_date
+        index). With catch_up, regenerate right away if a client expired after
+        the last apply, e.g. while the app was down at midnight.
+        """
+        from app.extensions import db
+        from app.models.client import Client
+        rows = db.session.query(Client.expiration_date, func.count(Client.id)) \
+            .filter(Client.expiration_date >= date.today()) \
+            .group_by(Client.expiration_date).all()
+        with self._lock:
+            self._counts = {_as_date(d): n for d, n in rows}
+            self._heap = list(self._counts)
+            heapq.heapify(self._heap)
+            self._schedule_next()
+        if catch_up and self.enabled and self._missed_expiries():
+            logging.info("Clients expired since the last apply, regenerating now")
+            self.scheduler.add_job(
+                id=f"{JOB_ID}_catch_up",
+                func=self._on_expiry,
+                trigger='date',
+                run_date=datetime.now(),
+                misfire_grace_time=None,
+                replace_existing=True
+            )
+
+    @staticmethod
+    def _missed_expiries():
+        """Clients whose access ended (midnight after expiration_date) after the last apply."""
+        from app.extensions import db
+        from app.models.client import Client
+        from app.services.configuration_service import ConfigurationService
+        applied_at = ConfigurationService.last_applied_at()
+        if applied_at is None:
+            return 0
+        # Expiring on day D ends access at midnight of D + 1, later than applied_at iff D >= applied_at's day
+        return db.session.query(func.count(Client.id)).filter(
+            Client.expiration_date >= applied_at.date(),
+            Client.expiration_date < date.today()).scalar()
+
+    def client_changed(self, old_date=None, new_date=None):
+        """Record an add (new only), delete (old only) or edit (both) of a client."""
+        if not self.enabled:
+            return
+        old_date, new_date = _as_date(old_date), _as_date(new_date)
+        if old_date == new_date:
+            return
+        with self._lock:
+            if old_date in self._counts:
+                self._counts[old_date] -= 1
+                if self._counts[old_date] <= 0:
+                    del self._counts[old_date]
+            if new_date is not None and new_date >= date.today():
+                if new_date not in self._counts:
+                    heapq.heappush(self._heap, new_date)
+                    self._counts[new_date] = 0
+                self._counts[new_date] += 1
+            self._schedule_next()
+
+    def next_expiry(self):
+        """(expiration_date, run_at) of the next scheduled regeneration, or None."""
+        with self._lock:
+            self._drop_stale()
+            if not self._heap:
+                return None
+            return self._heap[0], self._run_at(self._heap[0])
+
+    @staticmethod
+    def _run_at(expiration_date):
+        return datetime.combine(expiration_date + timedelta(days=1), time.min)
+
+    def _drop_stale(self):
+        while self._heap and self._heap[0] not in self._counts:
+            heapq.heappop(self._heap)
+
+    def _schedule_next(self):
+        self._drop_stale()
+        if not self.enabled:
+            return
+        if not self._heap:
+            if self.scheduler.get_job(JOB_ID):
+                self.scheduler.remove_job(JOB_ID)
+            return
+        run_at = self._run_at(self._heap[0])
+        job = self.scheduler.get_job(JOB_ID)
+        if job and job.next_run_time and job.next_run_time.replace(tzinfo=None) == run_at:
+            return
+        self.scheduler.add_job(
+            id=JOB_ID,
+            func=self._on_expiry,
+            trigger='date',
+            run_date=run_at,
+            misfire_grace_time=None,  # still run if the process was busy at midnight
+            replace_existing=True
+        )
+        logging.info(f"Next client expiry regeneration scheduled for {run_at}")
+
+    def _on_expiry(self):
+        from app.services.auto_tasks import auto_generate_and_apply_config
+        with self._lock:
+            expired = [d for d in self._counts if d < date.today()]
+            for d in expired:
+                del self._counts[d]
+        logging.info(f"Client expiry reached for {', '.join(map(str, sorted(expired))) or 'no dates'}")
+        from app.services.configuration_service import PIPELINE_BUSY
+        success, result = auto_generate_and_apply_config(self.app)
+        if not success and result == PIPELINE_BUSY:
+            # The running pipeline may have read the DB before midnight
+            self.scheduler.add_job(
+                id=f"{JOB_ID}_retry",
+                func=self._on_expiry,
+                trigger='date',
+                run_date=datetime.now() + timedelta(minutes=1),
+                replace_existing=True
+            )
+        with self.app.app_context():
+            # Resync with the DB in case rows changed outside the service layer
+            self.rebuild()
+
+
+expiry_scheduler = ExpiryScheduler()
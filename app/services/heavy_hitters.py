@@ -0,0 +1,157 @@
+import heapq
+import json
+import time
+from collections import Counter, OrderedDict
+
+from app.services.log_store import log_store
+from app.services.traffic_rollup import is_denied
+
+# window name -> (span seconds, bucket width seconds)
+WINDOWS = OrderedDict([
+    ('1h', (3600, 300)),
+    ('24h', (86400, 3600)),
+    ('7d', (7 * 86400, 6 * 3600)),
+])
+TABLES = ('domains', 'denied', 'pairs')
+
+
+class SpaceSaving:
+    """
+    Space-Saving top-K summary: at most `capacity` counters. A new key
+    replaces the smallest counter and inherits its count as error, so for every
+    tracked key count - error <= true count <= count.
+    """
+
+    def __init__(self, capacity, counts=None, errors=None):
+        self.capacity = capacity
+        self.counts = counts or {}
+        self.errors = errors or {}
+        self._heap = [(c, k) for k, c in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def offer(self, key, weight=1):
+        if key in self.counts:
+            self.counts[key] += weight
+            heapq.heappush(self._heap, (self.counts[key], key))
+            return
+        error = 0
+        if len(self.counts) >= self.capacity:
+            # Pop stale heap entries until the real minimum counter turns up
+            while True:
+                count, victim = heapq.heappop(self._heap)
+                if self.counts.get(victim) == count:
+                    break
+            del self.counts[victim]
+            self.errors.pop(victim, None)
+            error = count
+        self.counts[key] = error + weight
+        if error:
+            self.errors[key] = error
+        heapq.heappush(self._heap, (self.counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c, k) for k, c in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def to_json(self):
+        return json.dumps({'c': self.counts, 'e': self.errors})
+
+    @classmethod
+    def from_json(cls, capacity, data):
+        data = json.loads(data)
+        return cls(capacity, data['c'], data['e'])
+
+
+def merge_top(summaries, n):
+    """Top n (key, count, error) over several summaries, counts and errors summed."""
+    counts, errors = Counter(), Counter()
+    for summary in summaries:
+        counts.update(summary.counts)
+        errors.update(summary.errors)
+    return [(key, count, errors[key]) for key, count in counts.most_common(n)]
+
+
+class HeavyHitters:
+    """
+    Fixed-memory top-K tables over sliding windows, fed by the log store ingester.
+
+    For each table (domains, denied domains, client->domain pairs) and window
+    (1h, 24h, 7d) the window is split into time buckets, each holding one
+    SpaceSaving summary of HEAVY_HITTERS_CAPACITY counters. Expired buckets
+    are dropped, and a query merges the live buckets, so memory does not grow
+    with traffic and answers never touch the log. The bucket summaries live in
+    the log store: each batch re-reads the buckets it touches inside the ingest
+    transaction, so ingesters in several processes add to each other's counts
+    instead of overwriting them, and a restart keeps the windows.
+    """
+
+    schema = """
+    CREATE TABLE IF NOT EXISTS heavy_hitter_bucket (
+        tbl TEXT NOT NULL,
+        win TEXT NOT NULL,
+        start INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (tbl, win, start)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    @property
+    def capacity(self):
+        return self.store.app.config.get('HEAVY_HITTERS_CAPACITY', 1000)
+
+    def _bucket(self, conn, table, window, start):
+        row = conn.execute('SELECT data FROM heavy_hitter_bucket WHERE tbl = ? AND win = ? AND start = ?',
+                           (table, window, start)).fetchone()
+        return SpaceSaving.from_json(self.capacity, row[0]) if row else SpaceSaving(self.capacity)
+
+    def ingest(self, conn, entries):
+        batch = Counter()
+        for entry in entries:
+            denied = is_denied(entry)
+            for window, (_, width) in WINDOWS.items():
+                start = int(entry.timestamp // width) * width
+                batch[('domains', window, start, entry.host)] += 1
+                if denied:
+                    batch[('denied', window, start, entry.host)] += 1
+                batch[('pairs', window, start, f"{entry.client} {entry.host}")] += 1
+        summaries = {}
+        # Heaviest keys first, so within a batch light keys are the ones evicted
+        for (table, window, start, key), count in sorted(batch.items(), key=lambda item: -item[1]):
+            summary = summaries.get((table, window, start))
+            if summary is None:
+                summary = summaries[(table, window, start)] = self._bucket(conn, table, window, start)
+            summary.offer(key, count)
+        conn.executemany(
+            'INSERT OR REPLACE INTO heavy_hitter_bucket (tbl, win, start, data) VALUES (?, ?, ?, ?)',
+            [(t, w, s, summary.to_json()) for (t, w, s), summary in summaries.items()])
+        self._expire(conn, time.time())
+
+    def _expire(self, conn, now):
+        for window, (span, width) in WINDOWS.items():
+            conn.execute('DELETE FROM heavy_hitter_bucket WHERE win = ? AND start <= ?',
+                         (window, now - span - width))
+
+    def top(self, table, window, n=50, now=None):
+        """
+        [{'key', 'count', 'min_count'}, ...] for the n heaviest keys of a table
+        over a window. count may overestimate by at most the reported error;
+        min_count is the guaranteed lower bound.
+        """
+        if table not in TABLES or window not in WINDOWS:
+            raise ValueError(f"Unknown table/window {table}/{window}")
+        span, width = WINDOWS[window]
+        now = now or time.time()
+        conn = self.store.connect()
+        try:
+            rows = conn.execute('SELECT data FROM heavy_hitter_bucket WHERE tbl = ? AND win = ? AND start > ?',
+                                (table, window, now - span - width)).fetchall()
+        finally:
+            conn.close()
+        live = [SpaceSaving.from_json(self.capacity, data) for (data,) in rows]
+        top = merge_top(live, n)
+        return [{'key': key, 'count': count, 'min_count': count - error} for key, count, error in top]
+
+
+heavy_hitters = HeavyHitters(log_store)
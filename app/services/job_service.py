@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+PIPELINE_STAGES = ('generate', 'apply', 'reload')
+
+
+class Job:
+    """State of one background generate/apply/reload run, as exposed by the job API."""
+
+    def __init__(self, kind, stages):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'queued'        # queued -> running -> succeeded | failed
+        self.created_at = datetime.now()
+        self.finished_at = None
+        self.stages = OrderedDict((name, {'status': 'pending', 'seconds': None}) for name in stages)
+        self.error = None
+        self.result = None
+        self._stage_started = {}
+
+    @property
+    def done(self):
+        return self.status in ('succeeded', 'failed')
+
+    def stage_progress(self, stage, success):
+        """Callback for ConfigurationService.generate_apply_reload(progress=...)."""
+        if success is None:
+            self._stage_started[stage] = time.perf_counter()
+            self.stages[stage]['status'] = 'running'
+            return
+        self.stages[stage]['status'] = 'succeeded' if success else 'failed'
+        self.stages[stage]['seconds'] = round(time.perf_counter() - self._stage_started[stage], 3)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'created_at': self.created_at.isoformat(timespec='seconds'),
+            'finished_at': self.finished_at.isoformat(timespec='seconds') if self.finished_at else None,
+            'stages': [dict(name=name, **stage) for name, stage in self.stages.items()],
+            'error': self.error,
+        }
+
+
+class JobService:
+    """
+    Runs generate/apply/reload off the request thread on a small worker pool.
+
+    Jobs live in memory only; the last CONFIG_JOB_HISTORY jobs can be polled
+    by ID. Submitting while a pipeline job is queued or running returns that
+    job instead of starting a second one.
+    """
+    _executor = None
+    _jobs = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _get_executor(app):
+        with JobService._lock:
+            if JobService._executor is None:
+                JobService._executor = ThreadPoolExecutor(
+                    max_workers=app.config.get('CONFIG_JOB_WORKERS', 2),
+                    thread_name_prefix='config-job'
+                )
+            return JobService._executor
+
+    @staticmethod
+    def submit_apply(app, force=False):
+        """Queue a generate/apply/reload run. Returns (job, created)."""
+        with JobService._lock:
+            for job in JobService._jobs.values():
+                if job.kind == 'one_click_apply' and not job.done:
+                    return job, False
+            job = Job('one_click_apply', PIPELINE_STAGES)
+            JobService._jobs[job.id] = job
+            history = app.config.get('CONFIG_JOB_HISTORY', 20)
+            while len(JobService._jobs) > history:
+                oldest = next(iter(JobService._jobs.values()))
+                if not oldest.done:
+                    break
+                JobService._jobs.popitem(last=False)
+        JobService._get_executor(app).submit(JobService._run_apply, app, job, force)
+        return job, True
+
+    @staticmethod
+    def get_job(job_id):
+        return JobService._jobs.get(job_id)
+
+    @staticmethod
+    def _run_apply(app, job, force):
+        from app.services.configuration_service import ConfigurationService
+        job.status = 'running'
+        try:
+            with app.app_context(), app.test_request_context():
+                success, result = ConfigurationService.generate_apply_reload(
+                    force=force, progress=job.stage_progress)
+        except Exception as e:
+            logging.error(f"Job {job.id} crashed: {e}")
+            success, result = False, str(e)
+        if success:
+            job.result = result
+        else:
+            job.error = result
+        job.finished_at = datetime.now()
+        job.status = 'succeeded' if success else 'failed'
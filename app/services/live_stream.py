@@ -0,0 +1,172 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+import psutil
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class Subscription:
+    """
+    Bounded event queue of one SSE client. When a slow client falls behind,
+    the oldest events are dropped (and counted) so the producer never blocks.
+    """
+
+    def __init__(self, maxlen):
+        self._events = deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, event):
+        with self._cond:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(event)
+            self._cond.notify()
+
+    def drain(self, timeout):
+        """Wait up to timeout seconds for events. Returns (events, dropped since last drain)."""
+        with self._cond:
+            if not self._events:
+                self._cond.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+            dropped, self.dropped = self.dropped, 0
+        return events, dropped
+
+
+class Broadcaster:
+    """
+    One shared producer per data source, fanned out to every SSE subscriber.
+
+    The producer thread starts with the first subscriber and stops after the
+    last one leaves, so nothing is sampled while nobody is watching. Subclasses
+    implement step(state) -> (events, state); state is None on the first step.
+    """
+    name = None
+    interval_key = None
+
+    def __init__(self):
+        self.app = None
+        self.state = None
+        self._step_lock = threading.Lock()   # serialises step(); taken before _lock
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def step(self, state):
+        raise NotImplementedError
+
+    def subscribe(self, poll_first=False):
+        """
+        Register a subscriber. Returns (subscription, state) where state is the
+        producer state as of the last event the subscription will not receive,
+        or (None, None) once STREAM_MAX_SUBSCRIBERS are already registered.
+        With poll_first, the producer steps once before registering.
+        """
+        sub = Subscription(self.app.config.get('STREAM_QUEUE_SIZE', 100))
+        with self._step_lock:
+            # Every subscribe() holds _step_lock, so the count cannot grow past the check
+            if self.subscriber_count >= self.app.config.get('STREAM_MAX_SUBSCRIBERS', 50):
+                return None, None
+            if poll_first:
+                self._poll_locked()
+            with self._lock:
+                self._subscribers.add(sub)
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=f"{self.name}-stream", daemon=True)
+                    self._thread.start()
+                return sub, self.state
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def _poll_locked(self):
+        try:
+            with self.app.app_context():
+                events, state = self.step(self.state)
+        except Exception as e:
+            logging.error(f"{self.name} stream producer failed: {e}")
+            return
+        with self._lock:
+            self.state = state
+            for sub in self._subscribers:
+                for event in events:
+                    sub.put(event)
+
+    def _run(self):
+        interval = self.app.config.get(self.interval_key, 1)
+        while True:
+            with self._step_lock:
+                with self._lock:
+                    if not self._subscribers:
+                        self._thread = None
+                        self.state = None
+                        return
+                self._poll_locked()
+            time.sleep(interval)
+
+
+class StatsBroadcaster(Broadcaster):
+    """Samples CPU, RAM and bandwidth once per STREAM_STATS_INTERVAL for all dashboards."""
+    name = 'stats'
+    interval_key = 'STREAM_STATS_INTERVAL'
+
+    def step(self, state):
+        now = time.perf_counter()
+        net_io = psutil.net_io_counters()
+        cpu_percent = psutil.cpu_percent(interval=0)
+        if state is None:
+            # cpu_percent(interval=0) and bandwidth both need a previous sample
+            return [], (now, net_io)
+        started, previous = state
+        elapsed = max(now - started, 1e-6)
+        bits = ((net_io.bytes_recv - previous.bytes_recv) + (net_io.bytes_sent - previous.bytes_sent)) * 8
+        stats = {
+            'cpu_percent': cpu_percent,
+            'ram_percent': psutil.virtual_memory().percent,
+            'bandwidth': f"{bits / elapsed / 1_000_000:.2f} Mbps"
+        }
+        return [('stats', stats)], (now, net_io)
+
+
+class LogTailBroadcaster(Broadcaster):
+    """
+    Follows the access log for all live log viewers: one LogService.tail() per
+    STREAM_LOG_POLL_SECONDS, unfiltered; each subscriber filters its own copy.
+    """
+    name = 'log'
+    interval_key = 'STREAM_LOG_POLL_SECONDS'
+
+    def step(self, state):
+        from app.services.log_service import LogFilter, LogService
+        if state is None:
+            return [], LogService.log_cursor()
+        try:
+            res = LogService.tail(state['inode'], state['offset'], LogFilter())
+        except FileNotFoundError:
+            # Between squid -k rotate and the new file being created
+            return [], state
+        cursor = {'inode': res['inode'], 'offset': res['offset']}
+        if not res['entries'] and not res['reset']:
+            return [], cursor
+        return [('log', {'reset': res['reset'], 'entries': res['entries']})], cursor
+
+
+stats_stream = StatsBroadcaster()
+log_stream = LogTailBroadcaster()
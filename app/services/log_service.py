@@ -1,13 +1,338 @@
-import subprocess
+import logging
 import os
+import time
+import ipaddress
+from collections import namedtuple
 
 from flask import current_app
 
+# One line of Squid's native access.log format:
+# time elapsed client code/status bytes method URL user hierarchy/from type
+AccessLogEntry = namedtuple('AccessLogEntry', [
+    'timestamp', 'elapsed', 'client', 'result', 'status', 'size', 'method', 'url', 'host', 'raw'
+])
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def url_host(method, url):
+    """Destination host of a logged request (CONNECT logs host:port, others a full URL)."""
+    if method == 'CONNECT':
+        return url.rsplit(':', 1)[0].strip('[]').lower()
+    if '://' in url:
+        url = url.split('://', 1)[1]
+    host = url.split('/', 1)[0].rsplit('@', 1)[-1]
+    if host.startswith('['):
+        return host[1:host.find(']')].lower()
+    return host.split(':', 1)[0].lower()
+
+
+def parse_access_line(line):
+    """Parse a native-format access.log line, None if it does not look like one."""
+    fields = line.split(None, 9)
+    if len(fields) < 7:
+        return None
+    try:
+        timestamp = float(fields[0])
+        elapsed = int(fields[1])
+        size = int(fields[4])
+    except ValueError:
+        return None
+    result, _, status = fields[3].partition('/')
+    method, url = fields[5], fields[6]
+    return AccessLogEntry(timestamp, elapsed, fields[2], result, status, size, method, url,
+                          url_host(method, url), line.rstrip('\n'))
+
+
+def reverse_lines(path, block_size=READ_BLOCK_SIZE, max_bytes=None, end=None):
+    """
+    Yield the lines of a file from last to first, reading fixed-size blocks
+    from the end (or from byte offset `end`). With max_bytes, stop after
+    reading that much of the file.
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell() if end is None else min(end, f.tell())
+        floor = max(position - max_bytes, 0) if max_bytes else 0
+        tail = b''
+        while position > floor:
+            step = min(block_size, position - floor)
+            position -= step
+            f.seek(position)
+            chunk = f.read(step) + tail
+            lines = chunk.split(b'\n')
+            tail = lines.pop(0)  # may continue in the previous block
+            for line in reversed(lines):
+                if line:
+                    yield line.decode('utf-8', errors='replace')
+        # A line cut by max_bytes is incomplete; only the file's first line is whole
+        if tail and floor == 0:
+            yield tail.decode('utf-8', errors='replace')
+
+
+def _line_at(f, position):
+    """
+    (start, end, timestamp) of the first parsable line starting at or after
+    byte `position`, resynchronising on the next newline. end and timestamp
+    are None if no complete line follows.
+    """
+    if position > 0:
+        f.seek(position - 1)
+        f.readline()  # rest of the line containing position - 1
+    else:
+        f.seek(0)
+    while True:
+        start = f.tell()
+        line = f.readline()
+        if not line.endswith(b'\n'):
+            return start, None, None  # end of file, or a line still being written
+        try:
+            return start, f.tell(), float(line.split(None, 1)[0])
+        except (ValueError, IndexError):
+            continue
+
+
+def seek_time(path, timestamp, after=False):
+    """
+    Byte offset of the first parsable line logged at or after `timestamp`
+    (strictly after with after=True), found by bisecting the file on byte
+    offsets: about log2(file size) short reads, whatever the size of the log.
+    Relies on lines being appended in time order, as Squid does; a line out
+    of order only blurs the boundary by that line. If no complete line
+    qualifies, returns the end of the last complete line.
+    """
+    with open(path, 'rb') as f:
+        lo, hi = 0, os.fstat(f.fileno()).st_size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            _, end, line_time = _line_at(f, mid)
+            if end is not None and (line_time <= timestamp if after else line_time < timestamp):
+                lo = end
+            else:
+                hi = mid
+        # lo may precede unparsable lines; point at the first real entry
+        return _line_at(f, lo)[0]
+
+
+class LogFilter:
+    """
+    Field filters for access-log entries. Every criterion is optional:
+    client (IP or CIDR), status ('ANY', 'SUCCESS' = 2xx, 'DENIED' = *_DENIED or
+    403), result (substring of the Squid result code), method, domain (host or
+    any subdomain of it), since/until (epoch seconds).
+    """
+
+    def __init__(self, client=None, status='ANY', result=None, method=None, domain=None,
+                 since=None, until=None):
+        self.client = client or None
+        self.network = None
+        if self.client and '/' in self.client:
+            self.network = ipaddress.ip_network(self.client, strict=False)  # ValueError on bad input
+        self.status = (status or 'ANY').upper()
+        self.result = (result or '').upper() or None
+        self.method = (method or '').upper() or None
+        self.domain = (domain or '').strip().lower().lstrip('.') or None
+        self.since = since
+        self.until = until
+
+    @property
+    def active(self):
+        return any((self.client, self.status != 'ANY', self.result, self.method, self.domain,
+                    self.since is not None, self.until is not None))
+
+    def matches(self, entry):
+        if self.until is not None and entry.timestamp > self.until:
+            return False
+        if self.since is not None and entry.timestamp < self.since:
+            return False
+        if self.network is not None:
+            try:
+                if ipaddress.ip_address(entry.client) not in self.network:
+                    return False
+            except ValueError:
+                return False
+        elif self.client and entry.client != self.client:
+            return False
+        if self.status == 'SUCCESS' and not entry.status.startswith('2'):
+            return False
+        if self.status == 'DENIED' and 'DENIED' not in entry.result and entry.status != '403':
+            return False
+        if self.result and self.result not in entry.result:
+            return False
+        if self.method and entry.method != self.method:
+            return False
+        if self.domain and entry.host != self.domain and not entry.host.endswith('.' + self.domain):
+            return False
+        return True
+
+
 class LogService:
     @staticmethod
-    def get_logs(ip_filter=None, status_filter="ANY"):
+    def client_hit_counts(window_hours=24, log_path=None, now=None):
+        """
+        Requests per client address over the last window_hours of the access log.
+        Answered from the log store when it is in use, otherwise by reading
+        backwards from the end of the file up to the first line older than the
+        window, or at most LOG_SCAN_MAX_BYTES. Returns
+        ({client: [requests, connect_requests]}, lines_read); the counts are
+        None when the window does not fit in the cap, as they would rank only
+        the most recent traffic.
+        """
+        since = (now or time.time()) - window_hours * 3600
+        if log_path is None:
+            from app.services.log_store import log_store
+            if log_store.usable():
+                return log_store.client_hit_counts(since)
+        log_path = log_path or current_app.config.get('SQUID_ACCESS_LOG', '/var/log/squid/access.log')
+        counts = {}
+        lines_read = 0
+        if not os.path.exists(log_path):
+            return counts, lines_read
+        max_bytes = current_app.config.get('LOG_SCAN_MAX_BYTES', 64 * 1024 * 1024)
+        for line in reverse_lines(log_path, max_bytes=max_bytes):
+            entry = parse_access_line(line)
+            if entry is None:
+                continue
+            if entry.timestamp < since:
+                break
+            lines_read += 1
+            counter = counts.get(entry.client)
+            if counter is None:
+                counter = counts[entry.client] = [0, 0]
+            counter[0] += 1
+            if entry.method == 'CONNECT':
+                counter[1] += 1
+        else:
+            if os.path.getsize(log_path) > max_bytes:
+                logging.warning(f"Hit counts: {window_hours}h window exceeds LOG_SCAN_MAX_BYTES "
+                                f"({max_bytes} bytes) of {log_path}")
+                return None, lines_read
+        return counts, lines_read
+
+    @staticmethod
+    def log_cursor(log_path=None):
+        """
+        {'inode', 'offset'} just past the last complete line of the access log,
+        the starting point for tail(). None if the log does not exist.
+        """
+        log_path = log_path or current_app.config.get('SQUID_ACCESS_LOG', '/var/log/squid/access.log')
+        try:
+            with open(log_path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                offset = st.st_size
+                # Do not hand out a cursor in the middle of a line being written
+                f.seek(max(offset - READ_BLOCK_SIZE, 0))
+                block = f.read(offset - f.tell())
+                if block and not block.endswith(b'\n'):
+                    offset -= len(block) - (block.rfind(b'\n') + 1)
+        except FileNotFoundError:
+            return None
+        return {'inode': st.st_ino, 'offset': offset}
+
+    @staticmethod
+    def read_appended(inode, offset, log_path=None, max_bytes=None):
+        """
+        Parse up to max_bytes of whole lines written after (inode, offset).
+        If the inode changed (squid -k rotate) or the file shrank, reading
+        restarts at the beginning of the current file and `reset` is True.
+        Returns (inode, new_offset, reset, [AccessLogEntry, ...]).
+        """
+        log_path = log_path or current_app.config.get('SQUID_ACCESS_LOG', '/var/log/squid/access.log')
+        if max_bytes is None:
+            max_bytes = current_app.config.get('LOG_TAIL_MAX_BYTES', 1024 * 1024)
+        with open(log_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            reset = inode != st.st_ino or offset is None or offset > st.st_size
+            if reset:
+                offset = 0
+            f.seek(offset)
+            data = f.read(min(st.st_size - offset, max_bytes))
+        complete = data.rfind(b'\n') + 1
+        entries = []
+        for line in data[:complete].decode('utf-8', errors='replace').splitlines():
+            entry = parse_access_line(line)
+            if entry is not None:
+                entries.append(entry)
+        return st.st_ino, offset + complete, reset, entries
+
+    @staticmethod
+    def tail(inode, offset, log_filter, log_path=None, max_bytes=None):
+        """
+        Lines appended since a cursor from log_cursor()/tail(), parsed and
+        filtered (see read_appended for rotation handling). Reads at most
+        LOG_TAIL_MAX_BYTES, so work per call follows new traffic.
+        Returns {'inode', 'offset', 'reset', 'entries': [dict, ...]}.
+        """
+        inode, offset, reset, entries = LogService.read_appended(inode, offset, log_path, max_bytes)
+        entries = [entry._asdict() for entry in entries if log_filter.matches(entry)]
+        return {'inode': inode, 'offset': offset, 'reset': reset, 'entries': entries}
+
+    @staticmethod
+    def read_window(since=None, until=None, log_path=None):
+        """
+        Yield the AccessLogEntry of every line logged between since and until
+        (epoch seconds, either may be None), oldest first. The start is found
+        with seek_time(), so only the window itself is read from disk.
+        """
+        log_path = log_path or current_app.config.get('SQUID_ACCESS_LOG', '/var/log/squid/access.log')
+        start = seek_time(log_path, since) if since is not None else 0
+        with open(log_path, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # still being written
+                entry = parse_access_line(line.decode('utf-8', errors='replace'))
+                if entry is None:
+                    continue
+                if until is not None and entry.timestamp > until:
+                    break
+                yield entry
+
+    @staticmethod
+    def search(log_filter, limit=500, log_path=None, max_bytes=None, end=None):
+        """
+        Newest-first entries matching log_filter, read backwards from the end of
+        the access log, or from the end of log_filter.until located with
+        seek_time(). Stops at `limit` matches, at the first entry older than
+        log_filter.since, or after LOG_SCAN_MAX_BYTES. Unparsable lines are kept
+        only when no filter is active.
+        Returns (lines, {'scanned': lines read, 'truncated': hit the byte cap, 'max_bytes'}).
         """
-        Fetch Squid access logs filtered by IP and Status.
+        log_path = log_path or current_app.config.get('SQUID_ACCESS_LOG', '/var/log/squid/access.log')
+        if max_bytes is None:
+            max_bytes = current_app.config.get('LOG_SCAN_MAX_BYTES', 64 * 1024 * 1024)
+        if log_filter.until is not None:
+            window_end = seek_time(log_path, log_filter.until, after=True)
+            end = window_end if end is None else min(end, window_end)
+        matched = []
+        scanned = 0
+        stopped = False
+        for line in reverse_lines(log_path, max_bytes=max_bytes, end=end):
+            scanned += 1
+            entry = parse_access_line(line)
+            if entry is None:
+                if not log_filter.active:
+                    matched.append(line)
+            else:
+                if log_filter.since is not None and entry.timestamp < log_filter.since:
+                    stopped = True
+                    break
+                if log_filter.matches(entry):
+                    matched.append(entry.raw)
+            if len(matched) >= limit:
+                stopped = True
+                break
+        scan_end = os.path.getsize(log_path) if end is None else end
+        truncated = not stopped and bool(max_bytes) and scan_end > max_bytes
+        return matched, {'scanned': scanned, 'truncated': truncated, 'max_bytes': max_bytes}
+
+    @staticmethod
+    def get_logs(ip_filter=None, status_filter="ANY", cursor=None, **filters):
+        """
+        Fetch the last matching Squid access log lines (oldest first) as text.
+        Extra keyword filters: result, method, domain, since, until (see LogFilter).
+        With a cursor from log_cursor(), only lines before it are returned, so
+        tail() can continue from there without gaps or duplicates.
         Mocked on Windows.
         """
         if os.name == 'nt':
@@ -17,34 +342,44 @@ class LogService:
 
         if not os.path.exists(log_file_path):
             return f"Log file not found at: {log_file_path}"
-            
+
         try:
-            # Use 'sudo' if necessary, but requires sudoers config. 
-            # Assuming the app user has read access log file.
-            base_command = f"tail -n 500 {log_file_path}"
-            
-            if ip_filter:
-                # Sanitize ip_filter to prevent injection (basic check)
-                if not all(c.isalnum() or c in '.:' for c in ip_filter):
-                     return "Invalid IP Filter"
-                base_command += f" | grep {ip_filter}"
-            
-            if status_filter == "SUCCESS":
-                base_command += " | grep TCP_TUNNEL"
-            elif status_filter == "DENIED":
-                base_command += " | grep TCP_DENIED"
-
-            # Use subprocess securely? grep injection is possible if not careful.
-            # Using shell=True with user input is bad practice.
-            # Ideally use python filtering or list args.
-            # But adhering to original logic but safer:
-            
-            logs = subprocess.check_output(base_command, shell=True, text=True)
-            return logs
-        except subprocess.CalledProcessError as e:
-            # grep returns exit code 1 if no matches found, which check_output treats as error
-            if e.returncode == 1:
+            log_filter = LogFilter(client=ip_filter, status=status_filter, **filters)
+        except ValueError:
+            return "Invalid IP Filter"
+
+        try:
+            limit = current_app.config.get('LOG_VIEW_LINES', 500)
+            lines, info = LogService.search(log_filter, limit=limit, log_path=log_file_path,
+                                            end=cursor['offset'] if cursor else None)
+            if not lines:
                 return "No matching logs found."
-            return f"Error fetching logs: {e}"
+            lines.reverse()
+            logs = '\n'.join(lines) + '\n'
+            if info['truncated']:
+                logs = f"# Only the last {info['max_bytes'] // (1024 * 1024)} MB were searched\n" + logs
+            return logs
         except Exception as e:
             return f"Unexpected error: {e}"
+
+    @staticmethod
+    def get_log_view(ip_filter=None, status_filter="ANY", **filters):
+        """
+        (text, cursor) for the Logs page: the last matching lines, oldest first,
+        and the {'inode', 'offset'} cursor live tailing should continue from.
+        Served from the indexed log store once it has ingested the log,
+        otherwise read from the file.
+        """
+        from app.services.log_store import log_store
+        if os.name == 'nt' or not log_store.usable():
+            cursor = LogService.log_cursor() if os.name != 'nt' else None
+            return LogService.get_logs(ip_filter, status_filter, cursor=cursor, **filters), cursor
+        try:
+            log_filter = LogFilter(client=ip_filter, status=status_filter, **filters)
+        except ValueError:
+            return "Invalid IP Filter", None
+        lines, cursor = log_store.search(log_filter, limit=current_app.config.get('LOG_VIEW_LINES', 500))
+        if not lines:
+            return "No matching logs found.", cursor
+        lines.reverse()
+        return '\n'.join(lines) + '\n', cursor
@@ -0,0 +1,356 @@
+import ipaddress
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from app.services.log_service import AccessLogEntry, LogService
+
+JOB_ID = 'log_ingest'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS access_entry (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    client TEXT NOT NULL,
+    client_num INTEGER,          -- IPv4 address as an integer, for CIDR range scans
+    result TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    method TEXT NOT NULL,
+    rhost TEXT NOT NULL,         -- host labels reversed (com.example.www), for suffix scans
+    raw TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_access_entry_ts ON access_entry (ts);
+CREATE INDEX IF NOT EXISTS ix_access_entry_client ON access_entry (client, ts);
+CREATE INDEX IF NOT EXISTS ix_access_entry_client_num ON access_entry (client_num, ts);
+CREATE INDEX IF NOT EXISTS ix_access_entry_result ON access_entry (result, ts);
+CREATE INDEX IF NOT EXISTS ix_access_entry_rhost ON access_entry (rhost, ts);
+CREATE TABLE IF NOT EXISTS ingest_state (
+    log_path TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Where `squid -k rotate` (access.log.0) and logrotate (access.log.1) move the old file
+ROTATED_SUFFIXES = ('.0', '.1')
+
+
+def reverse_host(host):
+    return '.'.join(reversed(host.split('.')))
+
+
+def _ipv4_num(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return None
+    return int(ip) if ip.version == 4 else None
+
+
+def _status_num(status):
+    return int(status) if status.isdigit() else 0
+
+
+def _row_entry(row):
+    ts, client, result, status, size, method, rhost, raw = row
+    return AccessLogEntry(ts, None, client, result, f"{status:03d}", size, method, None,
+                          reverse_host(rhost), raw)
+
+
+class LogStore:
+    """
+    Indexed SQLite copy of the Squid access log, kept in its own database file.
+
+    A scheduler job ingests newly appended lines every LOG_INGEST_INTERVAL
+    seconds. Each batch reads the (inode, offset) cursor, stores the rows and
+    advances the cursor in one BEGIN IMMEDIATE transaction, so a restart
+    resumes exactly where ingestion stopped and ingesters in other processes
+    never store the same batch twice. After a
+    rotation the rest of the old file is read from its rotated name before
+    the new file is started. Rows older than LOG_STORE_RETENTION_DAYS are
+    pruned. Consumers registered with register() see every ingested batch in
+    the same transaction, which lets aggregates live alongside the rows.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._consumers = []
+        self._ingest_lock = threading.Lock()
+        self._schema_ready = set()
+
+    def init_app(self, app, scheduler=None):
+        self.app = app
+        if scheduler is not None and self.enabled:
+            scheduler.add_job(
+                id=JOB_ID,
+                func=self.ingest,
+                trigger='interval',
+                seconds=app.config.get('LOG_INGEST_INTERVAL', 15),
+                max_instances=1,
+                replace_existing=True
+            )
+
+    def register(self, consumer):
+        """
+        Add an object with ingest(conn, entries) and optionally schema (SQL) and
+        prune(conn, cutoff_ts), called inside the ingestion transaction.
+        """
+        if consumer not in self._consumers:
+            self._consumers.append(consumer)
+            self._schema_ready.clear()
+
+    @property
+    def enabled(self):
+        return self.app is not None and self.app.config.get('LOG_STORE_ENABLED', False)
+
+    @property
+    def path(self):
+        return self.app.config.get('LOG_STORE_PATH', 'db/access_log.db')
+
+    @property
+    def log_path(self):
+        return self.app.config.get('SQUID_ACCESS_LOG', '/var/log/squid/access.log')
+
+    def connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if self.path not in self._schema_ready:
+            conn.executescript(SCHEMA)
+            for consumer in self._consumers:
+                if getattr(consumer, 'schema', None):
+                    conn.executescript(consumer.schema)
+            self._schema_ready.add(self.path)
+        return conn
+
+    def cursor(self, conn=None):
+        """{'inode', 'offset'} ingested so far for the configured log, or None."""
+        if conn is None:
+            if not os.path.exists(self.path):
+                return None
+            conn = self.connect()
+            try:
+                return self.cursor(conn)
+            finally:
+                conn.close()
+        row = conn.execute('SELECT inode, offset FROM ingest_state WHERE log_path = ?',
+                           (self.log_path,)).fetchone()
+        return {'inode': row[0], 'offset': row[1]} if row else None
+
+    def usable(self):
+        """True once the store has ingested the configured log and can answer queries."""
+        return self.enabled and self.cursor() is not None
+
+    # Ingestion
+
+    def ingest(self, max_batches=None):
+        """
+        Ingest everything appended since the last run, in LOG_INGEST_BATCH_BYTES
+        batches. Returns the number of rows stored.
+        """
+        if not os.path.exists(self.log_path):
+            return 0
+        with self._ingest_lock, self.app.app_context():
+            conn = self.connect()
+            try:
+                stored = self._ingest(conn, max_batches)
+                self.prune(conn)
+                return stored
+            finally:
+                conn.close()
+
+    def _ingest(self, conn, max_batches):
+        batch_bytes = self.app.config.get('LOG_INGEST_BATCH_BYTES', 4 * 1024 * 1024)
+        cutoff = time.time() - self.app.config.get('LOG_STORE_RETENTION_DAYS', 14) * 86400
+        stored = batches = 0
+        while max_batches is None or batches < max_batches:
+            # The cursor is read, the batch stored and the cursor advanced in one
+            # write transaction, so ingesters in other processes take turns
+            # instead of storing the same batch twice
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                step = self._ingest_step(conn, batch_bytes, cutoff)
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+            if step is None:
+                break
+            if step >= 0:
+                stored += step
+                batches += 1
+        return stored
+
+    def _ingest_step(self, conn, batch_bytes, cutoff):
+        """
+        Ingest one batch from the stored cursor. Returns the rows stored, -1 if
+        the cursor only moved (overlong line skipped, rotated file finished),
+        or None once the live file is caught up.
+        """
+        state = self.cursor(conn)
+        current_inode = os.stat(self.log_path).st_ino
+        path = self.log_path
+        if state and state['inode'] != current_inode:
+            # Finish the rotated file first so the lines written just before rotation are kept
+            path = self._rotated_path(state['inode'])
+            if path is None:
+                logging.warning(f"Log store: rotated file for inode {state['inode']} not found, "
+                                f"starting {self.log_path} from the beginning")
+                path = self.log_path
+        inode, offset = (state['inode'], state['offset']) if state else (current_inode, 0)
+
+        new_inode, new_offset, _, entries = LogService.read_appended(
+            inode, offset, log_path=path, max_bytes=batch_bytes)
+        if (new_inode, new_offset) == (inode, offset):
+            skip_to = self._skip_overlong_line(path, offset, batch_bytes)
+            if skip_to is not None:
+                logging.warning(f"Log store: skipped a line longer than {batch_bytes} bytes "
+                                f"at {path}:{offset}")
+                self._save_cursor(conn, inode, skip_to)
+                return -1
+            if path == self.log_path:
+                return None
+            # Rotated file fully read: continue with the live file from the start
+            self._save_cursor(conn, current_inode, 0)
+            return -1
+        entries = [e for e in entries if e.timestamp >= cutoff]
+        self._store(conn, entries)
+        self._save_cursor(conn, new_inode, new_offset)
+        return len(entries)
+
+    @staticmethod
+    def _skip_overlong_line(path, offset, batch_bytes):
+        """
+        Offset just past a line starting at offset that does not fit in one
+        batch, or None if the batch was not full or the line is unterminated.
+        """
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size - offset < batch_bytes:
+                return None
+            position = offset + batch_bytes
+            f.seek(position)
+            while True:
+                chunk = f.read(batch_bytes)
+                if not chunk:
+                    return None
+                newline = chunk.find(b'\n')
+                if newline != -1:
+                    return position + newline + 1
+                position += len(chunk)
+
+    def _rotated_path(self, inode):
+        for suffix in ROTATED_SUFFIXES:
+            candidate = self.log_path + suffix
+            try:
+                if os.stat(candidate).st_ino == inode:
+                    return candidate
+            except FileNotFoundError:
+                continue
+        return None
+
+    def _save_cursor(self, conn, inode, offset):
+        conn.execute(
+            'INSERT INTO ingest_state (log_path, inode, offset, updated_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(log_path) DO UPDATE SET inode = excluded.inode, offset = excluded.offset, '
+            'updated_at = excluded.updated_at',
+            (self.log_path, inode, offset, time.time()))
+
+    def _store(self, conn, entries):
+        if not entries:
+            return
+        conn.executemany(
+            'INSERT INTO access_entry (ts, client, client_num, result, status, size, method, rhost, raw) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(e.timestamp, e.client, _ipv4_num(e.client), e.result, _status_num(e.status), e.size,
+              e.method, reverse_host(e.host), e.raw) for e in entries])
+        for consumer in self._consumers:
+            consumer.ingest(conn, entries)
+
+    def prune(self, conn):
+        cutoff = time.time() - self.app.config.get('LOG_STORE_RETENTION_DAYS', 14) * 86400
+        conn.execute('DELETE FROM access_entry WHERE ts < ?', (cutoff,))
+        for consumer in self._consumers:
+            if hasattr(consumer, 'prune'):
+                consumer.prune(conn, cutoff)
+        conn.commit()
+
+    # Queries
+
+    def search(self, log_filter, limit=500):
+        """
+        Newest-first raw lines matching a LogFilter, answered from the indexes.
+        Returns (lines, cursor): cursor is the ingest position the lines are
+        consistent with, read in the same transaction.
+        """
+        where, params = [], []
+        if log_filter.since is not None:
+            where.append('ts >= ?')
+            params.append(log_filter.since)
+        if log_filter.until is not None:
+            where.append('ts <= ?')
+            params.append(log_filter.until)
+        post_filter = None
+        if log_filter.network is not None:
+            if log_filter.network.version == 4:
+                where.append('client_num BETWEEN ? AND ?')
+                params += [int(log_filter.network.network_address), int(log_filter.network.broadcast_address)]
+            else:
+                post_filter = log_filter.matches
+        elif log_filter.client:
+            where.append('client = ?')
+            params.append(log_filter.client)
+        if log_filter.status == 'SUCCESS':
+            where.append('status BETWEEN 200 AND 299')
+        elif log_filter.status == 'DENIED':
+            where.append("(result LIKE '%DENIED%' OR status = 403)")
+        if log_filter.result:
+            where.append("result LIKE ? ESCAPE '\\'")
+            params.append('%' + log_filter.result.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if log_filter.method:
+            where.append('method = ?')
+            params.append(log_filter.method)
+        if log_filter.domain:
+            # host == domain, or any subdomain: a prefix range on the reversed host
+            rdomain = reverse_host(log_filter.domain)
+            where.append('(rhost = ? OR (rhost >= ? AND rhost < ?))')
+            params += [rdomain, rdomain + '.', rdomain + '/']
+        sql = ('SELECT ts, client, result, status, size, method, rhost, raw FROM access_entry'
+               + (' WHERE ' + ' AND '.join(where) if where else '')
+               + ' ORDER BY ts DESC, id DESC')
+        if post_filter is None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN')  # one snapshot for the rows and the cursor
+            lines = []
+            for row in conn.execute(sql, params):
+                if post_filter is None or post_filter(_row_entry(row)):
+                    lines.append(row[-1])
+                    if len(lines) >= limit:
+                        break
+            cursor = self.cursor(conn)
+            conn.rollback()
+        finally:
+            conn.close()
+        return lines, cursor
+
+    def client_hit_counts(self, since):
+        """({client: [requests, connect_requests]}, rows counted) for entries since epoch `since`."""
+        conn = self.connect()
+        try:
+            rows = conn.execute(
+                "SELECT client, COUNT(*), SUM(method = 'CONNECT') FROM access_entry "
+                "WHERE ts >= ? GROUP BY client", (since,)).fetchall()
+        finally:
+            conn.close()
+        return {client: [n, connects] for client, n, connects in rows}, sum(row[1] for row in rows)
+
+
+log_store = LogStore()
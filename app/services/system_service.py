@@ -2,6 +2,7 @@ import os
 import psutil
 import time
 import re
+import socket
 from datetime import datetime
 
 class SystemService:
@@ -47,6 +48,55 @@ class SystemService:
             pass
         return None
 
+    @staticmethod
+    def probe_squid_tcp(host, port, timeout=1.0):
+        """
+        Readiness probe: Squid accepts TCP connections on its http_port.
+        The listening socket stays open across `systemctl reload`, so this
+        passes immediately, before the new configuration is loaded.
+        """
+        try:
+            with socket.create_connection((host, int(port)), timeout=timeout):
+                return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def probe_squid_cachemgr(host, port, timeout=1.0):
+        """
+        Readiness probe: Squid answers a cache manager `info` request. Squid
+        only answers once it is done reconfiguring, so any HTTP response counts,
+        including a 403 when manager access from host is not allowed.
+        """
+        request = (
+            f"GET /squid-internal-mgr/info HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\nConnection: close\r\n\r\n"
+        )
+        try:
+            with socket.create_connection((host, int(port)), timeout=timeout) as sock:
+                sock.settimeout(timeout)
+                sock.sendall(request.encode('ascii'))
+                status_line = sock.recv(64).split(b'\r\n', 1)[0]
+            return status_line.startswith(b'HTTP/')
+        except OSError:
+            return False
+
+    @staticmethod
+    def wait_for_squid_ready(probe, host, port, timeout=30, interval=0.2):
+        """
+        Call probe(host, port, timeout) until it returns True.
+        Returns the seconds waited, or None if Squid was not ready within timeout.
+        The wait is only as meaningful as the probe: probe_squid_tcp succeeds
+        while Squid is still reconfiguring, probe_squid_cachemgr does not.
+        """
+        started = time.perf_counter()
+        while True:
+            if probe(host, port, min(interval * 5, timeout)):
+                return time.perf_counter() - started
+            if time.perf_counter() - started >= timeout:
+                return None
+            time.sleep(interval)
+
     @staticmethod
     def get_squid_port():
         """Detect Squid proxy port from configuration file."""
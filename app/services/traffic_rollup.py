@@ -0,0 +1,172 @@
+import ipaddress
+import time
+from datetime import datetime
+
+from app.services.log_store import log_store
+
+HOUR = 3600
+
+
+def hour_of(ts):
+    return int(ts // HOUR) * HOUR
+
+
+def is_denied(entry):
+    return 'DENIED' in entry.result or entry.status == '403'
+
+
+class TrafficRollup:
+    """
+    Hourly per-client traffic, maintained by the log store ingester.
+
+    Each ingested batch is folded into client_hourly (requests, bytes, denied,
+    distinct domains per client IP and hour); the (client, hour, host) pairs
+    behind the distinct count are kept in client_hour_domain. Usage views read
+    these small tables and never the raw log. Hourly rows are kept for
+    LOG_ROLLUP_RETENTION_DAYS, domain pairs only as long as the log store rows.
+    """
+
+    schema = """
+    CREATE TABLE IF NOT EXISTS client_hourly (
+        client TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        requests INTEGER NOT NULL DEFAULT 0,
+        bytes INTEGER NOT NULL DEFAULT 0,
+        denied INTEGER NOT NULL DEFAULT 0,
+        domains INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (client, hour)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS ix_client_hourly_hour ON client_hourly (hour);
+    CREATE TABLE IF NOT EXISTS client_hour_domain (
+        client TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        host TEXT NOT NULL,
+        PRIMARY KEY (client, hour, host)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS ix_client_hour_domain_hour ON client_hour_domain (hour);
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def ingest(self, conn, entries):
+        totals = {}
+        hosts = set()
+        for entry in entries:
+            key = (entry.client, hour_of(entry.timestamp))
+            counter = totals.get(key)
+            if counter is None:
+                counter = totals[key] = [0, 0, 0]
+            counter[0] += 1
+            counter[1] += entry.size
+            if is_denied(entry):
+                counter[2] += 1
+            hosts.add(key + (entry.host,))
+        conn.executemany(
+            'INSERT INTO client_hourly (client, hour, requests, bytes, denied) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(client, hour) DO UPDATE SET requests = requests + excluded.requests, '
+            'bytes = bytes + excluded.bytes, denied = denied + excluded.denied',
+            [key + tuple(counter) for key, counter in totals.items()])
+        conn.executemany('INSERT OR IGNORE INTO client_hour_domain (client, hour, host) VALUES (?, ?, ?)', hosts)
+        conn.executemany(
+            'UPDATE client_hourly SET domains = (SELECT COUNT(*) FROM client_hour_domain d '
+            'WHERE d.client = ? AND d.hour = ?) WHERE client = ? AND hour = ?',
+            [key + key for key in totals])
+
+    def prune(self, conn, cutoff):
+        conn.execute('DELETE FROM client_hour_domain WHERE hour < ?', (hour_of(cutoff),))
+        days = self.store.app.config.get('LOG_ROLLUP_RETENTION_DAYS', 90)
+        conn.execute('DELETE FROM client_hourly WHERE hour < ?', (hour_of(time.time() - days * 86400),))
+
+    @staticmethod
+    def _since(hours, now=None):
+        return hour_of((now or time.time()) - (hours - 1) * HOUR)
+
+    def usage_by_client(self, hours=24, now=None):
+        """
+        {client IP: {'requests', 'bytes', 'denied', 'domains'}} over the last
+        `hours` hours (current hour included); domains counts distinct hosts.
+        """
+        since = self._since(hours, now)
+        conn = self.store.connect()
+        try:
+            usage = {
+                client: {'requests': requests, 'bytes': size, 'denied': denied, 'domains': 0}
+                for client, requests, size, denied in conn.execute(
+                    'SELECT client, SUM(requests), SUM(bytes), SUM(denied) FROM client_hourly '
+                    'WHERE hour >= ? GROUP BY client', (since,))
+            }
+            for client, domains in conn.execute(
+                    'SELECT client, COUNT(DISTINCT host) FROM client_hour_domain '
+                    'WHERE hour >= ? GROUP BY client', (since,)):
+                if client in usage:
+                    usage[client]['domains'] = domains
+        finally:
+            conn.close()
+        return usage
+
+    def usage_for_network(self, network, usage, hours=24, now=None):
+        """Usage of a client entry that is a network: its member IPs from usage_by_client() summed."""
+        members = [ip for ip in usage if _in_network(ip, network)]
+        if not members:
+            return None
+        total = {
+            key: sum(usage[ip][key] for ip in members) for key in ('requests', 'bytes', 'denied')
+        }
+        total['domains'] = self._distinct_domains(members, self._since(hours, now))
+        return total
+
+    def _distinct_domains(self, clients, since):
+        conn = self.store.connect()
+        try:
+            marks = ','.join('?' * len(clients))
+            return conn.execute(
+                f'SELECT COUNT(DISTINCT host) FROM client_hour_domain WHERE hour >= ? AND client IN ({marks})',
+                [since] + clients).fetchone()[0]
+        finally:
+            conn.close()
+
+    def series(self, address, hours=24, now=None):
+        """
+        Hourly series for a client IP or network, oldest first:
+        {'labels', 'requests', 'bytes', 'denied', 'domains'}. Hours without
+        traffic are zero; for a network, domains adds up its members' counts.
+        """
+        since = self._since(hours, now)
+        network = ipaddress.ip_network(address, strict=False)
+        conn = self.store.connect()
+        try:
+            if network.num_addresses == 1:
+                clients = [str(network.network_address)]
+            else:
+                clients = [c for (c,) in conn.execute(
+                    'SELECT DISTINCT client FROM client_hourly WHERE hour >= ?', (since,))
+                    if _in_network(c, network)]
+            rows = {}
+            if clients:
+                marks = ','.join('?' * len(clients))
+                for hour, requests, size, denied, domains in conn.execute(
+                        f'SELECT hour, SUM(requests), SUM(bytes), SUM(denied), SUM(domains) FROM client_hourly '
+                        f'WHERE hour >= ? AND client IN ({marks}) GROUP BY hour', [since] + clients):
+                    rows[hour] = (requests, size, denied, domains)
+        finally:
+            conn.close()
+        hours_list = [since + i * HOUR for i in range(hours)]
+        empty = (0, 0, 0, 0)
+        return {
+            'labels': [datetime.fromtimestamp(h).strftime('%d/%m %H:00') for h in hours_list],
+            'requests': [rows.get(h, empty)[0] for h in hours_list],
+            'bytes': [rows.get(h, empty)[1] for h in hours_list],
+            'denied': [rows.get(h, empty)[2] for h in hours_list],
+            'domains': [rows.get(h, empty)[3] for h in hours_list],
+        }
+
+
+def _in_network(address, network):
+    try:
+        return ipaddress.ip_address(address) in network
+    except ValueError:
+        return False
+
+
+traffic_rollup = TrafficRollup(log_store)
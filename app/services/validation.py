@@ -1,7 +1,8 @@
 from ipaddress import ip_address, AddressValueError
-import validators
 from datetime import datetime
 import os
+import re
+import glob
 import subprocess
 
 def validate_ip(ip):
@@ -12,6 +13,8 @@ def validate_ip(ip):
         return False
 
 def validate_url(url):
+    # `validators` is not in requirements.txt; only needed by this helper
+    import validators
     return validators.url(url)
 
 def validate_expiration_date(expiration_date):
@@ -21,30 +24,176 @@ def validate_expiration_date(expiration_date):
     except ValueError:
         return False
 
-def validate_squid_configs(config_dir='output/'):
+# Directives whose quoted arguments name files that must exist
+FILE_ACL_TYPES = {'src', 'dst', 'dstdomain', 'srcdomain', 'dstdom_regex', 'url_regex', 'urlpath_regex'}
+KNOWN_ACL_TYPES = FILE_ACL_TYPES | {
+    'arp', 'eui64', 'srcdom_regex', 'port', 'localport', 'myportname', 'proto', 'method',
+    'http_status', 'browser', 'referer_regex', 'time', 'external', 'proxy_auth',
+    'proxy_auth_regex', 'maxconn', 'max_user_ip', 'req_header', 'rep_header', 'req_mime_type',
+    'rep_mime_type', 'ssl_error', 'server_name', 'ssl::server_name', 'ssl::server_name_regex',
+    'connections_encrypted', 'peername', 'peername_regex', 'at_step', 'note', 'any-of', 'all-of',
+    'annotate_transaction', 'annotate_client', 'has', 'adaptation_service', 'transaction_initiator',
+    'hier_code', 'random', 'user_cert', 'ca_cert', 'ext_user', 'ext_user_regex', 'tag', 'clientside_mark',
+}
+# ACLs Squid defines itself; CONNECT comes from the stock squid.conf
+BUILTIN_ACLS = {'all', 'manager', 'localhost', 'to_localhost', 'to_linklocal', 'CONNECT'}
+ACCESS_DIRECTIVES = {'http_access', 'http_reply_access', 'icp_access', 'htcp_access', 'cache',
+                     'miss_access', 'always_direct', 'never_direct', 'deny_info'}
+ACL_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.:-]+$')
+SQUID_DEFAULT_DOMAINS_DIR = '/etc/squid/domains/'
+STAGED_FILE_MARKER = '# --- '
+
+
+def build_validation_sandbox(sandbox_dir, conf_release, domains_release, path_map, main_conf=None):
+    """
+    Write a throwaway squid.conf in sandbox_dir that loads the staged config.
+
+    All staged conf.d files are concatenated into sandbox_dir/staged.conf with
+    references to the live directories (path_map: live path -> staged path)
+    rewritten, so domain files are read from the staged tree. If main_conf
+    exists, it is copied with its conf.d include pointed at staged.conf;
+    otherwise a minimal prelude is used. Returns the sandbox squid.conf path.
     """
-    Validate the generated Squid configuration files.
+    rewrites = sorted(path_map.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def rewrite(text):
+        for live, staged in rewrites:
+            text = text.replace(live, staged)
+        return text
+
+    staged_conf = os.path.join(sandbox_dir, 'staged.conf')
+    with open(staged_conf, 'w', encoding='utf-8') as out:
+        for filename in sorted(os.listdir(conf_release)):
+            if not filename.endswith('.conf'):
+                continue
+            with open(os.path.join(conf_release, filename), 'r', encoding='utf-8') as f:
+                out.write(f"{STAGED_FILE_MARKER}{filename}\n")
+                out.write(rewrite(f.read()))
+                out.write('\n')
+
+    lines = []
+    included = False
+    if main_conf and os.path.isfile(main_conf):
+        with open(main_conf, 'r', encoding='utf-8') as f:
+            for line in f:
+                words = line.split()
+                if words[:1] == ['include'] and len(words) > 1 and \
+                        os.path.dirname(words[1]).rstrip('/') in path_map:
+                    if not included:
+                        lines.append(f"include {staged_conf}\n")
+                        included = True
+                    continue
+                lines.append(rewrite(line))
+    else:
+        lines = ["http_port 3128\n", "acl CONNECT method CONNECT\n"]
+    if not included:
+        lines.append(f"include {staged_conf}\n")
+    lines.append("http_access deny all\n")
+
+    squid_conf = os.path.join(sandbox_dir, 'squid.conf')
+    with open(squid_conf, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    return squid_conf
 
-    Args:
-        config_dir (str): The directory containing the Squid configuration files to validate.
 
-    Returns:
-        bool: True if all configuration files are valid, False otherwise.
+def parse_with_squid(squid_binary, squid_conf, timeout=30):
+    """Run `squid -k parse` once over the sandbox config. Returns a list of errors."""
+    try:
+        result = subprocess.run(
+            [squid_binary, '-k', 'parse', '-f', squid_conf],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        return [f"squid -k parse timed out after {timeout}s"]
+    if result.returncode == 0:
+        return []
+    output = [line.strip() for line in result.stdout.splitlines() if line.strip()]
+    problems = [line for line in output if 'ERROR' in line or 'FATAL' in line]
+    return problems or output[-10:] or [f"squid -k parse exited with {result.returncode}"]
+
+
+def lint_squid_config(squid_conf):
+    """
+    Minimal Python check of a squid.conf and everything it includes:
+    ACL syntax and types, ACL names defined in more than one file or with
+    conflicting types, undefined ACLs in access rules, missing or malformed
+    ACL files. Returns a list of "file:line: message" errors.
     """
-    for file_name in os.listdir(config_dir):
-        config_path = os.path.join(config_dir, file_name)
-        try:
-            # Use the squid -k parse command to validate the configuration file
-            result = subprocess.run(
-                ['squid', '-k', 'parse', '-f', config_path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            if result.returncode != 0:
-                print(f"Validation failed for {config_path}: {result.stderr}")
-                return False
-        except FileNotFoundError:
-            print("Squid is not installed or not in the system PATH.")
-            return False
-    return True
\ No newline at end of file
+    from app.utils import is_valid_ip_or_cidr, validate_domain_entry
+
+    errors = []
+    acls = {}          # name -> (type, file)
+    checked_files = set()
+
+    def check_acl_file(path, acl_type, where):
+        if path in checked_files:
+            return
+        checked_files.add(path)
+        if not os.path.isfile(path):
+            errors.append(f"{where}: ACL file not found: {path}")
+            return
+        if acl_type not in ('src', 'dst', 'dstdomain'):
+            return
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for number, line in enumerate(f, 1):
+                value = line.split('#', 1)[0].strip()
+                if not value:
+                    continue
+                valid = is_valid_ip_or_cidr(value) if acl_type in ('src', 'dst') else validate_domain_entry(value)
+                if not valid:
+                    errors.append(f"{path}:{number}: invalid {acl_type} entry '{value}'")
+
+    def lint(path):
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            lines = f.readlines()
+        source = path
+        for number, line in enumerate(lines, 1):
+            if line.startswith(STAGED_FILE_MARKER):
+                # Section of staged.conf copied from one conf.d file
+                source = f"{path}[{line[len(STAGED_FILE_MARKER):].strip()}]"
+                continue
+            words = line.split()
+            if not words or words[0].startswith('#'):
+                continue
+            where = f"{source}:{number}"
+            directive = words[0]
+            if directive == 'include':
+                for pattern in words[1:]:
+                    for included in sorted(glob.glob(pattern)):
+                        lint(included)
+            elif directive == 'acl':
+                if len(words) < 4:
+                    errors.append(f"{where}: acl needs a name, a type and at least one value")
+                    continue
+                name, acl_type = words[1], words[2]
+                if not ACL_NAME_PATTERN.match(name):
+                    errors.append(f"{where}: invalid ACL name '{name}'")
+                if acl_type not in KNOWN_ACL_TYPES:
+                    errors.append(f"{where}: unknown ACL type '{acl_type}'")
+                if name in acls:
+                    previous_type, previous_where = acls[name]
+                    if previous_type != acl_type:
+                        errors.append(f"{where}: ACL '{name}' redefined as {acl_type} (was {previous_type} at {previous_where})")
+                    elif previous_where.rsplit(':', 1)[0] != source:
+                        errors.append(f"{where}: duplicate ACL '{name}' (also defined at {previous_where})")
+                else:
+                    acls[name] = (acl_type, where)
+                if acl_type in FILE_ACL_TYPES:
+                    for value in words[3:]:
+                        if value.startswith('"') and value.endswith('"'):
+                            check_acl_file(value.strip('"'), acl_type, where)
+            elif directive in ACCESS_DIRECTIVES:
+                names = words[2:]  # deny_info: page name, then ACLs
+                if directive != 'deny_info' and (len(words) < 2 or words[1] not in ('allow', 'deny')):
+                    errors.append(f"{where}: {directive} must be followed by allow or deny")
+                    continue
+                for name in names:
+                    name = name.lstrip('!')
+                    if name not in acls and name not in BUILTIN_ACLS:
+                        errors.append(f"{where}: ACL '{name}' used before it is defined")
+
+    lint(squid_conf)
+    return errors
@@ -1,15 +1,30 @@
 from app.models.whitelist import GlobalDomainWhitelist, GlobalIPWhitelist
 from app.extensions import db
-from app.utils import is_valid_ip_or_cidr, validate_domain_entry
+from app.utils import is_valid_ip_or_cidr, validate_domain_entry, normalize_domains, normalize_domain_entry, DomainSuffixTrie
 import logging
+from app.services.change_debouncer import config_debouncer
 
 class WhitelistService:
-    
+    _domain_trie = None  # cached DomainSuffixTrie of the global domains, reset on every change
+
     # --- DOMAIN OPERATIONS ---
     @staticmethod
     def get_all_domains():
         return GlobalDomainWhitelist.query.order_by(GlobalDomainWhitelist.domain).all()
 
+    @staticmethod
+    def domain_trie():
+        """DomainSuffixTrie of the global domains, built once and rebuilt only after a change."""
+        if WhitelistService._domain_trie is None:
+            WhitelistService._domain_trie = DomainSuffixTrie(
+                d for (d,) in GlobalDomainWhitelist.query.with_entities(GlobalDomainWhitelist.domain))
+        return WhitelistService._domain_trie
+
+    @staticmethod
+    def reset_domain_trie():
+        """Drop the cached trie after the table changed outside this service (e.g. a DB restore)."""
+        WhitelistService._domain_trie = None
+
     @staticmethod
     def add_domain(data):
         try:
@@ -30,6 +45,8 @@ class WhitelistService:
             )
             db.session.add(new_domain)
             db.session.commit()
+            WhitelistService._domain_trie = None
+            config_debouncer.mark_dirty('whitelist_domain')
             return True, f"Domain {domain} added successfully."
         except Exception as e:
             db.session.rollback()
@@ -45,6 +62,8 @@ class WhitelistService:
             
             db.session.delete(domain)
             db.session.commit()
+            WhitelistService._domain_trie = None
+            config_debouncer.mark_dirty('whitelist_domain')
             return True, "Domain deleted."
         except Exception as e:
             db.session.rollback()
@@ -67,11 +86,61 @@ class WhitelistService:
 
             domain_entry.description = data.get('description', domain_entry.description)
             db.session.commit()
+            WhitelistService._domain_trie = None
+            config_debouncer.mark_dirty('whitelist_domain')
             return True, "Domain updated."
         except Exception as e:
             db.session.rollback()
             return False, str(e)
 
+    @staticmethod
+    def import_domains(lines):
+        """
+        Bulk import "domain #description" lines.
+        Entries are normalized together (duplicates and covered subdomains
+        removed) and entries already covered by the existing global whitelist
+        are skipped. As with add_domain, a plain domain stays an exact entry. Returns (added_count, dropped) where dropped is a
+        list of (entry, reason).
+        """
+        descriptions = {}
+        entries = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            # Parse: domain #description
+            domain, _, description = line.partition('#')
+            domain = domain.strip()
+            entries.append(domain)
+            normalized = normalize_domain_entry(domain, exact=True)
+            if normalized:
+                descriptions.setdefault(normalized, description.strip())
+
+        domains, dropped = normalize_domains(entries, exact=True)
+
+        existing = DomainSuffixTrie(d.domain for d in GlobalDomainWhitelist.query.all())
+        added = 0
+        try:
+            for domain in domains:
+                cover = existing.find_cover(domain)
+                if cover is not None:
+                    dropped.append((domain, 'already exists' if cover == domain else f'covered by {cover}'))
+                    continue
+                db.session.add(GlobalDomainWhitelist(
+                    domain=domain,
+                    description=descriptions.get(domain, '')
+                ))
+                added += 1
+            db.session.commit()
+            WhitelistService._domain_trie = None
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error importing domains: {e}")
+            raise
+        if added:
+            config_debouncer.mark_dirty('whitelist_domain', added)
+        return added, dropped
+
     # --- IP OPERATIONS ---
     @staticmethod
     def get_all_ips():
@@ -95,6 +164,7 @@ class WhitelistService:
             )
             db.session.add(new_ip)
             db.session.commit()
+            config_debouncer.mark_dirty('whitelist_ip')
             return True, f"IP {ip} added successfully."
         except Exception as e:
             db.session.rollback()
@@ -110,6 +180,7 @@ class WhitelistService:
             
             db.session.delete(ip)
             db.session.commit()
+            config_debouncer.mark_dirty('whitelist_ip')
             return True, "IP deleted."
         except Exception as e:
             db.session.rollback()
@@ -132,6 +203,7 @@ class WhitelistService:
 
             ip_entry.description = data.get('description', ip_entry.description)
             db.session.commit()
+            config_debouncer.mark_dirty('whitelist_ip')
             return True, "IP updated."
         except Exception as e:
             db.session.rollback()
@@ -0,0 +1,170 @@
+import ipaddress
+import logging
+from collections import Counter
+
+from app.services.log_store import _ipv4_num, log_store
+from app.services.traffic_rollup import _in_network
+from app.utils import DomainSuffixTrie, PublicSuffixList, is_valid_ip
+
+_public_suffixes = {}  # PUBLIC_SUFFIX_LIST path -> PublicSuffixList, or None if unreadable
+
+
+def public_suffix_list(path):
+    """The parsed list at path, loaded once; None if it is not installed."""
+    if path not in _public_suffixes:
+        try:
+            _public_suffixes[path] = PublicSuffixList.load(path) if path else None
+        except OSError as e:
+            logging.warning(f"Public suffix list unavailable ({e}); suggesting exact hosts only")
+            _public_suffixes[path] = None
+    return _public_suffixes[path]
+
+
+def suggested_entry(host):
+    """dstdomain entry for exactly a denied host and its subdomains (.host), or the IP itself."""
+    host = host.lower().rstrip('.')
+    return host if is_valid_ip(host) else '.' + host
+
+
+def is_proxy_denied(entry):
+    """Denied by a Squid ACL (TCP_DENIED), as opposed to a 403 answered by the origin."""
+    return 'DENIED' in entry.result
+
+
+class DeniedTraffic:
+    """
+    Per-client denied hosts, maintained by the log store ingester.
+
+    Each batch's TCP_DENIED lines are folded into denied_host (hits, first and
+    last seen per client IP and host), indexed by client and by IPv4 number for
+    CIDR clients. Suggestions for a client are one indexed read of its denied
+    hosts, checked against the client's current allowed domains and the
+    cached global whitelist and template tries, so edits take effect
+    immediately.
+    """
+
+    schema = """
+    CREATE TABLE IF NOT EXISTS denied_host (
+        client TEXT NOT NULL,
+        host TEXT NOT NULL,
+        client_num INTEGER,
+        hits INTEGER NOT NULL DEFAULT 0,
+        first_seen REAL NOT NULL,
+        last_seen REAL NOT NULL,
+        PRIMARY KEY (client, host)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS ix_denied_host_client_num ON denied_host (client_num);
+    CREATE INDEX IF NOT EXISTS ix_denied_host_last_seen ON denied_host (last_seen);
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def ingest(self, conn, entries):
+        seen = {}
+        for entry in entries:
+            if not is_proxy_denied(entry) or not entry.host:
+                continue
+            key = (entry.client, entry.host.lower())
+            row = seen.get(key)
+            if row is None:
+                seen[key] = [1, entry.timestamp, entry.timestamp]
+            else:
+                row[0] += 1
+                row[1] = min(row[1], entry.timestamp)
+                row[2] = max(row[2], entry.timestamp)
+        conn.executemany(
+            'INSERT INTO denied_host (client, host, client_num, hits, first_seen, last_seen) '
+            'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(client, host) DO UPDATE SET '
+            'hits = hits + excluded.hits, first_seen = MIN(first_seen, excluded.first_seen), '
+            'last_seen = MAX(last_seen, excluded.last_seen)',
+            [(client, host, _ipv4_num(client), *row) for (client, host), row in seen.items()])
+
+    def prune(self, conn, cutoff):
+        conn.execute('DELETE FROM denied_host WHERE last_seen < ?', (cutoff,))
+
+    def denied_hosts(self, address, limit=500):
+        """[(host, hits, last_seen)] denied for a client IP or network, most hits first."""
+        network = ipaddress.ip_network(address, strict=False)
+        if network.num_addresses == 1:
+            where, params = 'client = ?', [str(network.network_address)]
+        elif network.version == 4:
+            where = 'client_num BETWEEN ? AND ?'
+            params = [int(network.network_address), int(network.broadcast_address)]
+        else:
+            where, params = "client LIKE '%:%'", []
+        conn = self.store.connect()
+        try:
+            rows = conn.execute(
+                f'SELECT client, host, hits, last_seen FROM denied_host WHERE {where}', params).fetchall()
+        finally:
+            conn.close()
+        hosts = {}
+        for client, host, hits, last_seen in rows:
+            if network.version == 6 and network.num_addresses > 1 and not _in_network(client, network):
+                continue
+            total = hosts.setdefault(host, [0, 0])
+            total[0] += hits
+            total[1] = max(total[1], last_seen)
+        ranked = sorted(hosts.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+        return [(host, hits, last_seen) for host, (hits, last_seen) in ranked]
+
+    def suggestions(self, address, allowed_domains, template_tries, global_trie=None, public_suffixes=None,
+                    limit=10):
+        """
+        Ranked whitelist suggestions for a client:
+        {'domains': [{'entry', 'hosts', 'hits', 'last_seen'}],
+         'parents': [{'entry', 'hosts', 'hits', 'last_seen'}],
+         'templates': [{'name', 'hosts', 'hits'}]}.
+        Denied hosts already covered by the client's allowed domains or the
+        global whitelist trie are ignored (the denial predates the fix).
+        domains suggests each denied host exactly. parents groups two or more
+        denied hosts under their registrable domain from public_suffixes
+        (a PublicSuffixList), so a shared provider such as s3.amazonaws.com is
+        never offered as a whole; hosts lists exactly what the entry would
+        cover. template_tries is {name: DomainSuffixTrie}; a template is
+        suggested for the denied hosts it covers, ranked by hosts covered and
+        then hits.
+        """
+        allowed = DomainSuffixTrie(allowed_domains)
+        denied = [(host, hits, last) for host, hits, last in self.denied_hosts(address)
+                  if host not in allowed and (global_trie is None or host not in global_trie)]
+
+        def group(key_of):
+            groups = {}
+            for host, hits, last_seen in denied:
+                entry = key_of(host)
+                if entry is None:
+                    continue
+                item = groups.setdefault(entry, {'entry': entry, 'hosts': [], 'hits': 0, 'last_seen': 0})
+                item['hosts'].append(host)
+                item['hits'] += hits
+                item['last_seen'] = max(item['last_seen'], last_seen)
+            return sorted(groups.values(), key=lambda i: (-i['hits'], i['entry']))
+
+        def parent_of(host):
+            if public_suffixes is None or is_valid_ip(host):
+                return None
+            domain = public_suffixes.registrable_domain(host)
+            return '.' + domain if domain else None
+
+        parents = [p for p in group(parent_of) if len(p['hosts']) > 1]
+
+        template_hosts, template_hits = {}, Counter()
+        for name, trie in template_tries.items():
+            for host, hits, _ in denied:
+                if host in trie:
+                    template_hosts.setdefault(name, []).append(host)
+                    template_hits[name] += hits
+
+        return {
+            'domains': group(suggested_entry)[:limit],
+            'parents': parents[:limit],
+            'templates': sorted(
+                ({'name': name, 'hosts': hosts, 'hits': template_hits[name]}
+                 for name, hosts in template_hosts.items()),
+                key=lambda t: (-len(t['hosts']), -t['hits'], t['name']))[:limit],
+        }
+
+
+denied_traffic = DeniedTraffic(log_store)
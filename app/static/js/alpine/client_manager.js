@@ -1,4 +1,7 @@
 document.addEventListener('alpine:init', () => {
+    // Kept outside Alpine's reactive state, which Chart.js instances do not tolerate
+    let usageChart = null;
+
     Alpine.data('clientManager', () => ({
         // UI States
         isSearchModalOpen: false,
@@ -6,6 +9,7 @@ document.addEventListener('alpine:init', () => {
         isBulkDeleteModalOpen: false,
         isClientModalOpen: false,
         isTemplateModalOpen: false,
+        isUsageModalOpen: false,
         currentTab: 'clients',
 
         // Client Modal Data
@@ -23,6 +27,9 @@ document.addEventListener('alpine:init', () => {
         isVip: false,
         parsingDNS: false,
 
+        // Whitelist suggestions from the client's denied traffic (edit mode)
+        suggestions: { domains: [], parents: [], templates: [] },
+
         // Templates Data
         urlGroups: {},
         selectedTemplates: [],
@@ -53,6 +60,12 @@ document.addEventListener('alpine:init', () => {
             return [...new Set(domains)];
         },
 
+        // Usage Chart Data
+        usageClientId: null,
+        usageIp: '',
+        usageHours: 24,
+        usageError: '',
+
         // Delete Data
         deleteId: null,
         selectedCount: 0,
@@ -108,7 +121,7 @@ document.addEventListener('alpine:init', () => {
                 let vA = a.dataset[key] || '';
                 let vB = b.dataset[key] || '';
 
-                if (this.sortCol === 'days') {
+                if (this.sortCol === 'days' || this.sortCol === 'requests') {
                     vA = parseInt(vA) || 0;
                     vB = parseInt(vB) || 0;
                 }
@@ -139,6 +152,7 @@ document.addEventListener('alpine:init', () => {
 
         openModal(mode, rowEl = null) {
             this.modalMode = mode;
+            this.suggestions = { domains: [], parents: [], templates: [] };
 
             if (mode === 'add') {
                 this.modalTitle = 'Add New Client';
@@ -174,6 +188,7 @@ document.addEventListener('alpine:init', () => {
                 if (mode === 'edit') {
                     this.modalTitle = 'Edit Client';
                     this.formAction = `/clients/edit/${data.id}`;
+                    this.loadSuggestions(data.id);
                 } else {
                     this.modalTitle = 'Clone Client Rules';
                     this.formAction = '/clients/add';
@@ -239,6 +254,87 @@ document.addEventListener('alpine:init', () => {
             this.isTemplateModalOpen = false;
         },
 
+        // --- Whitelist Suggestions (denied traffic) ---
+
+        async loadSuggestions(id) {
+            try {
+                const res = await fetch(`/api/clients/${id}/suggestions`);
+                if (res.ok) this.suggestions = await res.json();
+            } catch (e) { console.error('Failed to load whitelist suggestions'); }
+        },
+
+        mergeDomains(domains) {
+            const current = this.formData.domains.split('\n').map(s => s.trim()).filter(Boolean);
+            this.formData.domains = [...new Set([...current, ...domains])].join('\n');
+        },
+
+        addSuggestedDomain(item) {
+            this.mergeDomains([item.entry]);
+            this.suggestions.domains = this.suggestions.domains.filter(d => d !== item);
+        },
+
+        addSuggestedParent(item) {
+            // The parent covers its listed hosts, so their exact suggestions go too
+            this.mergeDomains([item.entry]);
+            this.suggestions.parents = this.suggestions.parents.filter(p => p !== item);
+            this.suggestions.domains = this.suggestions.domains.filter(d => !item.hosts.some(h => d.hosts.includes(h)));
+        },
+
+        applySuggestedTemplate(item) {
+            this.mergeDomains(this.urlGroups[item.name] || []);
+            this.suggestions.templates = this.suggestions.templates.filter(t => t !== item);
+        },
+
+        // --- Usage Chart (hourly rollups) ---
+
+        openUsageModal(id, ip) {
+            this.usageClientId = id;
+            this.usageIp = ip;
+            this.isUsageModalOpen = true;
+            this.loadUsage(24);
+        },
+
+        async loadUsage(hours) {
+            this.usageHours = hours;
+            this.usageError = '';
+            try {
+                const res = await fetch(`/api/clients/${this.usageClientId}/usage?hours=${hours}`);
+                const data = await res.json();
+                if (!res.ok) {
+                    this.usageError = data.error || 'Usage unavailable';
+                    return;
+                }
+                const ctx = document.getElementById('usageChart').getContext('2d');
+                if (usageChart) usageChart.destroy();
+                usageChart = new Chart(ctx, {
+                    type: 'bar',
+                    data: {
+                        labels: data.labels,
+                        datasets: [
+                            { label: 'Requests', data: data.requests, backgroundColor: 'rgba(59, 130, 246, 0.6)', yAxisID: 'y' },
+                            { label: 'Denied', data: data.denied, backgroundColor: 'rgba(239, 68, 68, 0.7)', yAxisID: 'y' },
+                            {
+                                label: 'MB', type: 'line', data: data.bytes.map(b => +(b / 1048576).toFixed(2)),
+                                borderColor: '#10b981', backgroundColor: 'transparent', tension: 0.3,
+                                pointRadius: 0, yAxisID: 'y1'
+                            }
+                        ]
+                    },
+                    options: {
+                        responsive: true,
+                        maintainAspectRatio: false,
+                        scales: {
+                            y: { beginAtZero: true, title: { display: true, text: 'Requests' } },
+                            y1: { beginAtZero: true, position: 'right', grid: { drawOnChartArea: false }, title: { display: true, text: 'MB' } }
+                        }
+                    }
+                });
+            } catch (e) {
+                console.error(e);
+                this.usageError = 'Failed to load usage';
+            }
+        },
+
         // --- List Management ---
 
         openSearchModal() { this.isSearchModalOpen = true; },
@@ -1,6 +1,9 @@
 import re
+import socket
 import logging
-from ipaddress import ip_address, ip_network
+from bisect import bisect_right
+from collections import namedtuple
+from ipaddress import ip_address, ip_network, collapse_addresses
 logging.info("Logging configuration is active in utils.py")
 
 def is_valid_ip(ip):
@@ -31,6 +34,100 @@ def is_valid_ip_or_cidr(value):
     return is_valid_ip(value) or is_valid_cidr(value)
 
 
+AggregatedNetworks = namedtuple('AggregatedNetworks', ['networks', 'sources', 'unparsed'])
+
+
+def format_network(network):
+    """Print host networks (/32, /128) as a bare address, others in CIDR form."""
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+
+def aggregate_networks(entries):
+    """
+    Collapse a list of IPs / CIDRs (IPv4 and IPv6) into the smallest equivalent
+    set of networks: adjacent networks are merged and contained ones dropped.
+
+    Returns AggregatedNetworks(networks, sources, unparsed): the aggregated
+    networks as strings (IPv4 first, each family sorted), a mapping of every
+    aggregated network to the original entries it replaces, and the entries
+    that are not valid IPs/CIDRs (left for the caller to emit verbatim).
+    """
+    parsed = []
+    unparsed = []
+    for entry in entries:
+        try:
+            parsed.append((ip_network(entry.strip(), strict=False), entry))
+        except ValueError:
+            unparsed.append(entry)
+
+    networks = []
+    for version in (4, 6):
+        networks.extend(collapse_addresses(net for net, _ in parsed if net.version == version))
+
+    # Collapsed networks are disjoint and sorted: bisect on the start address.
+    starts = [(net.version, int(net.network_address)) for net in networks]
+    sources = {format_network(net): [] for net in networks}
+    for net, entry in parsed:
+        index = bisect_right(starts, (net.version, int(net.network_address))) - 1
+        sources[format_network(networks[index])].append(entry)
+
+    return AggregatedNetworks([format_network(net) for net in networks], sources, unparsed)
+
+class IPPrefixIndex:
+    """
+    Longest-prefix-match index of IPv4/IPv6 networks.
+
+    Networks are stored in one hash table per (family, prefix length); a lookup
+    masks the address once per prefix length actually present, longest first.
+    That gives radix-tree semantics with only a handful of dict probes for
+    typical data (/32 hosts plus a few subnets).
+    """
+
+    def __init__(self):
+        self._tables = {4: {}, 6: {}}
+        self._lengths = {4: [], 6: []}
+        self.size = 0
+
+    def add(self, network, value=True):
+        """Insert an IP or CIDR string (host bits are ignored). Raises ValueError if invalid."""
+        net = ip_network(network.strip(), strict=False)
+        table = self._tables[net.version].setdefault(net.prefixlen, {})
+        if int(net.network_address) not in table:
+            self.size += 1
+        table[int(net.network_address)] = value
+        self._lengths[net.version] = sorted(self._tables[net.version], reverse=True)
+
+    def lookup(self, address):
+        """Value of the most specific network containing address, or None."""
+        address = address.strip()
+        try:
+            # inet_pton is several times faster than ipaddress.ip_address()
+            value = int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+            version, bits = 4, 32
+        except OSError:
+            try:
+                value = int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+                version, bits = 6, 128
+            except (OSError, ValueError):
+                return None
+        tables = self._tables[version]
+        for length in self._lengths[version]:
+            shift = bits - length
+            hit = tables[length].get(value >> shift << shift)
+            if hit is not None:
+                return hit
+        return None
+
+    def __len__(self):
+        return self.size
+
+# Squid dstdomain entry patterns
+DOMAIN_PATTERN = r'^(\.[a-zA-Z0-9-]+)+\.[a-zA-Z]{2,}$'          # .example.com (domain + subdomains)
+SIMPLE_DOMAIN_PATTERN = r'^([a-zA-Z0-9-]+\.)+[a-zA-Z]{2,}$'      # example.com
+IP_PATTERN = r'^(\d{1,3}\.){3}\d{1,3}$'                          # IPv4
+HOSTNAME_PATTERN = r'^(?!-)[a-zA-Z0-9-]{1,63}(?<!-)$'            # single-label hostname
 
 def validate_domain_entry(domain):
     """
@@ -38,74 +135,211 @@ def validate_domain_entry(domain):
     Returns True if valid, False otherwise.
     Does NOT raise generic exceptions, just returns boolean for simple checks.
     """
-    # Regex patterns
-    domain_pattern = r'^(\.[a-zA-Z0-9-]+)+\.[a-zA-Z]{2,}$'  # Domain must start with '.'
-    simple_domain_pattern = r'^([a-zA-Z0-9-]+\.)+[a-zA-Z]{2,}$' # Standard domain (e.g., sub.example.com)
-    ip_pattern = r'^(\d{1,3}\.){3}\d{1,3}$'  # IPv4
-    hostname_pattern = r'^(?!-)[a-zA-Z0-9-]{1,63}(?<!-)$'  # Hostname (simple)
-
     domain = domain.strip()
     if not domain:
         return False
     
     # Check patterns
-    if re.match(domain_pattern, domain):
+    if re.match(DOMAIN_PATTERN, domain):
          return True
-    elif not domain.startswith('.') and re.match(simple_domain_pattern, domain):
+    elif not domain.startswith('.') and re.match(SIMPLE_DOMAIN_PATTERN, domain):
          # Valid domain but missing dot - Accept it (Whitelist Service handles leading dot logic if needed, or treats as exact match)
          return True
-    elif re.match(ip_pattern, domain):
+    elif re.match(IP_PATTERN, domain):
         return True
-    elif re.match(hostname_pattern, domain):
+    elif re.match(HOSTNAME_PATTERN, domain):
         return True
     
     return False
 
-def validate_allowed_domains(domains):
+NormalizedDomains = namedtuple('NormalizedDomains', ['domains', 'dropped'])
+
+
+class DomainSuffixTrie:
     """
-    CHECK list of domains, IPs, or hostnames.
-    Ensures domains start with '.' if they are domains (for Squid partial matching).
-    Removes subdomains if parent exists.
-    """
-    logging.info(f"Validating domains: {domains}") 
-
-    # Regex patterns
-    # Regex patterns - Updated to support complex subdomains
-    domain_pattern = r'^(\.[a-zA-Z0-9-]+)+\.[a-zA-Z]{2,}$'
-    simple_domain_pattern = r'^([a-zA-Z0-9-]+\.)+[a-zA-Z]{2,}$'
-    ip_pattern = r'^(\d{1,3}\.){3}\d{1,3}$' 
-    hostname_pattern = r'^(?!-)[a-zA-Z0-9-]{1,63}(?<!-)$'
-
-    unique_domains = []
-    for domain in domains.splitlines():
-        domain = domain.strip()
-        logging.info(f"Checking domain: {domain}") 
-
-        if domain: 
-            if re.match(domain_pattern, domain):
-                if not any(domain.endswith(existing) for existing in unique_domains):
-                    unique_domains.append(domain)
-            elif re.match(simple_domain_pattern, domain) and not domain.startswith('.'):
-                # Domain is valid but missing dot -> Automatically add it
-                logging.info(f"Auto-adding leading dot to: {domain}")
-                domain = '.' + domain
-                unique_domains.append(domain)
-            elif re.match(ip_pattern, domain):
-                unique_domains.append(domain)
-            elif re.match(hostname_pattern, domain):
-                unique_domains.append(domain)
+    Trie over reversed domain labels (``a.example.com`` -> com, example, a).
+
+    A leading-dot entry (``.example.com``) covers the domain itself and every
+    subdomain, like Squid's dstdomain; any other entry covers only itself.
+    Lookups cost O(number of labels), independent of the number of entries.
+    """
+    _WILDCARD = object()
+    _EXACT = object()
+
+    def __init__(self, entries=()):
+        self.root = {}
+        self.size = 0
+        for entry in entries:
+            self.add(entry)
+
+    @staticmethod
+    def _labels(domain):
+        return domain.strip().lower().lstrip('.').split('.')[::-1]
+
+    def add(self, entry, value=None):
+        """Insert entry; value (default: the entry itself) is returned by lookups."""
+        node = self.root
+        for label in self._labels(entry):
+            node = node.setdefault(label, {})
+        marker = self._WILDCARD if entry.strip().startswith('.') else self._EXACT
+        if marker not in node:
+            self.size += 1
+        node[marker] = entry if value is None else value
+
+    def find_cover(self, domain):
+        """Return the value of the broadest entry that matches domain, or None."""
+        node = self.root
+        labels = self._labels(domain)
+        for label in labels:
+            node = node.get(label)
+            if node is None:
+                return None
+            if self._WILDCARD in node:
+                return node[self._WILDCARD]
+        if not domain.strip().startswith('.'):
+            return node.get(self._EXACT)
+        return None
+
+    def __contains__(self, domain):
+        return self.find_cover(domain) is not None
+
+    def __len__(self):
+        return self.size
+
+
+class PublicSuffixList:
+    """
+    Public Suffix List rules (https://publicsuffix.org/list/), including the
+    private section, so hosting providers such as s3.amazonaws.com or
+    github.io count as suffixes and each tenant is its own registrable domain.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = set()
+        self.exceptions = set()
+        for rule in rules:
+            rule = rule.strip().lower()
+            if not rule or rule.startswith('//'):
+                continue
+            rule = rule.split()[0]
+            if rule.startswith('!'):
+                self.exceptions.add(rule[1:])
             else:
+                self.rules.add(rule)
+
+    @classmethod
+    def load(cls, path):
+        """Parse a public_suffix_list.dat file. Raises OSError if it cannot be read."""
+        with open(path, encoding='utf-8') as f:
+            return cls(f)
+
+    def public_suffix(self, host):
+        """Longest matching public suffix of host; the last label if no rule matches."""
+        labels = host.lower().strip('.').split('.')
+        for i in range(len(labels)):
+            candidate = '.'.join(labels[i:])
+            if candidate in self.exceptions:
+                return '.'.join(labels[i + 1:])
+            if candidate in self.rules:
+                return candidate
+            if i + 1 < len(labels) and '*.' + '.'.join(labels[i + 1:]) in self.rules:
+                return candidate
+        return labels[-1]
+
+    def registrable_domain(self, host):
+        """Public suffix plus one label (example.co.uk), or None if host is itself a suffix."""
+        host = host.lower().strip('.')
+        suffix = self.public_suffix(host)
+        if host == suffix:
+            return None
+        return '.'.join(host.split('.')[-(suffix.count('.') + 2):])
+
+
+def normalize_domain_entry(domain, exact=False):
+    """
+    Normalized form of one dstdomain entry, or None if it is invalid.
+    With exact=True a plain domain stays an exact match instead of getting a leading dot.
+    """
+    domain = domain.strip()
+    if re.match(DOMAIN_PATTERN, domain):
+        return domain.lower()
+    elif re.match(SIMPLE_DOMAIN_PATTERN, domain):
+        # Domain is valid but missing dot -> Automatically add it
+        return domain.lower() if exact else '.' + domain.lower()
+    elif re.match(IP_PATTERN, domain) or re.match(HOSTNAME_PATTERN, domain):
+        return domain.lower()
+    return None
+
+
+def normalize_domains(entries, strict=False, exact=False):
+    """
+    Validate and normalize a bulk list of dstdomain entries.
+
+    Accepts a newline separated string or an iterable of strings. Plain
+    domains get a leading dot, exact duplicates and entries covered by a
+    broader one (``.a.example.com`` under ``.example.com``) are removed, in
+    O(n log n) via one sort and a DomainSuffixTrie.
+
+    Returns NormalizedDomains(domains, dropped): the kept entries in input
+    order and a list of (original entry, reason) tuples. With strict=True the first
+    invalid entry raises ValueError instead of being dropped. With exact=True
+    plain domains keep matching only themselves (see normalize_domain_entry).
+    """
+    if isinstance(entries, str):
+        entries = entries.splitlines()
+
+    candidates = []
+    originals = []
+    dropped = []
+    for raw in entries:
+        domain = raw.strip()
+        if not domain:
+            continue
+        normalized = normalize_domain_entry(domain, exact)
+        if normalized is None:
+            if strict:
                 logging.error(f"Invalid domain: {domain}")
                 raise ValueError(f'Invalid domain: {domain}')
+            dropped.append((domain, 'invalid'))
+            continue
+        candidates.append(normalized)
+        originals.append(domain)
 
-    # Remove subdomains if parent exists
-    unique_domains = sorted(unique_domains, key=len)
-    filtered_domains = []
-    for domain in unique_domains:
-        if not any(domain.endswith(existing) and domain != existing for existing in filtered_domains):
-            filtered_domains.append(domain)
+    # Broadest entries first (fewest labels, wildcard before exact), so every
+    # covering entry is already in the trie when its subdomains are checked.
+    order = sorted(range(len(candidates)),
+                   key=lambda i: (candidates[i].strip('.').count('.'), not candidates[i].startswith('.')))
+    trie = DomainSuffixTrie()
+    keep = [False] * len(candidates)
+    for i in order:
+        domain = candidates[i]
+        cover = trie.find_cover(domain)
+        if cover is None:
+            trie.add(domain)
+            keep[i] = True
+        elif cover == domain:
+            dropped.append((originals[i], 'duplicate'))
         else:
-            # Just log, don't flash
-            logging.warning(f"Duplicated domain found: {domain}")
+            dropped.append((originals[i], f'covered by {cover}'))
+
+    if dropped:
+        logging.debug(f"Normalized {len(candidates)} domains, dropped {len(dropped)}: {dropped[:20]}")
+    return NormalizedDomains([d for d, k in zip(candidates, keep) if k], dropped)
+
 
-    return filtered_domains
\ No newline at end of file
+def describe_dropped(dropped, limit=5):
+    """Short human readable summary of normalize_domains() drops, '' if none."""
+    if not dropped:
+        return ''
+    shown = ', '.join(f"{entry} ({reason})" for entry, reason in dropped[:limit])
+    more = f" and {len(dropped) - limit} more" if len(dropped) > limit else ''
+    return f"{len(dropped)} entries dropped: {shown}{more}."
+
+
+def validate_allowed_domains(domains):
+    """
+    CHECK list of domains, IPs, or hostnames.
+    Ensures domains start with '.' if they are domains (for Squid partial matching).
+    Removes subdomains if parent exists. Raises ValueError on the first invalid entry.
+    """
+    return normalize_domains(domains, strict=True).domains
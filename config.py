@@ -35,8 +35,64 @@ class Config:
     # Squid Configuration
     SQUID_CONF_DIR = os.getenv('SQUID_CONF_DIR', '/etc/squid/conf.d/')
     SQUID_DOMAINS_DIR = os.getenv('SQUID_DOMAINS_DIR', '/etc/squid/domains/')
+    SQUID_VIP_DIR = os.getenv('SQUID_VIP_DIR', '/etc/squid/VIP' if os.name != 'nt' else 'config/squid/VIP')
+    # Validate the staged config before it goes live: one `squid -k parse` of a
+    # sandbox squid.conf, or the built-in linter when SQUID_BINARY is not installed
+    SQUID_VALIDATE_CONFIG = os.getenv('SQUID_VALIDATE_CONFIG', 'True').lower() in ('true', '1', 't')
+    SQUID_BINARY = os.getenv('SQUID_BINARY', 'squid')
+    SQUID_MAIN_CONF = os.getenv('SQUID_MAIN_CONF', '/etc/squid/squid.conf')
+    SQUID_VALIDATE_TIMEOUT = int(os.getenv('SQUID_VALIDATE_TIMEOUT', 30))
+    # After a reload, poll Squid until it serves again: 'cachemgr' (GET squid-internal-mgr/info),
+    # 'tcp' (connect to http_port; passes before the reload finishes) or 'none'
+    SQUID_READY_PROBE = os.getenv('SQUID_READY_PROBE', 'cachemgr')
+    SQUID_PROBE_HOST = os.getenv('SQUID_PROBE_HOST', '127.0.0.1')
+    SQUID_READY_TIMEOUT = int(os.getenv('SQUID_READY_TIMEOUT', 30))
+    # 'per_client': one src/dstdomain ACL pair per client (default)
+    # 'grouped': one multi-IP src ACL per distinct domain set (fewer http_access rules)
+    ACL_GENERATION_MODE = os.getenv('ACL_GENERATION_MODE', 'per_client')
+    # Drop per-client domains already allowed for everybody by Whitelist_domains.acl
+    SUBTRACT_GLOBAL_DOMAINS = os.getenv('SUBTRACT_GLOBAL_DOMAINS', 'False').lower() in ('true', '1', 't')
+    # Collapse adjacent/contained networks in VIP_clients.acl and Whitelist_ips.acl
+    AGGREGATE_IP_ACLS = os.getenv('AGGREGATE_IP_ACLS', 'True').lower() in ('true', '1', 't')
+    # Order *_ip.conf files busiest-first by access-log requests over the last N hours
+    ACL_HIT_ORDERING = os.getenv('ACL_HIT_ORDERING', 'False').lower() in ('true', '1', 't')
+    ACL_HIT_WINDOW_HOURS = int(os.getenv('ACL_HIT_WINDOW_HOURS', 24))
+    # Client rows fetched per batch while generating config
+    GENERATE_BATCH_SIZE = int(os.getenv('GENERATE_BATCH_SIZE', 1000))
+    # Threads writing changed config files (1 = serial)
+    CONFIG_WRITE_WORKERS = int(os.getenv('CONFIG_WRITE_WORKERS', 4))
+    # Background workers for 1-Click Apply jobs, and how many finished jobs stay pollable
+    CONFIG_JOB_WORKERS = int(os.getenv('CONFIG_JOB_WORKERS', 2))
+    CONFIG_JOB_HISTORY = int(os.getenv('CONFIG_JOB_HISTORY', 20))
+    # Old staged releases of conf.d/domains kept next to the live tree for rollback
+    APPLY_KEEP_RELEASES = int(os.getenv('APPLY_KEEP_RELEASES', 2))
     OUTPUT_DIR = os.getenv('OUTPUT_DIR', 'output/')
     SQUID_ACCESS_LOG = os.getenv('SQUID_ACCESS_LOG', '/var/log/squid/access.log')
+    # Log page: matching lines shown, and how far back from the end of the log to search
+    LOG_VIEW_LINES = int(os.getenv('LOG_VIEW_LINES', 500))
+    LOG_SCAN_MAX_BYTES = int(os.getenv('LOG_SCAN_MAX_BYTES', 64 * 1024 * 1024))
+    LOG_TAIL_MAX_BYTES = int(os.getenv('LOG_TAIL_MAX_BYTES', 1024 * 1024))
+    # Server-Sent Events streams for the dashboard stats and the live log
+    STREAM_STATS_INTERVAL = float(os.getenv('STREAM_STATS_INTERVAL', 3))
+    STREAM_LOG_POLL_SECONDS = float(os.getenv('STREAM_LOG_POLL_SECONDS', 1))
+    STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', 100))
+    STREAM_HEARTBEAT_SECONDS = int(os.getenv('STREAM_HEARTBEAT_SECONDS', 15))
+    STREAM_MAX_SUBSCRIBERS = int(os.getenv('STREAM_MAX_SUBSCRIBERS', 50))
+    # Indexed SQLite copy of the access log, used by the Logs page and log APIs
+    LOG_STORE_ENABLED = os.getenv('LOG_STORE_ENABLED', 'False').lower() in ('true', '1', 't')
+    LOG_STORE_PATH = os.getenv('LOG_STORE_PATH', 'db/access_log.db')
+    LOG_STORE_RETENTION_DAYS = int(os.getenv('LOG_STORE_RETENTION_DAYS', 14))
+    LOG_INGEST_INTERVAL = int(os.getenv('LOG_INGEST_INTERVAL', 15))
+    LOG_INGEST_BATCH_BYTES = int(os.getenv('LOG_INGEST_BATCH_BYTES', 4 * 1024 * 1024))
+    # Hourly per-client traffic rollups kept in the log store, and the window shown on the clients page
+    LOG_ROLLUP_RETENTION_DAYS = int(os.getenv('LOG_ROLLUP_RETENTION_DAYS', 90))
+    CLIENT_USAGE_HOURS = int(os.getenv('CLIENT_USAGE_HOURS', 24))
+    # Counters per time bucket in the top domains / denied domains / client->domain tables
+    HEAVY_HITTERS_CAPACITY = int(os.getenv('HEAVY_HITTERS_CAPACITY', 1000))
+    # Public Suffix List used to group denied hosts under their registrable domain (Debian/Ubuntu: publicsuffix package)
+    PUBLIC_SUFFIX_LIST = os.getenv('PUBLIC_SUFFIX_LIST', '/usr/share/publicsuffix/public_suffix_list.dat')
+    # Allowed domains without a hit for this many days are reported as stale
+    ALLOWLIST_STALE_DAYS = int(os.getenv('ALLOWLIST_STALE_DAYS', 30))
 
     # Logging
     LOGGING_DIR = os.getenv('LOGGING_DIR', 'logs/')
@@ -57,6 +113,13 @@ class Config:
     # Scheduler & Network
     JOB_HOUR = int(os.getenv('JOB_HOUR', 17))
     JOB_MINUTE = int(os.getenv('JOB_MINUTE', 3))
+    # Regenerate when a client expires; False falls back to the daily JOB_HOUR:JOB_MINUTE job
+    EXPIRY_SCHEDULING = os.getenv('EXPIRY_SCHEDULING', 'True').lower() in ('true', '1', 't')
+    # Generate/apply/reload automatically after client/whitelist/template edits,
+    # once no edit happened for QUIET seconds (at most MAX_DELAY after the first)
+    AUTO_APPLY_ON_CHANGE = os.getenv('AUTO_APPLY_ON_CHANGE', 'False').lower() in ('true', '1', 't')
+    AUTO_APPLY_QUIET_SECONDS = int(os.getenv('AUTO_APPLY_QUIET_SECONDS', 30))
+    AUTO_APPLY_MAX_DELAY_SECONDS = int(os.getenv('AUTO_APPLY_MAX_DELAY_SECONDS', 300))
     DNS_SERVER = os.getenv('DNS_SERVER', '10.30.110.1')
 
 def create_app():
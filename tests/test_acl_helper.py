@@ -0,0 +1,61 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import date
+from app.acl_helper import PolicyIndex, handle_line, serve, sqlite_path
+from config import basedir
+
+
+class Holder:
+    def __init__(self, index):
+        self.index = index
+
+
+class TestPolicyIndex(unittest.TestCase):
+    def setUp(self):
+        clients = [
+            ('10.0.0.1', '.example.com\n10.9.9.9', '2999-01-01'),
+            ('10.0.1.0/24', '.corp.net', '2999-01-01'),
+            ('10.0.0.2', 'ANY', '2999-01-01'),
+            ('10.0.0.3', '.example.com', '2000-01-01'),  # expired
+        ]
+        self.index = PolicyIndex.from_rows(clients, ['.global.org'], ['172.16.0.0/16'], today=date(2026, 1, 1))
+
+    def test_lookups(self):
+        self.assertTrue(self.index.is_allowed('10.0.0.1', 'www.example.com'))
+        self.assertFalse(self.index.is_allowed('10.0.0.1', 'www.corp.net'))
+        self.assertTrue(self.index.is_allowed('10.0.1.77', 'git.corp.net'))
+        self.assertTrue(self.index.is_allowed('10.0.0.2', 'anything.io'))
+        self.assertFalse(self.index.is_allowed('10.0.0.3', 'www.example.com'))
+        self.assertTrue(self.index.is_allowed('192.168.1.1', 'cdn.global.org'))
+        self.assertTrue(self.index.is_allowed('192.168.1.1', '172.16.4.4'))
+
+    def test_protocol_with_and_without_channel_id(self):
+        holder = Holder(self.index)
+        self.assertEqual(handle_line(holder, '10.0.0.1 www.example.com\n'), 'OK')
+        self.assertEqual(handle_line(holder, '7 10.0.0.1 www.corp.net\n'), '7 ERR')
+        out = io.StringIO()
+        serve(holder, io.StringIO('0 10.0.0.2 a.b\n1 10.0.0.1 example.com\n'), out)
+        self.assertEqual(out.getvalue(), '0 OK\n1 OK\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class TestHelperStartup(unittest.TestCase):
+    def test_runs_by_path_from_another_directory(self):
+        # Squid starts the helper with its own working directory
+        script = os.path.join(basedir, 'app', 'acl_helper.py')
+        result = subprocess.run([sys.executable, script, '--benchmark', '--clients', '10', '--lookups', '100'],
+                                cwd=tempfile.gettempdir(), capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('lookups/sec', result.stdout)
+
+    def test_relative_db_path_is_resolved_from_the_project(self):
+        self.assertEqual(sqlite_path('sqlite:///db/squid_manager.db'),
+                         os.path.join(basedir, 'db', 'squid_manager.db'))
+        self.assertEqual(sqlite_path('sqlite:////var/lib/sm.db'), '/var/lib/sm.db')
@@ -1,7 +1,31 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from datetime import date, datetime, timedelta
 from app.services.configuration_service import ConfigurationService
+from app.extensions import db
+from app.models.client import Client
 from flask import Flask
 
+
+def make_app(tmp_dir):
+    """Minimal app with an in-memory DB and all Squid paths under tmp_dir."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['OUTPUT_DIR'] = os.path.join(tmp_dir, 'output')
+    app.config['SQUID_CONF_DIR'] = os.path.join(tmp_dir, 'squid', 'conf.d')
+    app.config['SQUID_DOMAINS_DIR'] = os.path.join(tmp_dir, 'squid', 'domains')
+    app.config['SQUID_VIP_DIR'] = os.path.join(tmp_dir, 'squid', 'VIP')
+    app.config['APPLY_KEEP_RELEASES'] = 1
+    app.config['SQUID_READY_PROBE'] = lambda host, port, timeout: True  # local stand-in
+    db.init_app(app)
+    return app
+
+
 class TestConfigurationService(unittest.TestCase):
     def setUp(self):
         self.app = Flask(__name__)
@@ -25,5 +49,948 @@ class TestConfigurationService(unittest.TestCase):
                  self.assertTrue(success)
                  self.assertIn("Dev", msg)
 
+class TestIncrementalGeneration(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.app = make_app(self.tmp_dir)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        future = date.today() + timedelta(days=30)
+        db.session.add_all([
+            Client(ip_address='10.0.0.1', expiration_date=future, allowed_domains='.a.com'),
+            Client(ip_address='10.0.0.2', expiration_date=future, allowed_domains='.b.com'),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_second_run_writes_nothing(self):
+        success, first = ConfigurationService.generate_config()
+        self.assertTrue(success)
+        self.assertEqual(len(first['changes']['added']), 8)  # 2 clients x 2 + 3 ACLs + side-car
+
+        success, second = ConfigurationService.generate_config()
+        self.assertTrue(success)
+        self.assertEqual(second['changes']['added'], [])
+        self.assertEqual(second['changes']['changed'], [])
+        self.assertEqual(second['changes']['removed'], [])
+
+    def test_missing_manifest_keeps_bookkeeping_files(self):
+        output_dir = self.app.config['OUTPUT_DIR']
+        os.makedirs(output_dir)
+        for name in ('.applied_manifest.json', '.reload_state.json', 'stale.conf'):
+            with open(os.path.join(output_dir, name), 'w') as f:
+                f.write('{}')
+
+        success, result = ConfigurationService.generate_config()
+        self.assertTrue(success)
+        self.assertEqual(result['changes']['removed'], ['stale.conf'])
+        self.assertTrue(os.path.exists(os.path.join(output_dir, '.applied_manifest.json')))
+        self.assertTrue(os.path.exists(os.path.join(output_dir, '.reload_state.json')))
+
+    def test_streamed_rows_render_like_orm_objects(self):
+        from app.models.whitelist import GlobalDomainWhitelist, GlobalIPWhitelist
+        future = date.today() + timedelta(days=30)
+        db.session.add_all([
+            Client(ip_address='10.0.0.3', expiration_date=future, allowed_domains='ANY'),
+            Client(ip_address='10.0.1.0/24', expiration_date=future, allowed_domains='.c.com\n.d.com'),
+            Client(ip_address='10.0.0.4', expiration_date=date.today() - timedelta(days=1), allowed_domains='.e.com'),
+            GlobalDomainWhitelist(domain='.global.org', description='shared'),
+            GlobalIPWhitelist(ip_address='172.16.0.0/16', description='lan'),
+        ])
+        db.session.commit()
+        self.app.config['GENERATE_BATCH_SIZE'] = 2  # several batches
+
+        streamed = list(ConfigurationService._render_files(*ConfigurationService._query_sources(date.today()), {}))
+        orm = list(ConfigurationService._render_files(
+            Client.query.filter(Client.expiration_date >= date.today()).order_by(Client.id).all(),
+            GlobalDomainWhitelist.query.order_by(GlobalDomainWhitelist.id).all(),
+            GlobalIPWhitelist.query.order_by(GlobalIPWhitelist.id).all(), {}))
+        self.assertEqual(streamed, orm)
+        self.assertFalse(any(name.startswith('10_0_0_4__') for name, _ in streamed))
+
+        # A run too fast for the clock to advance reports 0 rows/sec instead of failing
+        from unittest import mock
+        with mock.patch('app.services.configuration_service.time.perf_counter', return_value=1.0):
+            success, result = ConfigurationService.generate_config()
+        self.assertTrue(success, result)
+        self.assertEqual(result['rows_per_sec'], 0)
+
+    def test_only_touched_client_is_reported(self):
+        ConfigurationService.generate_config()
+        client = Client.query.filter_by(ip_address='10.0.0.1').first()
+        client.allowed_domains = '.a.com\n.c.com'
+        Client.query.filter_by(ip_address='10.0.0.2').first().expiration_date = date.today() - timedelta(days=1)
+        db.session.commit()
+
+        success, result = ConfigurationService.generate_config()
+        self.assertTrue(success)
+        changes = result['changes']
+        self.assertEqual(changes['changed'], [f"10_0_0_1__{client.expiration_date:%Y%m%d}_url.conf"])
+        self.assertEqual(len(changes['removed']), 2)
+        for filename in changes['removed']:
+            self.assertTrue(filename.startswith('10_0_0_2__'))
+            self.assertFalse(os.path.exists(os.path.join(self.app.config['OUTPUT_DIR'], filename)))
+
+    def test_apply_swaps_in_staged_release(self):
+        conf_dir = self.app.config['SQUID_CONF_DIR']
+        os.makedirs(conf_dir)
+        with open(os.path.join(conf_dir, 'default.conf'), 'w') as f:
+            f.write('# hand maintained\n')
+
+        ConfigurationService.generate_config()
+        success, msg = ConfigurationService.apply_config()
+        self.assertTrue(success, msg)
+        self.assertTrue(os.path.islink(conf_dir))
+        names = sorted(os.listdir(conf_dir))
+        self.assertIn('default.conf', names)
+        self.assertEqual(len([n for n in names if n.endswith('_ip.conf')]), 2)
+        unchanged = [n for n in names if n.startswith('10_0_0_2__')][0]
+        first_inode = os.stat(os.path.join(conf_dir, unchanged)).st_ino
+
+        Client.query.filter_by(ip_address='10.0.0.1').first().allowed_domains = '.z.com'
+        db.session.commit()
+        ConfigurationService.generate_config()
+        success, msg = ConfigurationService.apply_config()
+        self.assertTrue(success, msg)
+        # Unchanged files are hard-linked from the previous release, not copied
+        self.assertEqual(os.stat(os.path.join(conf_dir, unchanged)).st_ino, first_inode)
+        with open(os.path.join(self.app.config['SQUID_DOMAINS_DIR'],
+                               [n for n in os.listdir(self.app.config['SQUID_DOMAINS_DIR'])
+                                if n.startswith('10_0_0_1__')][0])) as f:
+            self.assertEqual(f.read(), '.z.com')
+        self.assertTrue(os.path.isfile(os.path.join(self.app.config['SQUID_VIP_DIR'], 'VIP_clients.acl')))
+
+    def test_reload_skipped_when_deployed_config_unchanged(self):
+        calls = []
+        original = ConfigurationService.reload_squid
+        ConfigurationService.reload_squid = staticmethod(lambda: calls.append(1) or (True, "Squid reloaded."))
+        try:
+            success, result = ConfigurationService.generate_apply_reload()
+            self.assertTrue(success, result)
+            self.assertTrue(result['reload']['reloaded'])
+
+            success, result = ConfigurationService.generate_apply_reload()
+            self.assertTrue(success, result)
+            self.assertFalse(result['reload']['reloaded'])
+            self.assertEqual(ConfigurationService.get_reload_state()['history'][0]['action'], 'noop')
+
+            success, result = ConfigurationService.generate_apply_reload(force=True)
+            self.assertTrue(result['reload']['reloaded'])
+            self.assertEqual(len(calls), 2)
+        finally:
+            ConfigurationService.reload_squid = original
+
+    def test_reload_waits_for_readiness_and_records_latency(self):
+        answers = [False, False, True]
+        self.app.config['SQUID_READY_PROBE'] = lambda host, port, timeout: answers.pop(0)
+        original = ConfigurationService.reload_squid
+        ConfigurationService.reload_squid = staticmethod(lambda: (True, "Squid reloaded."))
+        try:
+            success, result = ConfigurationService.reload_if_changed(force=True)
+            self.assertTrue(success, result)
+            self.assertGreater(result['ready_seconds'], 0)
+            self.assertEqual(answers, [])
+
+            self.app.config['SQUID_READY_PROBE'] = lambda host, port, timeout: False
+            self.app.config['SQUID_READY_TIMEOUT'] = 0
+            success, result = ConfigurationService.reload_if_changed(force=True)
+            self.assertFalse(success)
+            self.assertIn("not ready", result)
+        finally:
+            ConfigurationService.reload_squid = original
+
+        stats = ConfigurationService.reload_latency_stats()
+        self.assertEqual((stats['count'], stats['failures']), (1, 1))
+        self.assertEqual(stats['p50'], stats['p95'])
+
+    def test_mocked_reload_is_not_probed(self):
+        from unittest import mock
+        from app.models.reload_event import ReloadEvent
+        self.app.config.update(SQUID_READY_PROBE='cachemgr', SQUID_READY_TIMEOUT=30)
+        probed = []
+        with mock.patch.object(os, 'name', 'nt'), \
+                mock.patch('app.services.system_service.SystemService.wait_for_squid_ready',
+                           side_effect=lambda *args: probed.append(args)):
+            success, result = ConfigurationService.reload_if_changed(force=True)
+        self.assertTrue(success, result)
+        self.assertEqual(result['message'], "Squid reloaded (Dev).")
+        self.assertIsNone(result['ready_seconds'])
+        self.assertEqual(probed, [])
+        self.assertEqual(ReloadEvent.query.order_by(ReloadEvent.id.desc()).first().probe, 'none')
+
+    def test_cachemgr_probe_waits_for_an_answer(self):
+        import socket
+        from app.services.system_service import SystemService
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(5)
+        port = server.getsockname()[1]
+
+        def answer(count):
+            for _ in range(count):
+                conn, _ = server.accept()
+                with conn:
+                    try:
+                        conn.recv(1024)
+                        conn.sendall(b'HTTP/1.1 403 Forbidden\r\nConnection: close\r\n\r\n')
+                    except OSError:
+                        pass
+
+        try:
+            # Reconfiguring: the socket still accepts connections but nothing answers
+            self.assertTrue(SystemService.probe_squid_tcp('127.0.0.1', port, 0.2))
+            self.assertFalse(SystemService.probe_squid_cachemgr('127.0.0.1', port, 0.2))
+            worker = threading.Thread(target=answer, args=(3,))
+            worker.start()
+            # Any answer means Squid serves again, even without manager access
+            self.assertTrue(SystemService.probe_squid_cachemgr('127.0.0.1', port, 2))
+            worker.join(2)
+        finally:
+            server.close()
+
+    def test_hit_ordering_puts_busiest_client_first(self):
+        now = time.time()
+        log_path = os.path.join(self.tmp_dir, 'access.log')
+        with open(log_path, 'w') as f:
+            f.write(f"{now - 90000:.3f}    5 10.0.0.1 TCP_TUNNEL/200 100 CONNECT old.a.com:443 - HIER_DIRECT/1.1.1.1 -\n")
+            f.write(f"{now - 60:.3f}    5 10.0.0.1 TCP_TUNNEL/200 100 CONNECT www.a.com:443 - HIER_DIRECT/1.1.1.1 -\n")
+            for i in range(30):
+                f.write(f"{now - 50 + i:.3f}    5 10.0.0.2 TCP_MISS/200 100 GET http://www.b.com/{i} - HIER_DIRECT/2.2.2.2 text/html\n")
+        self.app.config.update(SQUID_ACCESS_LOG=log_path, ACL_HIT_ORDERING=True, ACL_HIT_WINDOW_HOURS=24)
+
+        success, result = ConfigurationService.generate_config()
+        self.assertTrue(success, result)
+        ip_files = sorted(f for f in os.listdir(self.app.config['OUTPUT_DIR']) if f.endswith('_ip.conf'))
+        self.assertEqual(len(ip_files), 2)
+        self.assertIn('10_0_0_2__', ip_files[0])
+        self.assertIn('10_0_0_1__', ip_files[1])
+
+        report = result['hit_ordering']
+        self.assertEqual((report['requests'], report['matched']), (31, 31))
+        self.assertAlmostEqual(report['avg_rules_before'], (1 + 30 * 4) / 31)
+        self.assertAlmostEqual(report['avg_rules_after'], (30 * 2 + 3) / 31)
+
+        # A window larger than LOG_SCAN_MAX_BYTES is not ranked on partial counts
+        from app.services.log_service import LogService
+        self.app.config['LOG_SCAN_MAX_BYTES'] = 1024
+        self.assertIsNone(LogService.client_hit_counts(24)[0])
+        success, result = ConfigurationService.generate_config()
+        self.assertTrue(success, result)
+        self.assertIsNone(result['hit_ordering'])
+        ip_files = sorted(f for f in os.listdir(self.app.config['OUTPUT_DIR']) if f.endswith('_ip.conf'))
+        self.assertTrue(ip_files[0].startswith('10_0_0_1__'))
+
+    def test_grouped_mode_emits_one_policy_per_domain_set(self):
+        future = date.today() + timedelta(days=30)
+        db.session.add(Client(ip_address='10.0.0.3', expiration_date=future, allowed_domains='.A.com\n'))
+        db.session.commit()
+        self.app.config['ACL_GENERATION_MODE'] = 'grouped'
+
+        success, result = ConfigurationService.generate_config()
+        self.assertTrue(success, result)
+        self.assertEqual(result['policy_groups'], 2)
+        self.assertEqual(result['http_access_rules'], 4)
+        output_dir = self.app.config['OUTPUT_DIR']
+        ip_confs = [n for n in os.listdir(output_dir) if n.endswith('_ip.conf')]
+        self.assertEqual(len(ip_confs), 2)
+        shared = [n for n in ip_confs
+                  if '10.0.0.1 10.0.0.3' in open(os.path.join(output_dir, n)).read()]
+        self.assertEqual(len(shared), 1)
+
+    def test_client_rules_are_included_before_default_conf(self):
+        # Squid includes conf.d/*.conf in name order; default.conf must stay last in both modes
+        output_dir = self.app.config['OUTPUT_DIR']
+        for mode in ('per_client', 'grouped'):
+            self.app.config['ACL_GENERATION_MODE'] = mode
+            success, result = ConfigurationService.generate_config()
+            self.assertTrue(success, result)
+            ip_confs = [n for n in os.listdir(output_dir) if n.endswith('_ip.conf')]
+            self.assertEqual(len(ip_confs), 2)
+            self.assertEqual(sorted(ip_confs + ['default.conf'])[-1], 'default.conf', mode)
+
+    def test_subtract_global_domains(self):
+        from app.models.whitelist import GlobalDomainWhitelist
+        db.session.add(GlobalDomainWhitelist(domain='.a.com'))
+        client = Client.query.filter_by(ip_address='10.0.0.2').first()
+        client.allowed_domains = '.b.com\n.x.a.com'
+        db.session.commit()
+        self.app.config['SUBTRACT_GLOBAL_DOMAINS'] = True
+
+        success, result = ConfigurationService.generate_config()
+        self.assertTrue(success, result)
+        self.assertEqual(result['global_redundant'], {'10.0.0.1': 1, '10.0.0.2': 1})
+        url_file = f"10_0_0_2__{client.expiration_date:%Y%m%d}_url.conf"
+        with open(os.path.join(self.app.config['OUTPUT_DIR'], url_file)) as f:
+            self.assertEqual(f.read(), '.b.com')
+
+    def test_write_errors_are_collected_per_file(self):
+        self.app.config['CONFIG_WRITE_WORKERS'] = 4
+        output_dir = self.app.config['OUTPUT_DIR']
+        exp = f"{date.today() + timedelta(days=30):%Y%m%d}"
+        blocked = [f"10_0_0_2__{exp}_url.conf", f"10_0_0_1__{exp}_ip.conf"]
+        for name in blocked:
+            os.makedirs(os.path.join(output_dir, name))
+
+        success, result = ConfigurationService.generate_config()
+        self.assertFalse(success)
+        self.assertIn("Failed to write 2 file(s)", result)
+        self.assertLess(result.index(sorted(blocked)[0]), result.index(sorted(blocked)[1]))
+        self.assertTrue(os.path.isfile(os.path.join(output_dir, f"10_0_0_1__{exp}_url.conf")))
+
+        # Failed files are left out of the manifest and written by the next run
+        for name in blocked:
+            os.rmdir(os.path.join(output_dir, name))
+        success, result = ConfigurationService.generate_config()
+        self.assertTrue(success, result)
+        self.assertEqual(result['changes']['added'], sorted(blocked))
+
+    def test_benchmark_writes_leaves_output_untouched(self):
+        success, result = ConfigurationService.benchmark_writes(worker_counts=(1, 2))
+        self.assertTrue(success, result)
+        self.assertEqual(result['files'], 8)
+        self.assertEqual([run['workers'] for run in result['runs']], [1, 2])
+        self.assertEqual(os.listdir(self.app.config['OUTPUT_DIR']), [])
+
+class TestStagedValidation(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write(self, path, content):
+        path = os.path.join(self.tmp_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_linter_reports_context_errors_in_one_pass(self):
+        from app.services.validation import build_validation_sandbox, lint_squid_config
+        self.write('domains/a_url.conf', '.a.com\n')
+        self.write('conf.d/a_ip.conf',
+                   'acl client_a src 10.0.0.1\n'
+                   'acl sites_a dstdomain "/etc/squid/domains/a_url.conf"\n'
+                   'http_access allow client_a CONNECT sites_a\n')
+        self.write('conf.d/b_ip.conf',
+                   'acl client_a src 10.0.0.2\n'
+                   'acl sites_b dstdomain "/etc/squid/domains/b_url.conf"\n'
+                   'http_access allow client_b sites_b\n')
+        sandbox = os.path.join(self.tmp_dir, 'sandbox')
+        os.makedirs(sandbox)
+        squid_conf = build_validation_sandbox(
+            sandbox, os.path.join(self.tmp_dir, 'conf.d'), os.path.join(self.tmp_dir, 'domains'),
+            {'/etc/squid/domains': os.path.join(self.tmp_dir, 'domains')})
+
+        errors = lint_squid_config(squid_conf)
+        self.assertEqual(len(errors), 3, errors)
+        self.assertIn("duplicate ACL 'client_a'", errors[0])
+        self.assertIn("b_url.conf", errors[1])
+        self.assertIn("ACL 'client_b' used before it is defined", errors[2])
+
+    def test_failed_parse_leaves_live_config_untouched(self):
+        squid = self.write('bin/squid', '#!/bin/sh\necho "FATAL: Bungled squid.conf line 3"\nexit 1\n')
+        os.chmod(squid, 0o755)
+        app = make_app(self.tmp_dir)
+        app.config['SQUID_BINARY'] = squid
+        with app.app_context():
+            db.create_all()
+            db.session.add(Client(ip_address='10.0.0.1', expiration_date=date.today(), allowed_domains='.a.com'))
+            db.session.commit()
+            ConfigurationService.generate_config()
+            success, msg = ConfigurationService.apply_config()
+            db.session.remove()
+        self.assertFalse(success)
+        self.assertIn("squid -k parse", msg)
+        self.assertIn("FATAL: Bungled", msg)
+        self.assertFalse(os.path.exists(app.config['SQUID_CONF_DIR']))
+        releases = os.path.join(self.tmp_dir, 'squid', '.conf.d.releases')
+        self.assertEqual(os.listdir(releases), [])
+
+
+class TestLogSearch(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.tmp_dir, 'access.log')
+        lines = []
+        for i in range(200):
+            client = '10.0.0.1' if i % 2 else '10.0.1.7'
+            if i % 10 == 0:
+                lines.append(f"{1000 + i}.000 3 {client} TCP_DENIED/403 0 CONNECT blocked.com:443 - HIER_NONE/- -")
+            else:
+                lines.append(f"{1000 + i}.000 3 {client} TCP_MISS/200 10 GET http://www.site{i}.example.com/x - HIER_DIRECT/1.1.1.1 text/html")
+        with open(self.log_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        self.app = Flask(__name__)
+        self.app.config['SQUID_ACCESS_LOG'] = self.log_path
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.ctx.pop()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_reverse_lines_across_blocks(self):
+        from app.services.log_service import reverse_lines
+        with open(self.log_path) as f:
+            expected = f.read().splitlines()[::-1]
+        self.assertEqual(list(reverse_lines(self.log_path, block_size=37)), expected)
+
+    def test_field_filters_stop_at_limit(self):
+        from app.services.log_service import LogFilter, LogService
+        lines, info = LogService.search(LogFilter(status='DENIED', client='10.0.1.0/24'), limit=3)
+        self.assertEqual([line.split()[0] for line in lines], ['1190.000', '1180.000', '1170.000'])
+        self.assertLess(info['scanned'], 40)
+
+        lines, _ = LogService.search(LogFilter(domain='example.com', method='get', since=1195), limit=50)
+        self.assertEqual(len(lines), 5)  # 1195..1199
+        lines, _ = LogService.search(LogFilter(domain='xample.com'), limit=50)
+        self.assertEqual(lines, [])
+
+    def test_tail_from_cursor(self):
+        from app.services.log_service import LogFilter, LogService
+        with open(self.log_path, 'a') as f:
+            f.write("1300.000 3 10.0.0.9 TCP_MISS/200 10 GET http://a.com/ - HIER_DIRECT/1.1.1.1 -\n1301.000 3 10.0")
+        cursor = LogService.log_cursor()
+        self.assertEqual(cursor['offset'], os.path.getsize(self.log_path) - len("1301.000 3 10.0"))
+        lines, _ = LogService.search(LogFilter(), limit=1, end=cursor['offset'])
+        self.assertTrue(lines[0].startswith('1300.000'))
+
+        with open(self.log_path, 'a') as f:
+            f.write(".9 TCP_DENIED/403 0 CONNECT b.com:443 - HIER_NONE/- -\n")
+        res = LogService.tail(cursor['inode'], cursor['offset'], LogFilter(status='DENIED'))
+        self.assertFalse(res['reset'])
+        self.assertEqual([(e['timestamp'], e['host']) for e in res['entries']], [(1301.0, 'b.com')])
+        self.assertEqual(res['offset'], os.path.getsize(self.log_path))
+        self.assertEqual(LogService.tail(res['inode'], res['offset'], LogFilter())['entries'], [])
+
+        # Rotation: a new file under the same name starts again from the top
+        os.remove(self.log_path)
+        with open(self.log_path, 'w') as f:
+            f.write("1400.000 3 10.0.0.9 TCP_MISS/200 10 GET http://c.com/ - HIER_DIRECT/1.1.1.1 -\n")
+        res = LogService.tail(res['inode'], res['offset'], LogFilter())
+        self.assertTrue(res['reset'])
+        self.assertEqual([e['host'] for e in res['entries']], ['c.com'])
+
+    def test_time_range_bisect(self):
+        from app.services.log_service import LogFilter, LogService, seek_time
+        with open(self.log_path, 'a') as f:
+            f.write("garbage line\n1200.000 3 10.0.0.9 TCP_MISS/200 10 GET http://a.com/ - HIER_DIRECT/1.1.1.1 -\n1201.0")
+        with open(self.log_path, 'rb') as f:
+            data = f.read()
+        starts = [0] + [i + 1 for i, byte in enumerate(data) if byte == ord('\n')][:-1]
+        self.assertEqual(seek_time(self.log_path, 0), 0)
+        self.assertEqual(seek_time(self.log_path, 1000), 0)
+        self.assertEqual(seek_time(self.log_path, 1000, after=True), starts[1])
+        self.assertEqual(seek_time(self.log_path, 1099.5), starts[100])
+        self.assertEqual(seek_time(self.log_path, 1200), starts[201])  # past the garbage line
+        self.assertEqual(seek_time(self.log_path, 5000), len(data) - len('1201.0'))  # not into the partial line
+
+        window = [e.timestamp for e in LogService.read_window(1050, 1054.5)]
+        self.assertEqual(window, [1050.0, 1051.0, 1052.0, 1053.0, 1054.0])
+        # Unparsable lines are skipped and the line still being written is left out
+        self.assertEqual([e.host for e in LogService.read_window(1199)], ['www.site199.example.com', 'a.com'])
+
+        # Newest-first search starts at the end of the window instead of the end of the file
+        lines, info = LogService.search(LogFilter(since=1100, until=1102.5), limit=50)
+        self.assertEqual([line.split()[0] for line in lines], ['1102.000', '1101.000', '1100.000'])
+        self.assertLessEqual(info['scanned'], 4)
+
+
+class TestLogStore(unittest.TestCase):
+    def setUp(self):
+        from app.services.log_store import LogStore
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.tmp_dir, 'access.log')
+        self.now = time.time()
+        self.write([self.line(-3600, '10.30.1.5', 'TCP_MISS/200', 'GET', 'http://www.foo.com/a'),
+                    self.line(-1800, '10.30.2.9', 'TCP_DENIED/403', 'CONNECT', 'foo.com:443'),
+                    self.line(-60, '10.0.0.1', 'TCP_TUNNEL/200', 'CONNECT', 'barfoo.com:443')])
+        self.app = Flask(__name__)
+        self.app.config.update(SQUID_ACCESS_LOG=self.log_path, LOG_STORE_ENABLED=True,
+                               LOG_STORE_PATH=os.path.join(self.tmp_dir, 'store.db'))
+        self.store = LogStore()
+        self.store.init_app(self.app)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def line(self, age, client, code, method, url):
+        return f"{self.now + age:.3f} 5 {client} {code} 100 {method} {url} - HIER_DIRECT/1.1.1.1 -"
+
+    def write(self, lines, path=None):
+        with open(path or self.log_path, 'a') as f:
+            f.write(''.join(line + '\n' for line in lines))
+
+    def clients(self, **filters):
+        from app.services.log_service import LogFilter
+        lines, _ = self.store.search(LogFilter(**filters))
+        return [line.split()[2] for line in lines]
+
+    def test_indexed_queries(self):
+        self.assertFalse(self.store.usable())
+        self.assertEqual(self.store.ingest(), 3)
+        self.assertTrue(self.store.usable())
+        self.assertEqual(self.clients(), ['10.0.0.1', '10.30.2.9', '10.30.1.5'])
+        self.assertEqual(self.clients(client='10.30.0.0/16'), ['10.30.2.9', '10.30.1.5'])
+        self.assertEqual(self.clients(domain='foo.com'), ['10.30.2.9', '10.30.1.5'])
+        self.assertEqual(self.clients(status='DENIED'), ['10.30.2.9'])
+        self.assertEqual(self.clients(result='tunnel', since=self.now - 120), ['10.0.0.1'])
+        from app.services.log_service import LogFilter
+        _, cursor = self.store.search(LogFilter())
+        self.assertEqual(cursor['offset'], os.path.getsize(self.log_path))
+
+    def test_resume_rotation_and_retention(self):
+        from app.services.log_store import LogStore
+        self.store.ingest()
+        self.write([self.line(-30, '10.0.0.2', 'TCP_MISS/200', 'GET', 'http://a.com/')])
+        restarted = LogStore()
+        restarted.init_app(self.app)
+        self.assertEqual(restarted.ingest(), 1)  # only the new line, not the whole file again
+
+        # Lines written just before squid -k rotate are read from access.log.0
+        self.write([self.line(-20, '10.0.0.3', 'TCP_MISS/200', 'GET', 'http://b.com/')])
+        os.rename(self.log_path, self.log_path + '.0')
+        self.write([self.line(-10, '10.0.0.4', 'TCP_MISS/200', 'GET', 'http://c.com/')])
+        self.assertEqual(restarted.ingest(), 2)
+        self.assertEqual(self.clients()[:3], ['10.0.0.4', '10.0.0.3', '10.0.0.2'])
+
+        self.app.config['LOG_STORE_RETENTION_DAYS'] = 0
+        restarted.ingest()
+        self.assertEqual(self.clients(), [])
+
+    def test_concurrent_ingesters_store_each_line_once(self):
+        from unittest import mock
+        from app.services.log_service import LogService
+        from app.services.log_store import LogStore
+        other = LogStore()
+        other.init_app(self.app)
+        read_appended = LogService.read_appended
+        worker = threading.Thread(target=other.ingest)
+
+        def racing_read(*args, **kwargs):
+            # A second process ingests while this batch is being read
+            if not worker.is_alive() and worker.ident is None:
+                worker.start()
+                worker.join(0.5)
+            return read_appended(*args, **kwargs)
+
+        with mock.patch.object(LogService, 'read_appended', side_effect=racing_read):
+            self.store.ingest()
+        worker.join(5)
+        self.assertEqual(len(self.clients()), 3)
+
+    def test_overlong_line_is_skipped(self):
+        self.app.config['LOG_INGEST_BATCH_BYTES'] = 256
+        self.store.ingest()
+        self.write(['x' * 1000, self.line(-30, '10.0.0.2', 'TCP_MISS/200', 'GET', 'http://a.com/')])
+        self.assertEqual(self.store.ingest(), 1)
+        self.assertEqual(self.store.cursor()['offset'], os.path.getsize(self.log_path))
+
+        # Same on the rotated file: its remaining lines are not dropped
+        self.write(['y' * 1000, self.line(-20, '10.0.0.3', 'TCP_MISS/200', 'GET', 'http://b.com/')])
+        os.rename(self.log_path, self.log_path + '.0')
+        self.write([self.line(-10, '10.0.0.4', 'TCP_MISS/200', 'GET', 'http://c.com/')])
+        self.assertEqual(self.store.ingest(), 2)
+        self.assertEqual(self.clients()[:3], ['10.0.0.4', '10.0.0.3', '10.0.0.2'])
+
+    def test_hourly_client_rollups(self):
+        import ipaddress
+        from app.services.traffic_rollup import TrafficRollup
+        rollup = TrafficRollup(self.store)
+        self.store.register(rollup)
+        self.store.ingest(max_batches=1)
+        self.write([self.line(-30, '10.30.1.5', 'TCP_DENIED/403', 'CONNECT', 'foo.com:443'),
+                    self.line(-20, '10.30.1.5', 'TCP_MISS/200', 'GET', 'http://www.foo.com/b')])
+        self.store.ingest()
+
+        usage = rollup.usage_by_client(hours=24)
+        self.assertEqual(usage['10.30.1.5'], {'requests': 3, 'bytes': 300, 'denied': 1, 'domains': 2})
+        self.assertEqual(usage['10.30.2.9']['denied'], 1)
+        network = rollup.usage_for_network(ipaddress.ip_network('10.30.0.0/16'), usage)
+        self.assertEqual((network['requests'], network['domains']), (4, 2))
+
+        series = rollup.series('10.30.1.5', hours=3)
+        self.assertEqual(len(series['labels']), 3)
+        self.assertEqual(sum(series['requests']), 3)
+        self.assertEqual(sum(rollup.series('10.30.0.0/16', hours=3)['denied']), 2)
+
+    def test_heavy_hitters(self):
+        from app.services.heavy_hitters import HeavyHitters, SpaceSaving
+        summary = SpaceSaving(capacity=2)
+        for key in 'aaaabbc':
+            summary.offer(key)
+        self.assertEqual(summary.counts, {'a': 4, 'c': 3})
+        self.assertEqual(summary.errors, {'c': 2})
+
+        self.app.config['HEAVY_HITTERS_CAPACITY'] = 10
+        hitters = HeavyHitters(self.store)
+        self.store.register(hitters)
+        self.write([self.line(-30, '10.30.1.5', 'TCP_DENIED/403', 'CONNECT', 'foo.com:443')])
+        self.store.ingest()
+        self.assertEqual(hitters.top('denied', '24h'), [{'key': 'foo.com', 'count': 2, 'min_count': 2}])
+        self.assertEqual(hitters.top('domains', '1h', n=1)[0]['key'], 'foo.com')
+        self.assertEqual(len(hitters.top('pairs', '7d')), 4)
+        # Windows survive a restart: a fresh instance reloads the bucket summaries
+        self.assertEqual(HeavyHitters(self.store).top('denied', '24h')[0]['count'], 2)
+
+        # A second ingesting process adds to the stored buckets instead of overwriting them
+        from app.services.log_store import LogStore
+        other = LogStore()
+        other.init_app(self.app)
+        other.register(HeavyHitters(other))
+        self.write([self.line(-20, '10.30.1.5', 'TCP_DENIED/403', 'CONNECT', 'foo.com:443')])
+        other.ingest()
+        self.write([self.line(-10, '10.30.1.5', 'TCP_DENIED/403', 'CONNECT', 'foo.com:443')])
+        self.store.ingest()
+        self.assertEqual(hitters.top('denied', '24h')[0]['count'], 4)
+        with self.assertRaises(ValueError):
+            hitters.top('denied', '30d')
+
+    def test_whitelist_suggestions(self):
+        from app.services.whitelist_suggestions import DeniedTraffic, suggested_entry
+        from app.utils import DomainSuffixTrie, PublicSuffixList
+        self.assertEqual(suggested_entry('login.live.com'), '.login.live.com')
+        self.assertEqual(suggested_entry('10.1.1.1'), '10.1.1.1')
+        psl = PublicSuffixList(['// comment', 'com', 'uk', 'co.uk', 'amazonaws.com', 's3.amazonaws.com',
+                                '*.ck', '!www.ck'])
+        self.assertEqual(psl.registrable_domain('www.gov.co.uk'), 'gov.co.uk')
+        self.assertEqual(psl.registrable_domain('mybucket.s3.amazonaws.com'), 'mybucket.s3.amazonaws.com')
+        self.assertEqual(psl.registrable_domain('a.b.foo.ck'), 'b.foo.ck')
+        self.assertEqual(psl.registrable_domain('a.www.ck'), 'www.ck')
+        self.assertIsNone(psl.registrable_domain('co.uk'))
+
+        denied = DeniedTraffic(self.store)
+        self.store.register(denied)
+        self.write([self.line(-30, '10.30.2.9', 'TCP_DENIED/403', 'CONNECT', 'login.live.com:443'),
+                    self.line(-20, '10.30.2.9', 'TCP_DENIED/403', 'GET', 'http://a.live.com/'),
+                    self.line(-15, '10.30.2.9', 'TCP_DENIED/403', 'GET', 'http://one.s3.amazonaws.com/'),
+                    self.line(-12, '10.30.2.9', 'TCP_DENIED/403', 'GET', 'http://two.s3.amazonaws.com/'),
+                    self.line(-10, '10.30.2.9', 'TCP_DENIED/403', 'CONNECT', 'foo.com:443'),
+                    self.line(-5, '10.30.2.9', 'TCP_MISS/403', 'GET', 'http://origin.net/')])
+        self.store.ingest()
+        self.assertEqual([h[:2] for h in denied.denied_hosts('10.30.2.9')],
+                         [('foo.com', 2), ('a.live.com', 1), ('login.live.com', 1),
+                          ('one.s3.amazonaws.com', 1), ('two.s3.amazonaws.com', 1)])
+        self.assertEqual(len(denied.denied_hosts('10.30.0.0/16')), 5)
+
+        templates = {'Microsoft': DomainSuffixTrie(['.live.com', '.microsoft.com']),
+                     'Other': DomainSuffixTrie(['.example.com'])}
+        result = denied.suggestions('10.30.2.9', ['.foo.com'], templates)
+        self.assertEqual([d['entry'] for d in result['domains']],
+                         ['.a.live.com', '.login.live.com', '.one.s3.amazonaws.com', '.two.s3.amazonaws.com'])
+        self.assertEqual(result['parents'], [])  # no public suffix list, nothing is collapsed
+        self.assertEqual(result['templates'],
+                         [{'name': 'Microsoft', 'hosts': ['a.live.com', 'login.live.com'], 'hits': 2}])
+
+        result = denied.suggestions('10.30.2.9', ['.foo.com'], {}, public_suffixes=psl)
+        self.assertEqual([(p['entry'], p['hosts'], p['hits']) for p in result['parents']],
+                         [('.live.com', ['a.live.com', 'login.live.com'], 2)])
+        result = denied.suggestions('10.30.2.9', [], {}, global_trie=DomainSuffixTrie(['.live.com']))
+        self.assertEqual(result['domains'][0]['entry'], '.foo.com')
+        self.assertNotIn('.login.live.com', [d['entry'] for d in result['domains']])
+
+    def test_stale_allowlist_entries(self):
+        from app.models.whitelist import GlobalDomainWhitelist
+        from app.services.allowlist_usage import AllowlistUsage
+        from app.services.client_service import ClientService
+        from app.services.log_store import LogStore
+        app = make_app(self.tmp_dir)
+        app.config.update(SQUID_ACCESS_LOG=self.log_path, LOG_STORE_PATH=os.path.join(self.tmp_dir, 'store.db'))
+        store = LogStore()
+        store.init_app(app)
+        usage = AllowlistUsage(store)
+        store.register(usage)
+        with app.app_context():
+            db.create_all()
+            future, added = date.today() + timedelta(days=30), datetime(2020, 1, 1)
+            db.session.add_all([
+                Client(ip_address='10.30.1.5', expiration_date=future, date_added=added,
+                       allowed_domains='.foo.com\n.unused.com'),
+                Client(ip_address='10.0.0.0/24', expiration_date=future, date_added=added,
+                       allowed_domains='.barfoo.com'),
+                GlobalDomainWhitelist(domain='.barfoo.com', date_added=added),
+                GlobalDomainWhitelist(domain='.old.org', date_added=added),
+            ])
+            db.session.commit()
+            store.ingest()
+
+            report = usage.stale_report(days=0.5 / 24, now=self.now)  # nothing since 30 minutes ago
+            self.assertTrue(report['complete'])
+            self.assertEqual([(c['ip_address'], [(e['entry'], e['hits']) for e in c['entries']])
+                              for c in report['clients']], [('10.30.1.5', [('.foo.com', 1), ('.unused.com', 0)])])
+            self.assertEqual([g['domain'] for g in report['global']], ['.old.org'])
+            self.assertFalse(usage.stale_report(days=1, now=self.now)['complete'])
+
+            success, removed = ClientService.remove_allowed_domains({report['clients'][0]['id']: ['.unused.com']})
+            self.assertTrue(success)
+            self.assertEqual(removed, {'10.30.1.5': ['.unused.com']})
+            self.assertEqual(Client.query.filter_by(ip_address='10.30.1.5').one().allowed_domains, '.foo.com')
+            db.session.remove()
+            db.drop_all()
+
+
+class TestLiveStream(unittest.TestCase):
+    def test_subscription_drops_oldest(self):
+        from app.services.live_stream import Subscription
+        sub = Subscription(maxlen=3)
+        for i in range(5):
+            sub.put(('n', i))
+        self.assertEqual(sub.drain(0), ([('n', 2), ('n', 3), ('n', 4)], 2))
+        self.assertEqual(sub.drain(0), ([], 0))
+
+    def test_one_producer_fans_out(self):
+        from app.services.live_stream import Broadcaster
+
+        class Counter(Broadcaster):
+            name = 'counter'
+            interval_key = 'INTERVAL'
+            steps = 0
+
+            def step(self, state):
+                Counter.steps += 1
+                return [('tick', (state or 0) + 1)], (state or 0) + 1
+
+        app = Flask(__name__)
+        app.config.update(INTERVAL=0.01, STREAM_QUEUE_SIZE=1000)
+        stream = Counter()
+        stream.init_app(app)
+        first, _ = stream.subscribe()
+        second, _ = stream.subscribe()
+        time.sleep(0.1)
+        stream.unsubscribe(first)
+        stream.unsubscribe(second)
+        time.sleep(0.05)
+        a, _ = first.drain(0)
+        b, _ = second.drain(0)
+        self.assertTrue(b)
+        # Both subscribers see the same events from one producer
+        self.assertEqual(a[-len(b):], b)
+        self.assertEqual(len(a), Counter.steps)
+        self.assertEqual(stream.subscriber_count, 0)
+        self.assertIsNone(stream._thread)  # producer stops without subscribers
+
+        app.config['STREAM_MAX_SUBSCRIBERS'] = 1
+        first, _ = stream.subscribe()
+        self.assertEqual(stream.subscribe(), (None, None))
+        stream.unsubscribe(first)
+        second, _ = stream.subscribe()
+        self.assertIsNotNone(second)
+        stream.unsubscribe(second)
+
+    def test_log_stream_catch_up_cursor(self):
+        from app.services.live_stream import LogTailBroadcaster
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        log_path = os.path.join(tmp_dir, 'access.log')
+        with open(log_path, 'w') as f:
+            f.write("1000.000 3 10.0.0.1 TCP_MISS/200 10 GET http://a.com/ - HIER_DIRECT/1.1.1.1 -\n")
+        app = Flask(__name__)
+        app.config.update(SQUID_ACCESS_LOG=log_path, STREAM_LOG_POLL_SECONDS=60)
+        stream = LogTailBroadcaster()
+        stream.init_app(app)
+        with app.app_context():
+            sub, cursor = stream.subscribe(poll_first=True)
+            self.addCleanup(stream.unsubscribe, sub)
+            self.assertEqual(cursor['offset'], os.path.getsize(log_path))
+            with open(log_path, 'a') as f:
+                f.write("1001.000 3 10.0.0.2 TCP_DENIED/403 0 CONNECT b.com:443 - HIER_NONE/- -\n")
+            stream._poll_locked()
+        events, _ = sub.drain(1)
+        self.assertEqual([e['host'] for _, data in events for e in data['entries']], ['b.com'])
+
+
+class TestWhitelistImport(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.app = make_app(self.tmp_dir)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_exact_entries_stay_exact(self):
+        from app.models.whitelist import GlobalDomainWhitelist
+        from app.services.whitelist_service import WhitelistService
+        self.assertTrue(WhitelistService.add_domain({'domain': 'example.com'})[0])
+        added, dropped = WhitelistService.import_domains(
+            ['example.com # again', 'exact.org # kept exact', '.wide.net', 'a.wide.net'])
+        self.assertEqual(added, 2)
+        self.assertEqual(sorted(d.domain for d in GlobalDomainWhitelist.query),
+                         ['.wide.net', 'exact.org', 'example.com'])
+        self.assertEqual(dict(dropped), {'example.com': 'already exists', 'a.wide.net': 'covered by .wide.net'})
+
+
+class FakeScheduler:
+    """Records date jobs the way APScheduler's add_job/get_job/remove_job would."""
+    def __init__(self):
+        self.jobs = {}
+
+    def add_job(self, id, func, trigger, run_date, **kwargs):
+        self.jobs[id] = run_date
+
+    def get_job(self, id):
+        # next_run_time=None makes the service always re-add the job
+        return type('Job', (), {'next_run_time': None})() if id in self.jobs else None
+
+    def remove_job(self, id):
+        del self.jobs[id]
+
+
+class TestExpiryScheduler(unittest.TestCase):
+    def setUp(self):
+        from app.services.expiry_scheduler import ExpiryScheduler, JOB_ID
+        self.job_id = JOB_ID
+        self.tmp_dir = tempfile.mkdtemp()
+        self.app = make_app(self.tmp_dir)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.today = date.today()
+        db.session.add_all([
+            Client(ip_address='10.0.0.1', expiration_date=self.today + timedelta(days=5)),
+            Client(ip_address='10.0.0.2', expiration_date=self.today + timedelta(days=2)),
+            Client(ip_address='10.0.0.3', expiration_date=self.today - timedelta(days=1)),
+        ])
+        db.session.commit()
+        self.scheduler = FakeScheduler()
+        self.expiry = ExpiryScheduler()
+        self.expiry.init_app(self.app, self.scheduler)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def run_date(self, days):
+        return datetime.combine(self.today + timedelta(days=days + 1), datetime.min.time())
+
+    def test_job_scheduled_at_midnight_after_earliest_expiry(self):
+        self.assertEqual(self.scheduler.jobs[self.job_id], self.run_date(2))
+
+    def test_edits_and_deletes_move_the_job(self):
+        self.expiry.client_changed(self.today + timedelta(days=2), self.today + timedelta(days=9))
+        self.assertEqual(self.scheduler.jobs[self.job_id], self.run_date(5))
+        self.expiry.client_changed(new_date=self.today)
+        self.assertEqual(self.scheduler.jobs[self.job_id], self.run_date(0))
+        for days in (0, 5, 9):
+            self.expiry.client_changed(old_date=self.today + timedelta(days=days))
+        self.assertNotIn(self.job_id, self.scheduler.jobs)
+        self.assertIsNone(self.expiry.next_expiry())
+
+    def test_expiry_missed_while_down_regenerates_on_startup(self):
+        from app.services.configuration_service import APPLIED_MANIFEST_FILE
+        catch_up = f"{self.job_id}_catch_up"
+        self.assertNotIn(catch_up, self.scheduler.jobs)  # nothing applied yet
+        output_dir = self.app.config['OUTPUT_DIR']
+        os.makedirs(output_dir)
+        applied = os.path.join(output_dir, APPLIED_MANIFEST_FILE)
+        with open(applied, 'w') as f:
+            f.write('{}')
+        self.expiry.rebuild(catch_up=True)
+        self.assertNotIn(catch_up, self.scheduler.jobs)  # applied after 10.0.0.3 expired
+
+        two_days_ago = time.time() - 2 * 86400
+        os.utime(applied, (two_days_ago, two_days_ago))
+        self.expiry.rebuild(catch_up=True)
+        self.assertIn(catch_up, self.scheduler.jobs)
+
+class TestChangeDebouncer(unittest.TestCase):
+    def setUp(self):
+        from app.services.change_debouncer import ChangeDebouncer, JOB_ID
+        self.job_id = JOB_ID
+        self.app = Flask(__name__)
+        self.app.config.update(AUTO_APPLY_ON_CHANGE=True, AUTO_APPLY_QUIET_SECONDS=30,
+                               AUTO_APPLY_MAX_DELAY_SECONDS=300)
+        self.scheduler = FakeScheduler()
+        self.debouncer = ChangeDebouncer()
+        self.debouncer.init_app(self.app, self.scheduler)
+
+    def test_burst_is_coalesced_and_capped_by_max_delay(self):
+        start = datetime(2024, 1, 1, 12, 0, 0)
+        for i in range(20):
+            self.debouncer.mark_dirty('client', now=start + timedelta(seconds=20 * i))
+        # Each edit pushes the run out by the quiet period until the max delay caps it
+        self.assertEqual(self.scheduler.jobs[self.job_id], start + timedelta(seconds=300))
+        self.assertEqual(self.debouncer.pending()['changes'], {'client': 20})
+
+    def test_disabled_by_default(self):
+        self.app.config['AUTO_APPLY_ON_CHANGE'] = False
+        self.debouncer.mark_dirty('client')
+        self.assertEqual(self.scheduler.jobs, {})
+        self.assertIsNone(self.debouncer.pending())
+
+    def test_pipeline_is_single_flight(self):
+        import fcntl
+        from app.services.configuration_service import PIPELINE_BUSY, PIPELINE_LOCK_FILE
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, True)
+        self.app.config['OUTPUT_DIR'] = tmp_dir
+        with self.app.app_context():
+            with ConfigurationService.single_flight() as acquired:
+                self.assertTrue(acquired)
+                self.assertEqual(ConfigurationService.generate_apply_reload(), (False, PIPELINE_BUSY))
+
+            # Another process holding the file lock (a separate open file behaves the same)
+            with open(os.path.join(tmp_dir, PIPELINE_LOCK_FILE), 'a') as other:
+                fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                with ConfigurationService.single_flight() as acquired:
+                    self.assertFalse(acquired)
+            with ConfigurationService.single_flight() as acquired:
+                self.assertTrue(acquired)
+
+class TestJobService(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.original = ConfigurationService.generate_apply_reload
+        self.release = threading.Event()
+
+        def fake_pipeline(force=False, progress=None):
+            self.release.wait(5)
+            for stage in ('generate', 'apply', 'reload'):
+                progress(stage, None)
+                progress(stage, stage != 'reload')
+            return False, "Reload failed: boom"
+        ConfigurationService.generate_apply_reload = staticmethod(fake_pipeline)
+
+    def tearDown(self):
+        self.release.set()
+        ConfigurationService.generate_apply_reload = self.original
+
+    def wait_for(self, job):
+        for _ in range(100):
+            if job.done:
+                return
+            time.sleep(0.05)
+        self.fail("job did not finish")
+
+    def test_running_job_is_reused_and_reports_stages(self):
+        from app.services.job_service import JobService
+        job, created = JobService.submit_apply(self.app)
+        again, created_again = JobService.submit_apply(self.app)
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertIs(again, job)
+
+        self.release.set()
+        self.wait_for(job)
+        data = JobService.get_job(job.id).to_dict()
+        self.assertEqual(data['status'], 'failed')
+        self.assertEqual(data['error'], "Reload failed: boom")
+        self.assertEqual([st['status'] for st in data['stages']], ['succeeded', 'succeeded', 'failed'])
+        self.assertTrue(all(st['seconds'] is not None for st in data['stages']))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,56 @@
+import unittest
+from app.utils import normalize_domains, validate_allowed_domains, DomainSuffixTrie, aggregate_networks
+
+
+class TestDomainSuffixTrie(unittest.TestCase):
+    def test_wildcard_covers_domain_and_subdomains(self):
+        trie = DomainSuffixTrie(['.example.com', 'exact.org'])
+        self.assertEqual(trie.find_cover('example.com'), '.example.com')
+        self.assertEqual(trie.find_cover('a.b.example.com'), '.example.com')
+        self.assertEqual(trie.find_cover('.x.example.com'), '.example.com')
+        self.assertIsNone(trie.find_cover('badexample.com'))
+
+    def test_exact_entry_covers_only_itself(self):
+        trie = DomainSuffixTrie(['exact.org'])
+        self.assertIn('exact.org', trie)
+        self.assertNotIn('a.exact.org', trie)
+        self.assertNotIn('.exact.org', trie)
+
+
+class TestNormalizeDomains(unittest.TestCase):
+    def test_removes_duplicates_and_covered_subdomains(self):
+        result = normalize_domains("a.example.com\nexample.com\n.example.com\n10.0.0.1\nlocalhost\n.other.net")
+        self.assertEqual(result.domains, ['.example.com', '10.0.0.1', 'localhost', '.other.net'])
+        reasons = dict(result.dropped)
+        self.assertEqual(reasons['a.example.com'], 'covered by .example.com')
+        self.assertEqual(reasons['.example.com'], 'duplicate')
+
+    def test_invalid_entries(self):
+        result = normalize_domains(['ok.com', 'not a domain'])
+        self.assertEqual(result.domains, ['.ok.com'])
+        self.assertEqual(result.dropped, [('not a domain', 'invalid')])
+        with self.assertRaises(ValueError):
+            validate_allowed_domains('ok.com\nnot a domain')
+
+    def test_exact_keeps_plain_domains_exact(self):
+        result = normalize_domains(['example.com', 'a.example.com', '.other.net', 'x.other.net'], exact=True)
+        self.assertEqual(result.domains, ['example.com', 'a.example.com', '.other.net'])
+
+    def test_large_list(self):
+        entries = [f"host{i}.zone{i % 100}.com" for i in range(5000)]
+        entries += [f".zone{i}.com" for i in range(50)]
+        result = normalize_domains(entries)
+        self.assertEqual(len(result.domains), 50 + 2500)
+
+
+class TestAggregateNetworks(unittest.TestCase):
+    def test_collapses_adjacent_and_contained(self):
+        result = aggregate_networks(['10.0.0.0', '10.0.0.1', '10.0.0.2/31', '10.1.0.0/16',
+                                     '10.1.2.3', '2001:db8::1', 'not-an-ip'])
+        self.assertEqual(result.networks, ['10.0.0.0/30', '10.1.0.0/16', '2001:db8::1'])
+        self.assertEqual(result.sources['10.1.0.0/16'], ['10.1.0.0/16', '10.1.2.3'])
+        self.assertEqual(result.unparsed, ['not-an-ip'])
+
+
+if __name__ == '__main__':
+    unittest.main()